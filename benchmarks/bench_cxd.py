@@ -0,0 +1,394 @@
+"""
+Benchmarks of cxd: rendering, parsers and ranges loading.
+
+The inputs are generated in a work directory (once, from a fixed seed, so that they are the same
+on every machine): random, zero-heavy, text-heavy and synthetic PE files of the requested sizes,
+and colors files holding the requested numbers of ranges. Each case runs in its own process,
+whose elapsed time (best of --repeat runs) and peak RSS are recorded.
+
+    python benchmarks/bench_cxd.py --sizes 1K,1M,64M --ranges 0,1K,100K --save baseline.json
+    python benchmarks/bench_cxd.py --sizes 1K,1M,64M --ranges 0,1K,100K --compare baseline.json
+
+xxd and hexdump -C are timed on the same inputs (if they are installed) as a yardstick.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+__author__ = "malware4n6"
+__copyright__ = "malware4n6"
+__license__ = "The Unlicense"
+
+_logger = logging.getLogger(__name__)
+
+
+# the inputs are generated by blocks of this size
+BLOCK_SIZE = 1024 * 1024
+KINDS = ('random', 'zeros', 'text', 'pe')
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+# a case is slower than its baseline if its time grows by more than this ratio, and by more
+# than MIN_DELTA seconds (the shortest cases are noisy)
+DEFAULT_TOLERANCE = 0.2
+MIN_DELTA = 0.01
+COLORS = 'red green yellow blue magenta cyan light_red light_green'.split()
+WORDS = ('the data of a file is dumped in hex with colors for each range of bytes found by the parsers '
+         'kernel32.dll GetProcAddress LoadLibraryA https://example.com/index.html C:\\Windows\\System32 '
+         'error warning 0x1000 user password config value true false null {"key": [1, 2, 3]}').split()
+
+
+def parse_size(text: str) -> int:
+    """Returns the number of bytes (or of ranges) of a text like 64K, 1M, 1G or 1000."""
+    text = text.strip().upper()
+    if text and text[-1] in UNITS:
+        return int(text[:-1]) * UNITS[text[-1]]
+    return int(text)
+
+
+def format_size(size: int) -> str:
+    for unit in 'GMK':
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f'{size // UNITS[unit]}{unit}'
+    return str(size)
+
+
+def _text_block(rnd: random.Random, size: int) -> bytes:
+    # lines of words, with a few binary bytes between them
+    parts = []
+    length = 0
+    while length < size:
+        line = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 12)))
+        line = line.encode() + (b'\n' if rnd.random() < 0.9 else rnd.randbytes(rnd.randint(1, 8)))
+        parts.append(line)
+        length += len(line)
+    return b''.join(parts)[:size]
+
+
+def _zeros_block(rnd: random.Random, size: int) -> bytes:
+    # pages of zeros, with random bytes in one page out of ten
+    block = bytearray(size)
+    for page in range(0, size, 4096):
+        if rnd.random() < 0.1:
+            length = min(rnd.randint(1, 4096), size - page)
+            block[page:page + length] = rnd.randbytes(length)
+    return bytes(block)
+
+
+def _pe_headers(size: int, sections) -> bytes:
+    # headers of a PE32+ whose sections are mapped at their file offset (sections alignment = file alignment)
+    dos_header = b'MZ' + bytes(58) + struct.pack('<I', 0x40)
+    file_header = struct.pack('<HHIIIHH', 0x8664, len(sections), 0, 0, 0, 240, 0x22)
+    rdata = next(s for s in sections if s[0] == b'.rdata')
+    directories = [(0, 0)] * 16
+    directories[1] = (rdata[1], rdata[3])
+    optional_header = struct.pack('<HBBIIIIIQIIHHHHHHIIIIHHQQQQII', 0x20b, 1, 0, 0, 0, 0, 0x1000, 0x1000, 0x140000000,
+                                  0x1000, 0x1000, 6, 0, 0, 0, 6, 0, 0, size, 0x1000, 0, 3, 0, 0x100000, 0x1000,
+                                  0x100000, 0x1000, 0, 16) + b''.join(struct.pack('<II', *d) for d in directories)
+    table = b''.join(struct.pack('<8sIIIIIIHHI', name, length, offset, length, offset, 0, 0, 0, 0, 0x40000040)
+                     for name, offset, length, _ in sections)
+    return (dos_header + b'PE\0\0' + file_header + optional_header + table).ljust(0x1000, b'\0')
+
+
+def _pe_imports(rnd: random.Random, rva: int, functions: int) -> tuple:
+    # import directory of 8 DLLs importing `functions` names in all, laid out at rva.
+    # Returns its data and the size of the descriptors
+    dlls = [[f'Func{i}_{rnd.randrange(1 << 16):04x}'.encode() for i in range(dll, functions, 8)] for dll in range(8)]
+    descriptors_size = 20 * (len(dlls) + 1)
+    thunks_size = sum(8 * (len(names) + 1) for names in dlls)
+    # descriptors, lookup tables, address tables, then the DLLs and hint/name entries
+    names_rva = rva + descriptors_size + 2 * thunks_size
+    descriptors, lookups, names = [], [], []
+    thunks_rva = rva + descriptors_size
+
+    def add_name(name: bytes) -> int:
+        nonlocal names_rva
+        names.append(name)
+        names_rva += len(name)
+        return names_rva - len(name)
+
+    for i, functions_names in enumerate(dlls):
+        dll_rva = add_name(f'lib{i}.dll'.encode() + b'\0')
+        entries = []
+        for name in functions_names:
+            # hint, name, and padding to an even address
+            entries.append(struct.pack('<Q', add_name(struct.pack('<H', 0) + name + b'\0' * (2 - len(name) % 2))))
+        entries.append(bytes(8))
+        descriptors.append(struct.pack('<IIIII', thunks_rva, 0, 0, dll_rva, thunks_rva + thunks_size))
+        lookups.append(b''.join(entries))
+        thunks_rva += 8 * (len(functions_names) + 1)
+    descriptors.append(bytes(20))
+    data = b''.join(descriptors) + b''.join(lookups) * 2 + b''.join(names)
+    return data, descriptors_size
+
+
+def _iter_blocks(kind: str, size: int, seed: int = 0):
+    # yields the blocks of an input, generated from the seed
+    rnd = random.Random(f'{kind}-{seed}')
+    if kind == 'pe':
+        # headers, an import directory (one function per 4 KiB, at most 20000), then code and text sections
+        functions = max(8, min(20000, size // 4096))
+        rdata_offset = 0x1000
+        imports, descriptors_size = _pe_imports(rnd, rdata_offset, functions)
+        rdata_length = -(-len(imports) // 0x1000) * 0x1000
+        text_offset = rdata_offset + rdata_length
+        data_offset = text_offset + max(0, size - text_offset) // 2 // 0x1000 * 0x1000
+        sections = [(b'.rdata', rdata_offset, rdata_length, descriptors_size),
+                    (b'.text', text_offset, data_offset - text_offset, 0),
+                    (b'.data', data_offset, max(0, size - data_offset), 0)]
+        head = _pe_headers(max(size, text_offset), sections) + imports.ljust(rdata_length, b'\0')
+        yield head[:size]
+        position = len(head)
+        while position < size:
+            length = min(BLOCK_SIZE, size - position)
+            yield rnd.randbytes(length) if position < data_offset else _text_block(rnd, length)
+            position += length
+        return
+    generate = {'random': lambda n: rnd.randbytes(n), 'zeros': lambda n: _zeros_block(rnd, n),
+                'text': lambda n: _text_block(rnd, n)}[kind]
+    for position in range(0, size, BLOCK_SIZE):
+        yield generate(min(BLOCK_SIZE, size - position))
+
+
+def generate_input(workdir: Path, kind: str, size: int) -> Path:
+    """Returns the path of the input of this kind and size, generating it if needed."""
+    path = workdir / f'{kind}-{format_size(size)}.bin'
+    if not path.exists() or path.stat().st_size != size:
+        _logger.info(f'Generating {path}')
+        partial = path.with_suffix('.tmp')
+        with partial.open('wb') as fd:
+            for block in _iter_blocks(kind, size):
+                fd.write(block)
+        partial.replace(path)
+    return path
+
+
+def generate_ranges(workdir: Path, count: int, span: int) -> Path:
+    """Returns the path of a colors file of `count` ranges spread over `span` bytes, generating it if needed."""
+    path = workdir / f'ranges-{format_size(count)}-{format_size(span)}.txt'
+    if not path.exists():
+        _logger.info(f'Generating {path}')
+        rnd = random.Random(f'ranges-{count}')
+        step = max(1, span // max(count, 1))
+        partial = path.with_suffix('.tmp')
+        with partial.open('w') as fd:
+            for i in range(count):
+                fd.write(f'{i * step % span},{rnd.randint(1, max(1, min(64, step)))},{COLORS[i % len(COLORS)]},field_{i}\n')
+        partial.replace(path)
+    return path
+
+
+def list_cases(workdir: Path, kinds, sizes, ranges_counts) -> list:
+    """Returns the cases (dicts) of the benchmark, generating their inputs."""
+    cases = []
+    # the ranges are spread over each input
+    ranges_files = {(count, size): generate_ranges(workdir, count, size) if count else None
+                    for count in ranges_counts for size in sizes}
+    for count in ranges_counts:
+        if count:
+            path = ranges_files[count, max(sizes)]
+            cases.append({'name': f'read_colors_ranges ranges={format_size(count)}', 'operation': 'read_colors_ranges',
+                          'input': str(path), 'size': path.stat().st_size})
+    for kind in kinds:
+        for size in sizes:
+            path = str(generate_input(workdir, kind, size))
+            label = f'{kind} {format_size(size)}'
+            for count in ranges_counts:
+                ranges = ranges_files[count, size]
+                for operation in ('print', 'print_file'):
+                    cases.append({'name': f'{operation}[ansi] {label} ranges={format_size(count)}',
+                                  'operation': operation, 'output_format': 'ansi', 'input': path,
+                                  'ranges': None if ranges is None else str(ranges), 'size': size})
+            cases.append({'name': f'print_file[plain] {label}', 'operation': 'print_file', 'output_format': 'plain',
+                          'input': path, 'ranges': None, 'size': size})
+            if kind == 'pe':
+                cases.append({'name': f'PeColorer.parse {label}', 'operation': 'pe', 'input': path, 'size': size})
+            if kind in ('text', 'pe'):
+                cases.append({'name': f'StringsColorer.parse {label}', 'operation': 'strings', 'input': path, 'size': size})
+            for tool in (['xxd'], ['hexdump', '-C']):
+                if shutil.which(tool[0]):
+                    cases.append({'name': f'{" ".join(tool)} {label}', 'operation': 'command', 'command': tool + [path],
+                                  'size': size})
+    return cases
+
+
+def _peak_rss_kb(children: bool = False) -> int:
+    # peak RSS of this process (or of its terminated children)
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def run_case(case: dict) -> dict:
+    """Runs a case in this process: returns its elapsed time (in seconds) and the peak RSS of the process."""
+    operation = case['operation']
+    if operation == 'command':
+        start = time.perf_counter()
+        subprocess.run(case['command'], stdout=subprocess.DEVNULL, check=True)
+        return {'seconds': time.perf_counter() - start, 'rss_kb': _peak_rss_kb(children=True)}
+
+    from cxd.colored_hex_dump import ColoredHexDump
+    from cxd.colors_file import read_colors_ranges
+    ranges = read_colors_ranges(case['ranges']) if case.get('ranges') else None
+    data = Path(case['input']).read_bytes() if operation == 'print' else None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        if operation == 'read_colors_ranges':
+            read_colors_ranges(case['input'])
+        elif operation in ('print', 'print_file'):
+            cxd = ColoredHexDump(ranges, output_format=case['output_format'])
+            if operation == 'print':
+                cxd.print(data)
+            else:
+                cxd.print_file(case['input'])
+        elif operation == 'pe':
+            from cxd.parsers.parser_pe import PeColorer
+            colorer = PeColorer(case['input'], COLORS)
+            if not colorer.check():
+                raise ValueError(f'{case["input"]} is not a PE')
+            colorer.parse()
+        elif operation == 'strings':
+            from cxd.parsers.parser_strings import StringsColorer
+            StringsColorer(case['input'], COLORS).parse()
+        else:
+            raise ValueError(f'Unknown operation {operation}')
+        seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'rss_kb': _peak_rss_kb()}
+
+
+def measure(case: dict, repeat: int) -> dict:
+    """Runs a case `repeat` times, each time in a new process: returns the best time, its throughput
+    and the largest peak RSS."""
+    results = []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, __file__, '--run-case', json.dumps(case)],
+                                 capture_output=True, text=True)
+        if process.returncode:
+            _logger.error(f'{case["name"]} failed: {process.stderr.strip()}')
+            return None
+        results.append(json.loads(process.stdout.splitlines()[-1]))
+    seconds = min(result['seconds'] for result in results)
+    rss = [result['rss_kb'] for result in results if result['rss_kb'] is not None]
+    return {'seconds': seconds, 'mb_s': case['size'] / 1e6 / seconds if seconds else None,
+            'rss_kb': max(rss) if rss else None}
+
+
+def compare(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """Returns the names of the cases of results which are slower than in the baseline,
+    or whose peak RSS is larger, by more than the tolerance ratio. The external tools are not compared."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None or result.get('external'):
+            continue
+        if result['seconds'] > max(reference['seconds'] * (1 + tolerance), reference['seconds'] + MIN_DELTA):
+            regressions.append(name)
+        elif result['rss_kb'] and reference['rss_kb'] and result['rss_kb'] > reference['rss_kb'] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def format_result(name: str, result: dict, reference: dict = None) -> str:
+    rss = f'{result["rss_kb"] / 1024:8.1f} MB' if result['rss_kb'] else '       ? MB'
+    line = f'{name:<52} {result["seconds"]:9.4f} s {result["mb_s"] or 0:9.1f} MB/s {rss}'
+    if reference:
+        line += f'  x{result["seconds"] / reference["seconds"]:.2f} time'
+        if result['rss_kb'] and reference['rss_kb']:
+            line += f'  x{result["rss_kb"] / reference["rss_kb"]:.2f} RSS'
+    return line
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="cxd benchmarks")
+    parser.add_argument("--sizes", help="sizes of the inputs (default: 1K,1M,16M)", type=str, default='1K,1M,16M')
+    parser.add_argument("--kinds", help=f"kinds of inputs (default: {','.join(KINDS)})", type=str, default=','.join(KINDS))
+    parser.add_argument("--ranges", help="numbers of colors ranges (default: 0,1K,100K)", type=str, default='0,1K,100K')
+    parser.add_argument("-k", "--filter", help="only run the cases whose name contains this text", type=str)
+    parser.add_argument("--repeat", help="number of runs of each case, the best time being kept (default: 3)",
+                        type=int, default=3)
+    parser.add_argument("--workdir", help="directory of the generated inputs (kept between runs)", type=str,
+                        default=str(Path(tempfile.gettempdir()) / 'cxd-benchmarks'))
+    parser.add_argument("--save", help="write the results to this JSON file (a baseline)", type=str)
+    parser.add_argument("--compare", help="compare the results to this baseline; exits with 1 if a case regressed",
+                        type=str)
+    parser.add_argument("--tolerance", help=f"ratio of slowdown tolerated by --compare (default: {DEFAULT_TOLERANCE})",
+                        type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--run-case", help=argparse.SUPPRESS, type=str)
+    parser.add_argument("-v", "--verbose", dest="loglevel", help="set loglevel to INFO",
+                        action="store_const", const=logging.INFO)
+    return parser.parse_args(args)
+
+
+def setup_logging(loglevel):
+    logformat = "[%(asctime)s] %(levelname)s\t%(name)s\t%(message)s"
+    logging.basicConfig(
+        level=loglevel, stream=sys.stderr, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+    if args.run_case:
+        # child process of measure()
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return 0
+    assert args.repeat > 0
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    ranges_counts = [parse_size(count) for count in args.ranges.split(',')]
+    kinds = args.kinds.split(',')
+    for kind in kinds:
+        if kind not in KINDS:
+            _logger.error(f'Unknown kind {kind}. Available: {", ".join(KINDS)}')
+            return 2
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fd:
+            baseline = json.load(fd)['results']
+
+    results = {}
+    for case in list_cases(workdir, kinds, sizes, ranges_counts):
+        if args.filter and args.filter not in case['name']:
+            continue
+        result = measure(case, args.repeat)
+        if result is not None:
+            result['external'] = case['operation'] == 'command'
+            results[case['name']] = result
+            print(format_result(case['name'], result, baseline.get(case['name'])), flush=True)
+
+    if args.save:
+        from cxd import __version__
+        with open(args.save, 'w', encoding='utf-8') as fd:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'cxd': __version__,
+                       'results': results}, fd, indent=1)
+    if args.compare:
+        regressions = compare(results, baseline, args.tolerance)
+        for name in regressions:
+            print(f'REGRESSION: {format_result(name, results[name], baseline[name])}')
+        return 1 if regressions else 0
+    return 0
+
+
+def run():
+    sys.exit(main(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    run()
@@ -1,19 +1,27 @@
 import sys
 
-if sys.version_info[:2] >= (3, 8):
-    # TODO: Import directly (no need for conditional) when `python_requires = >= 3.8`
-    from importlib.metadata import PackageNotFoundError, version  # pragma: no cover
-else:
-    from importlib_metadata import PackageNotFoundError, version  # pragma: no cover
+from cxd.color_range import ColorRange
 
-try:
-    # Change here if project is renamed and does not equal the package name
-    dist_name = __name__
-    __version__ = version(dist_name)
-except PackageNotFoundError:  # pragma: no cover
-    __version__ = "unknown"
-finally:
-    del version, PackageNotFoundError
+# ColoredHexDump and __version__ are loaded on first access (PEP 562):
+# importing importlib.metadata and the renderer is slow compared to a short run of cxd
 
-from cxd.color_range import ColorRange
-from cxd.colored_hex_dump import ColoredHexDump
+
+def __getattr__(name):
+    if name == '__version__':
+        if sys.version_info[:2] >= (3, 8):
+            # TODO: Import directly (no need for conditional) when `python_requires = >= 3.8`
+            from importlib.metadata import PackageNotFoundError, version  # pragma: no cover
+        else:
+            from importlib_metadata import PackageNotFoundError, version  # pragma: no cover
+        try:
+            # Change here if project is renamed and does not equal the package name
+            dist_name = __name__
+            value = version(dist_name)
+        except PackageNotFoundError:  # pragma: no cover
+            value = "unknown"
+    elif name == 'ColoredHexDump':
+        from cxd.colored_hex_dump import ColoredHexDump as value
+    else:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    globals()[name] = value
+    return value
@@ -0,0 +1,78 @@
+"""
+Comparison of two data sources without loading them in memory.
+"""
+
+import logging
+import re
+
+from cxd.data_source import RELEASE_STEP, next_data, release_pages
+
+__author__ = "malware4n6"
+__copyright__ = "malware4n6"
+__license__ = "The Unlicense"
+
+_logger = logging.getLogger(__name__)
+
+
+# size of the blocks compared at once; only the blocks which differ are compared byte by byte
+DIFF_BLOCK = 1024 * 1024
+_DIFFERENT = re.compile(b'[^\x00]+')
+
+
+def _block_differences(a: bytes, b: bytes):
+    # (start, end) of the runs of different bytes of two blocks of the same length:
+    # the runs of non-zero bytes of a xor b
+    xored = (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+    return (m.span() for m in _DIFFERENT.finditer(xored))
+
+
+def iter_differences(data_a, base_a: int, data_b, base_b: int, start: int, end_a: int, end_b: int,
+                     fileno_a=None, fileno_b=None):
+    """Yields the (start, end) runs of offsets where the data differ, in order.
+
+    data_a holds the bytes [base_a, base_a + len(data_a)) of the first source, which ends
+    at end_a (same for data_b); the sources are compared from start. The bytes which are
+    only in the longest source are a difference.
+    The sources are compared by blocks of DIFF_BLOCK bytes, and the pages of mmaps are released
+    once compared. The ranges which are holes in both sparse files fileno_a and fileno_b are skipped.
+    """
+    view_a, view_b = memoryview(data_a), memoryview(data_b)
+    end = max(start, min(end_a, end_b))
+    released = offset = start
+    pending = None
+    while offset < end:
+        data_starts = next_data(fileno_a, offset), next_data(fileno_b, offset)
+        if None not in data_starts and min(data_starts) > offset:
+            # both files hold zeros until there
+            offset = min(min(data_starts), end)
+            continue
+        block_end = min(offset + DIFF_BLOCK, end)
+        # bytes comparisons use memcmp, unlike the ones of memoryviews
+        a = bytes(view_a[offset - base_a:block_end - base_a])
+        b = bytes(view_b[offset - base_b:block_end - base_b])
+        if a != b:
+            for run_start, run_end in _block_differences(a, b):
+                run_start, run_end = offset + run_start, offset + run_end
+                if pending is not None and pending[1] == run_start:
+                    # the run goes on from the previous block
+                    pending = (pending[0], run_end)
+                    continue
+                if pending is not None:
+                    yield pending
+                pending = (run_start, run_end)
+        offset = block_end
+        if offset - released >= RELEASE_STEP:
+            release_pages(data_a, released - base_a, offset - base_a)
+            release_pages(data_b, released - base_b, offset - base_b)
+            released = offset
+    release_pages(data_a, released - base_a, offset - base_a)
+    release_pages(data_b, released - base_b, offset - base_b)
+    if max(end_a, end_b) > end:
+        if pending is not None and pending[1] == end:
+            pending = (pending[0], max(end_a, end_b))
+        else:
+            if pending is not None:
+                yield pending
+            pending = (end, max(end_a, end_b))
+    if pending is not None:
+        yield pending
@@ -3,6 +3,9 @@ __copyright__ = "malware4n6"
 __license__ = "The Unlicense"
 
 class ColorRange():
+    # no per-instance __dict__: parsers may create millions of ranges
+    __slots__ = ('start', 'length', 'color', 'end', 'comment')
+
     def __init__(self, start, length, color = None, comment = None) -> None:
         self.start = start
         self.length = length
@@ -2,11 +2,29 @@
 
 """
 
+import heapq
+import html
+import json
 import logging
+import mmap
+import os
+import re
 import string
+import sys
+from bisect import bisect_right
+from collections import deque
+from contextlib import nullcontext
+from functools import partial
+from itertools import chain
 from pathlib import Path
-from intervaltree import IntervalTree
 from termcolor import colored
+# NumPy is imported by _load_numpy, the first time colored output is rendered:
+# it takes longer to import than to render a small dump.
+# False if it is not installed (the pure Python renderer is used)
+np = None
+
+from cxd.data_source import RELEASE_STEP, data_ready, map_file, mappable, release_pages, skip_repeated_lines
+from cxd.range_table import RangeTable
 
 __author__ = "malware4n6"
 __copyright__ = "malware4n6"
@@ -15,18 +33,179 @@ __license__ = "The Unlicense"
 _logger = logging.getLogger(__name__)
 
 
+def _build_color_runs(ranges, stop_at_first_color_found=True, indexes=None, comments=False):
+    """Flatten (possibly overlapping) colors ranges into sorted, non-overlapping runs.
+
+    `ranges` is a RangeTable or a list of ColorRange; only the ranges at `indexes`
+    of the table are used if it is given.
+    Returns three parallel lists: starts, ends (excluded) and colors, and a fourth one
+    with the comment of the range of each run if `comments` is set.
+    When several ranges hold an offset, the one sorting first (or last) by
+    (start, end) wins, ties being broken by the position in `ranges`.
+    A winning range without color leaves its bytes to the default/shadow colors,
+    so it does not generate any run.
+    """
+    table = ranges if isinstance(ranges, RangeTable) else RangeTable(ranges)
+    if indexes is None:
+        indexes = range(len(table))
+    # the table is already sorted by (start, end, position)
+    starts, ends, colors_ids, table_colors = table.starts, table.ends, table.color_ids, table.colors
+    comment_of = table.comments.__getitem__ if comments else lambda i: None
+    items = [(starts[i], ends[i], i, table_colors[colors_ids[i]]) for i in indexes if ends[i] > starts[i]]
+    if all(a[1] <= b[0] for a, b in zip(items, items[1:])):
+        # no overlap: each range is a run
+        starts, ends, colors, runs_comments = [], [], [], []
+        for start, end, i, color in items:
+            if color is None:
+                continue
+            if ends and ends[-1] == start and colors[-1] == color and runs_comments[-1] == comment_of(i):
+                ends[-1] = end
+            else:
+                starts.append(start)
+                ends.append(end)
+                colors.append(color)
+                runs_comments.append(comment_of(i))
+        return (starts, ends, colors, runs_comments) if comments else (starts, ends, colors)
+    boundaries = sorted({x for item in items for x in item[:2]})
+    starts, ends, colors, runs_comments = [], [], [], []
+    active = []
+    sign = 1 if stop_at_first_color_found else -1
+    next_item = 0
+    for b0, b1 in zip(boundaries, boundaries[1:]):
+        while next_item < len(items) and items[next_item][0] <= b0:
+            start, end, i, color = items[next_item]
+            heapq.heappush(active, (sign * start, sign * end, sign * i, end, color))
+            next_item += 1
+        while active and active[0][3] <= b0:
+            heapq.heappop(active)
+        if not active or active[0][4] is None:
+            continue
+        color = active[0][4]
+        comment = comment_of(sign * active[0][2])
+        if ends and ends[-1] == b0 and colors[-1] == color and runs_comments[-1] == comment:
+            ends[-1] = b1
+        else:
+            starts.append(b0)
+            ends.append(b1)
+            colors.append(color)
+            runs_comments.append(comment)
+    return (starts, ends, colors, runs_comments) if comments else (starts, ends, colors)
+
+
+def _load_numpy() -> bool:
+    global np
+    if np is None:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = False
+    return np is not False
+
+
+# CSS colors of the HTML output, close to the ones of the usual terminals
+HTML_COLORS = {
+    'black': '#000000', 'red': '#cd3131', 'green': '#0dbc79', 'yellow': '#e5e510', 'blue': '#2472c8',
+    'magenta': '#bc3fbc', 'cyan': '#11a8cd', 'white': '#ffffff', 'light_grey': '#e5e5e5', 'dark_grey': '#767676',
+    'light_red': '#f14c4c', 'light_green': '#23d18b', 'light_yellow': '#f5f543', 'light_blue': '#3b8eea',
+    'light_magenta': '#d670d6', 'light_cyan': '#29b8db',
+}
+HTML_BACKGROUND = '#1e1e1e'
+_HTML_SPECIAL = re.compile('[&<>"\']')
+
+
+def _html_escape(text: str) -> str:
+    # the characters to escape are rare: searching them is much faster than html.escape
+    return html.escape(text) if _HTML_SPECIAL.search(text) else text
+
+# largest size of the blocks of pages mapped at once
+HUGE_PAGE = 2 * 1024 * 1024
+
+# state of a worker process of a parallel rendering:
+# (ColoredHexDump, mmap, window start, window end, file, output format)
+_worker_state = None
+
+def _init_worker(cxd, filepath, start, end, output_format):
+    global _worker_state
+    # the file stays open to find its holes
+    fd = open(filepath, 'rb')
+    data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    if cxd.stats is not None:
+        # the statistics are the ones of the main process: the workers neither count nor trace
+        cxd.stats = None
+        import tracemalloc
+        tracemalloc.stop()
+    _worker_state = (cxd, data, start, end, fd, output_format)
+
+def _render_segment(segment):
+    cxd, data, start, end, fd, output_format = _worker_state
+    text = cxd._render_segment(data, start, end, segment, fd.fileno(), output_format)
+    # the system can map the pages around the segment at the same time as the
+    # pages of the segment (up to a huge page): they are released too
+    release_pages(data, max(0, segment[0] - HUGE_PAGE), min(len(data), segment[1] + HUGE_PAGE))
+    return text
+
+class _RenderState():
+    # state of an output of a ColoredHexDump (see ColoredHexDump.__new_state): each generator of lines
+    # has its own, so that the outputs of an instance can be pulled in turn
+    __slots__ = ('format', 'escapes', 'colors_enabled', 'run_starts', 'run_ends', 'run_colors', 'run_titles',
+                 'json_next', 'json_active', 'numpy')
+
+    def __init__(self, output_format: str, escapes: dict) -> None:
+        # the resolved format: 'ansi', 'plain', 'jsonl' or 'html'
+        self.format = output_format
+        # {color: (prefix, suffix)}
+        self.escapes = escapes
+        self.colors_enabled = any(prefix for prefix, _ in escapes.values())
+        # runs coloring the lines being rendered (see ColoredHexDump.__select_runs)
+        self.run_starts, self.run_ends, self.run_colors = [], [], []
+        self.run_titles = None
+        # ranges overlapping the lines of the JSON output, found by sweeping the table:
+        # index of the next range starting after the lines, and heap of the (end, index) of the others
+        self.json_next = 0
+        self.json_active = []
+        # palette of the NumPy renderer, once it is enabled
+        self.numpy = None
+
+class _NumpyPalette():
+    # pieces gathered by the NumPy renderer (see ColoredHexDump.__prepare_numpy_palette)
+    __slots__ = ('palette', 'prefixes', 'suffixes', 'tags', 'span_end', 'hex', 'ascii', 'space', 'separator',
+                 'newline', 'hex_columns', 'ascii_bytes', 'shadow_bytes')
+
 class ColoredHexDump():
+    # number of characters gathered before a single write to stdout
+    WRITE_SIZE = 64 * 1024
+    # largest size of the blocks read at once from a stream (stdin, a pipe...)
+    STREAM_BLOCK = 1024 * 1024
+    # size of the data rendered by a worker in a parallel rendering
+    PARALLEL_SEGMENT = 1024 * 1024
+    # number of lines colored at once by the NumPy renderer
+    NUMPY_BLOCK_LINES = 4096
+    # smaller windows are rendered in pure Python, which is faster than importing NumPy
+    NUMPY_MIN_SIZE = 64 * 1024
     # colors can be found here: https://pypi.org/project/termcolor/
+    # formats of the dumps printed by print, print_file and print_diff (see resolve_output_format)
+    OUTPUT_FORMATS = ('auto', 'ansi', 'plain', 'jsonl')
     ALLOWED_COLORS = 'black red green yellow blue magenta cyan white light_grey dark_grey light_red light_green light_yellow light_blue light_magenta light_cyan'.split()
 
     def __init__(self, ranges=None, chunk_length: int=16, replace_not_printable:str='.', column_separator:str='\t', address_shift:int=0,
                 default_color:str='white', shadow_color:str='dark_grey', address_color:str='cyan', title_color:str='dark_grey',
                 enable_shadow_bytes=True, hide_null_lines=True, stop_at_first_color_found=True,
-                show_columns_name_at_start=True, show_columns_name_at_end=True) -> None:
+                show_columns_name_at_start=True, show_columns_name_at_end=True, merge_escapes=True,
+                use_numpy=True, hide_repeated_lines=False, removed_color:str='red', added_color:str='green',
+                output_format:str='auto') -> None:
         self.color_ranges = [] if ranges is None else ranges
-        self.color_tree = IntervalTree()
-        for cr in self.color_ranges:
-            self.color_tree[cr.start:cr.end+1] = cr
+        # sorted columns of the ranges, queried by bisection
+        self.range_table = ranges if isinstance(ranges, RangeTable) else RangeTable(self.color_ranges)
+        # if multiple ranges contain an offset, the user decides whether
+        # the first or the last must be selected
+        self.stop_at_first_color_found = stop_at_first_color_found
+        # the ranges are resolved once into non-overlapping runs, each line is then
+        # colored by walking these runs instead of querying the table for each byte.
+        # the runs of all ranges are built on first use; when a window of the data is
+        # printed, only the ranges overlapping the window are resolved.
+        # {True if the runs have comments: runs}
+        self.__all_runs = {}
         self.chunk_length = chunk_length
         assert self.chunk_length > 0
         self.replace_not_printable = replace_not_printable
@@ -42,132 +221,1042 @@ class ColoredHexDump():
         assert self.address_color in ColoredHexDump.ALLOWED_COLORS
         self.title_color = title_color
         assert self.title_color in ColoredHexDump.ALLOWED_COLORS
+        # colors of the bytes of the first and second file which differ in a diff
+        self.removed_color = removed_color
+        assert self.removed_color in ColoredHexDump.ALLOWED_COLORS
+        self.added_color = added_color
+        assert self.added_color in ColoredHexDump.ALLOWED_COLORS
         # bytes with these values will be colored with self.shadow_color
         self.shadow_bytes = (0x0, )
         self.enable_shadow_bytes = enable_shadow_bytes
         # if hide_null_lines is set we replace the line by "ADDR *" 
         self.hide_null_lines = hide_null_lines
         self.__content_to_hide = bytes(chunk_length)
-        self.__hide_mode = False
-        # if multiple ranges contain an offset, the user decides whether
-        # the first or the last must be selected
-        self.stop_at_first_color_found = stop_at_first_color_found
+        # if hide_repeated_lines is set, a line identical to the previous one is replaced
+        # by "ADDR *" too (like hexdump does)
+        self.hide_repeated_lines = hide_repeated_lines
         self.show_columns_name_at_start = show_columns_name_at_start
         self.show_columns_name_at_end = show_columns_name_at_end
+        # if merge_escapes is set, consecutive bytes sharing a color are wrapped in a single
+        # escape sequence. Otherwise each byte gets its own one (legacy output).
+        # The visible text is the same in both cases.
+        self.merge_escapes = merge_escapes
+        # lookup tables indexed by byte value: hex text and ascii column character
+        self.__hex_table = tuple(f'{c:02X}' for c in range(256))
+        self.__ascii_table = ''.join(chr(c) if chr(c) in self.printable else self.replace_not_printable
+                                     for c in range(256))
+        try:
+            # allows bytes.translate when the replacement character fits in a byte
+            self.__ascii_bytes_table = self.__ascii_table.encode('latin-1')
+        except UnicodeEncodeError:
+            self.__ascii_bytes_table = None
+        # matches the runs of shadow bytes
+        self.__shadow_regex = re.compile(b'[' + b''.join(re.escape(bytes([b])) for b in self.shadow_bytes) + b']+')
+        # if NumPy is installed, the colors and the text of blocks of lines are computed
+        # with vectorized operations instead of line by line
+        self.use_numpy = use_numpy
+        self.__color_codes = {color: i for i, color in enumerate(ColoredHexDump.ALLOWED_COLORS)}
+        # palettes of the NumPy renderer, built on first use: {output format: _NumpyPalette}
+        self.__numpy_palettes = {}
+        # 'ansi' (colored), 'plain' (no color, the ranges are not even resolved), 'jsonl' (a JSON object
+        # per line, for other tools) or 'auto': 'ansi' if the output can be colored, 'plain' otherwise.
+        # the state of each output (its resolved format, runs...) is kept by its generator (see __new_state)
+        self.output_format = output_format
+        assert self.output_format in ColoredHexDump.OUTPUT_FORMATS
+        # {output format: {color: (prefix, suffix)}}
+        self.__escapes = {}
+        # start of the span of each color in the HTML output: the colors are CSS classes c0, c1...
+        self.__html_tags = {color: f'<span class=c{i}' for i, color in enumerate(ColoredHexDump.ALLOWED_COLORS)}
+        # if set (see cxd.run_stats.RunStats), the outputs count the bytes and lines rendered, the range
+        # lookups and the writes, and time the writes. The counters are updated per call or per block of lines
+        self.stats = None
 
-    def __get_color_for_offset(self, offset:int, x):
-        # x is not a byte because of the use of `enumerate`
-        ret = None
+    def __select_runs(self, state: _RenderState, start: int, end: int, titles: bool = False):
+        # prepares the runs of the output needed to color [start, end), with the HTML title attributes
+        # made of the comments of their ranges if requested.
+        # the runs of all the ranges are built (once) unless the window is small
+        # compared to the span of the ranges
+        table = self.range_table
+        if titles in self.__all_runs or not table or 2 * (end - start) >= table.end() - table.begin():
+            if titles not in self.__all_runs:
+                self.__all_runs[titles] = self.__build_runs(table, None, titles)
+                if self.stats is not None:
+                    self.stats.count('range lookups')
+                    self.stats.count('ranges resolved', len(table))
+            runs = self.__all_runs[titles]
+        else:
+            indexes = table.overlap(start, end)
+            runs = self.__build_runs(table, indexes, titles)
+            if self.stats is not None:
+                self.stats.count('range lookups')
+                self.stats.count('ranges resolved', len(indexes))
+        state.run_starts, state.run_ends, state.run_colors = runs[:3]
+        state.run_titles = runs[3] if titles else None
 
-        intervals = sorted(self.color_tree[offset])
-        if intervals:
-            if self.stop_at_first_color_found:
-                ret = intervals[0].data.color
-            else:
-                ret = intervals[-1].data.color
+    def __build_runs(self, table, indexes, titles: bool):
+        if not titles:
+            return _build_color_runs(table, self.stop_at_first_color_found, indexes)
+        starts, ends, colors, comments = _build_color_runs(table, self.stop_at_first_color_found, indexes, True)
+        return starts, ends, colors, [None if comment is None else f' title="{_html_escape(str(comment))}"'
+                                      for comment in comments]
+
+    @staticmethod
+    def resolve_output_format(output_format: str = 'auto') -> str:
+        """Returns the format of the dumps printed to stdout: output_format, 'auto' being 'ansi' when
+        termcolor colors the output (a TTY, NO_COLOR and ANSI_COLORS_DISABLED being unset...) and 'plain' otherwise."""
+        if output_format != 'auto':
+            return output_format
+        return 'ansi' if colored('\0', 'red') != '\0' else 'plain'
+
+    def __new_state(self, output_format: str = None) -> _RenderState:
+        # resolves the format of an output (self.output_format by default) and returns its state.
+        # the 'ansi' output is always colored, the other ones are never colored by escape sequences
+        output_format = ColoredHexDump.resolve_output_format(self.output_format if output_format is None
+                                                             else output_format)
+        if output_format not in self.__escapes:
+            self.__escapes[output_format] = {
+                color: (tuple(colored('\0', color, force_color=True).split('\0')) if output_format == 'ansi'
+                        else ('', ''))
+                for color in ColoredHexDump.ALLOWED_COLORS}
+        return _RenderState(output_format, self.__escapes[output_format])
+
+    def __numpy_renderer_enabled(self, state: _RenderState, size: int) -> bool:
+        # NumPy and the palette (of the output format) are only loaded when needed
+        if not self.use_numpy or state.format == 'jsonl' or size < ColoredHexDump.NUMPY_MIN_SIZE:
+            return False
+        if state.numpy is None:
+            if not _load_numpy():
+                return False
+            if state.format not in self.__numpy_palettes:
+                self.__numpy_palettes[state.format] = self.__prepare_numpy_palette(state)
+            state.numpy = self.__numpy_palettes[state.format]
+        return True
+
+    def __prepare_numpy_palette(self, state: _RenderState) -> _NumpyPalette:
+        # the NumPy renderer builds its output by gathering pieces of this palette:
+        # the escape sequences (or HTML tags), the hex and ascii text of each byte value, and the separators
+        html = state.format == 'html'
+        tables = _NumpyPalette()
+        pieces = []
+        size = 0
+
+        def put(text: str):
+            nonlocal size
+            data = text.encode()
+            pieces.append(data)
+            size += len(data)
+            return size - len(data), len(data)
 
+        if html:
+            escapes = [('', '') if color == self.default_color else (self.__html_tags[color] + '>', '</span>')
+                       for color in ColoredHexDump.ALLOWED_COLORS]
+            ascii_table = [_html_escape(x) for x in self.__ascii_table]
+            separator = _html_escape(self.column_separator)
+        else:
+            escapes = [state.escapes[color] for color in ColoredHexDump.ALLOWED_COLORS]
+            ascii_table = self.__ascii_table
+            separator = self.column_separator
+        tables.prefixes = np.array([put(prefix) for prefix, _ in escapes], dtype=np.int32)
+        tables.suffixes = np.array([put(suffix) for _, suffix in escapes], dtype=np.int32)
+        if html:
+            # the spans of the runs having a title (see __add_titles_numpy)
+            tables.tags = np.array([put(self.__html_tags[color] + '>') for color in ColoredHexDump.ALLOWED_COLORS],
+                                   dtype=np.int32)
+            tables.span_end = np.array(put('</span>'), dtype=np.int32)
+        tables.hex = np.array([put(x) for x in self.__hex_table], dtype=np.int32)
+        tables.ascii = np.array([put(x) for x in ascii_table], dtype=np.int32)
+        tables.space = put(' ')
+        tables.separator = put(separator)
+        tables.newline = put('\n')
+        tables.palette = np.frombuffer(b''.join(pieces), dtype=np.uint8)
+        # tables of the plain output, whose lines have a fixed length if each ascii character is a byte
+        tables.hex_columns = np.frombuffer(''.join(x + ' ' for x in self.__hex_table).encode(),
+                                           dtype=np.uint8).reshape(256, 3)
+        ascii_bytes = self.__ascii_table.encode()
+        tables.ascii_bytes = np.frombuffer(ascii_bytes, dtype=np.uint8) if len(ascii_bytes) == 256 else None
+        tables.shadow_bytes = np.array(self.shadow_bytes, dtype=np.uint8)
+        return tables
+
+    def __colorize(self, state: _RenderState, text: str, color: str) -> str:
+        prefix, suffix = state.escapes[color]
+        return prefix + text + suffix
+
+    def __get_color_segments(self, state: _RenderState, chunk: bytes, chunk_offset: int):
+        # returns a list of (start, end, color) covering the chunk, start and end being
+        # relative to the chunk and consecutive segments having different colors
         # if belongs to a range -> provided color is chosen first
         # if not in a range:
             # if x == 0x00 -> shadow_color
             # else -> default_color
-        if ret is None:
-            if x in self.shadow_bytes and self.enable_shadow_bytes:
-                ret = self.shadow_color
+        segments = []
+
+        def add(start, end, color):
+            if start >= end:
+                return
+            if segments and segments[-1][2] == color:
+                segments[-1] = (segments[-1][0], end, color)
             else:
-                ret = self.default_color
-        _logger.debug(f'Color for {offset=}: {ret}')
-        return ret
+                segments.append((start, end, color))
+
+        def add_default(start, end):
+            if self.enable_shadow_bytes:
+                for m in self.__shadow_regex.finditer(chunk, start, end):
+                    add(start, m.start(), self.default_color)
+                    add(m.start(), m.end(), self.shadow_color)
+                    start = m.end()
+            add(start, end, self.default_color)
 
-    def __print_snip(self, addr: int):
-        print(colored(f'{addr:08x}', self.address_color), end='')
-        print(self.column_separator, end='')
-        print('*')
+        pos = 0
+        chunk_end = chunk_offset + len(chunk)
+        i = bisect_right(state.run_ends, chunk_offset)
+        while i < len(state.run_starts) and state.run_starts[i] < chunk_end:
+            start = max(state.run_starts[i], chunk_offset) - chunk_offset
+            end = min(state.run_ends[i], chunk_end) - chunk_offset
+            add_default(pos, start)
+            add(start, end, state.run_colors[i])
+            pos = end
+            i += 1
+        add_default(pos, len(chunk))
+        return segments
 
-    def __print_chunk(self, addr: int, chunk: bytes, chunk_offset: int):
+    def __format_snip(self, state: _RenderState, addr: int) -> str:
+        return self.__colorize(state, f'{addr:08x}', self.address_color) + self.column_separator + '*\n'
+
+    def __format_chunk(self, state: _RenderState, addr: int, chunk: bytes, chunk_offset: int) -> str:
         # addr is the address displayed in the first column of the output
         # self.address_shift is not added in the function
         # chunk_offset is the offset of the chunk in a larger binary object
+        chunk = bytes(chunk)
+        # byte i is written at hex_text[3*i:3*i+2]
+        hex_text = chunk.hex(' ').upper()
+        if self.__ascii_bytes_table is not None:
+            ascii_text = chunk.translate(self.__ascii_bytes_table).decode('latin-1')
+        else:
+            ascii_text = ''.join(map(self.__ascii_table.__getitem__, chunk))
+        if not state.colors_enabled:
+            # plain output: no need to resolve the colors
+            return self.__format_plain_line(addr, hex_text, ascii_text)
+        return self.__format_colored_line(state, addr, hex_text, ascii_text,
+                                          self.__get_color_segments(state, chunk, chunk_offset))
 
-        # print address column and separator
-        print(colored(f'{addr:08x}', self.address_color), end='')
-        print(self.column_separator, end='')
-
-        # generate ascii content
-        # hex chars are print directly
-        ascii_content = ''
-        raw_ascii_content = ''
-        # iterate over each byte value in the chunk
-        for i, c in enumerate(chunk):
-            color = self.__get_color_for_offset(chunk_offset + i, c)
-            print(colored(f'{c:02X}', color), end='')
-            print(' ', end='')
-            if chr(c) in self.printable:
-                raw_ascii_content += chr(c)
-                ascii_content += colored(f'{chr(c)}', color)
-            else:
-                raw_ascii_content += self.replace_not_printable
-                ascii_content += colored(f'{self.replace_not_printable}', color)
+    def __format_plain_chunk(self, addr: int, chunk: bytes, chunk_offset: int) -> str:
+        # same as __format_chunk for the plain output, the ranges being ignored
+        chunk = bytes(chunk)
+        if self.__ascii_bytes_table is not None:
+            ascii_text = chunk.translate(self.__ascii_bytes_table).decode('latin-1')
+        else:
+            ascii_text = ''.join(map(self.__ascii_table.__getitem__, chunk))
+        return self.__format_plain_line(addr, chunk.hex(' ').upper(), ascii_text)
 
+    def __format_plain_line(self, addr: int, hex_text: str, ascii_text: str) -> str:
         # handle the last line so that the columns are OK
-        if len(raw_ascii_content) != self.chunk_length:
-            print(3*(self.chunk_length - len(raw_ascii_content))*' ', end='')
-        print(self.column_separator, end='')
-        print(ascii_content, end='')
-        # end of the line!
-        print()
-
-    def __print_columns_names(self):
-        print(colored(f'  Offset', self.title_color), end='')
-        print(self.column_separator, end='')
-        for i in range(self.chunk_length):
-            print(colored(f'{i:02X}', self.title_color), end='')
-            print(' ', end='')
-        print(self.column_separator)
-
-    def print(self, data: bytes):
-        if self.show_columns_name_at_start:
-            self.__print_columns_names()
-        for chunk_offset in range(0, len(data), self.chunk_length):
-            chunk = data[chunk_offset:chunk_offset + self.chunk_length]
-            addr = self.address_shift + chunk_offset
-            # print(len(data), chunk_offset, ((len(data) - chunk_offset)//self.chunk_length))
-            if self.hide_null_lines and chunk_offset != 0 and ((len(data) - chunk_offset)//self.chunk_length) not in (0, 1):
-                # check only if option is enabled and it's not the first or last line of the dump
-                if chunk == self.__content_to_hide:
-                    if not self.__hide_mode:
-                        self.__hide_mode = True
-                        self.__print_snip(addr)
+        padding = 3 * (self.chunk_length - len(ascii_text)) * ' '
+        return (f'{addr:08x}' + self.column_separator + hex_text + ' ' + padding
+                + self.column_separator + ascii_text + '\n')
+
+    def __format_json_chunk(self, state: _RenderState, addr: int, chunk: bytes, chunk_offset: int) -> str:
+        # a JSON object per line: its address, the hex and ascii text of its bytes and the indexes
+        # (in self.range_table) of the ranges overlapping it. The lines come in increasing order,
+        # so the ranges are found by sweeping the table
+        chunk = bytes(chunk)
+        table, active = self.range_table, state.json_active
+        chunk_end = chunk_offset + len(chunk)
+        while state.json_next < len(table) and table.starts[state.json_next] < chunk_end:
+            heapq.heappush(active, (table.ends[state.json_next], state.json_next))
+            state.json_next += 1
+        while active and active[0][0] <= chunk_offset:
+            heapq.heappop(active)
+        ranges = sorted(i for end, i in active if end > table.starts[i])
+        return json.dumps({'offset': addr, 'hex': chunk.hex(),
+                           'ascii': ''.join(map(self.__ascii_table.__getitem__, chunk)), 'ranges': ranges}) + '\n'
+
+    def __format_json_snip(self, addr: int) -> str:
+        # the lines from addr to the next object are hidden (see hide_null_lines and hide_repeated_lines)
+        return json.dumps({'offset': addr, 'hidden': True}) + '\n'
+
+    def __format_colored_line(self, state: _RenderState, addr: int, hex_text: str, ascii_text: str, segments) -> str:
+        # hex_text holds the hex value of byte i at [3*i:3*i+2], ascii_text its character at i
+        # and segments the (start, end, color) of the line
+        hex_content = []
+        ascii_content = []
+        for start, end, color in segments:
+            prefix, suffix = state.escapes[color]
+            if self.merge_escapes:
+                hex_content.append(prefix + hex_text[3*start:3*end-1] + suffix + ' ')
+                ascii_content.append(prefix + ascii_text[start:end] + suffix)
+            else:
+                hex_content.extend(prefix + hex_text[3*i:3*i+2] + suffix + ' ' for i in range(start, end))
+                ascii_content.extend(prefix + x + suffix for x in ascii_text[start:end])
+        # handle the last line so that the columns are OK
+        padding = 3 * (self.chunk_length - len(ascii_text)) * ' '
+        return (self.__colorize(state, f'{addr:08x}', self.address_color) + self.column_separator
+                + ''.join(hex_content) + padding + self.column_separator + ''.join(ascii_content) + '\n')
+
+    def __get_html_segments(self, state: _RenderState, chunk: bytes, chunk_offset: int):
+        # same as __get_color_segments, the segments being (start, end, color, title attribute):
+        # the runs must have been selected with their titles
+        segments = []
+
+        def add(start, end, color, title=None):
+            if start >= end:
+                return
+            if segments and segments[-1][2] == color and segments[-1][3] == title:
+                segments[-1] = (segments[-1][0], end, color, title)
+            else:
+                segments.append((start, end, color, title))
+
+        def add_default(start, end):
+            if self.enable_shadow_bytes:
+                for m in self.__shadow_regex.finditer(chunk, start, end):
+                    add(start, m.start(), self.default_color)
+                    add(m.start(), m.end(), self.shadow_color)
+                    start = m.end()
+            add(start, end, self.default_color)
+
+        pos = 0
+        chunk_end = chunk_offset + len(chunk)
+        i = bisect_right(state.run_ends, chunk_offset)
+        while i < len(state.run_starts) and state.run_starts[i] < chunk_end:
+            start = max(state.run_starts[i], chunk_offset) - chunk_offset
+            end = min(state.run_ends[i], chunk_end) - chunk_offset
+            add_default(pos, start)
+            add(start, end, state.run_colors[i], state.run_titles[i])
+            pos = end
+            i += 1
+        add_default(pos, len(chunk))
+        return segments
+
+    def __format_html_chunk(self, state: _RenderState, addr: int, chunk: bytes, chunk_offset: int) -> str:
+        # same as __format_chunk in HTML: the runs of bytes of a color are wrapped in a span of its class
+        # (except the default color, which is the one of the text), the comment of their range being
+        # the tooltip of their hex text
+        chunk = bytes(chunk)
+        hex_text = chunk.hex(' ').upper()
+        if self.__ascii_bytes_table is not None:
+            ascii_text = chunk.translate(self.__ascii_bytes_table).decode('latin-1')
+        else:
+            ascii_text = ''.join(map(self.__ascii_table.__getitem__, chunk))
+        escape = _HTML_SPECIAL.search(ascii_text) is not None
+        hex_content = []
+        ascii_content = []
+        for start, end, color, title in self.__get_html_segments(state, chunk, chunk_offset):
+            ascii_part = html.escape(ascii_text[start:end]) if escape else ascii_text[start:end]
+            if color == self.default_color and title is None:
+                hex_content.append(hex_text[3*start:3*end-1] + ' ')
+                ascii_content.append(ascii_part)
+            else:
+                tag = self.__html_tags[color]
+                hex_content.append(f'{tag}{title or ""}>{hex_text[3*start:3*end-1]}</span> ')
+                ascii_content.append(f'{tag}>{ascii_part}</span>')
+        separator = html.escape(self.column_separator)
+        padding = 3 * (self.chunk_length - len(chunk)) * ' '
+        return (self.__html_wrap(f'{addr:08x}', self.address_color) + separator
+                + ''.join(hex_content) + padding + separator + ''.join(ascii_content) + '\n')
+
+    def __html_wrap(self, text: str, color: str) -> str:
+        # the text is in the default color when it is not wrapped
+        return text if color == self.default_color else f'{self.__html_tags[color]}>{text}</span>'
+
+    def __format_html_snip(self, addr: int) -> str:
+        return self.__html_wrap(f'{addr:08x}', self.address_color) + html.escape(self.column_separator) + '*\n'
+
+    def __format_html_columns_names(self) -> str:
+        names = ' '.join(f'{i:02X}' for i in range(self.chunk_length))
+        separator = html.escape(self.column_separator)
+        return (self.__html_wrap('  Offset', self.title_color) + separator
+                + self.__html_wrap(names, self.title_color) + ' ' + separator + '\n')
+
+    def __format_html_header(self, name: str) -> str:
+        classes = ''.join(f'.c{i}{{color:{HTML_COLORS[color]}}}\n' for i, color in enumerate(ColoredHexDump.ALLOWED_COLORS))
+        return ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+                f'<title>{html.escape(name)}</title>\n<style>\n'
+                f'pre.cxd{{background:{HTML_BACKGROUND};color:{HTML_COLORS[self.default_color]};padding:1em;tab-size:4}}\n'
+                f'{classes}</style>\n</head>\n<body>\n<pre class=cxd>\n')
+
+    def __format_block_numpy(self, state: _RenderState, data, base: int, block_start: int, block_end: int, hidden):
+        # formats the lines of [block_start, block_end) (which starts with a line) with vectorized
+        # operations, except the lines whose hidden flag is set.
+        # Returns the UTF-8 encoded text and the offset of the end of each line in it.
+        block = np.frombuffer(data[block_start - base:block_end - base], dtype=np.uint8)
+        length = len(block)
+        colors = ColoredHexDump.ALLOWED_COLORS
+        # the palette, and the pieces opening and closing the bytes of each code in the hex and ascii columns
+        tables = (state.numpy.palette, state.numpy.prefixes, state.numpy.suffixes,
+                  state.numpy.prefixes, state.numpy.suffixes)
+        plain = state.format == 'plain'
+        # color index of each byte: default, shadow, then the runs (no color is resolved in the plain output)
+        codes = np.full(length, colors.index(self.default_color), dtype=np.uint8)
+        if self.enable_shadow_bytes and not plain:
+            codes[np.isin(block, state.numpy.shadow_bytes)] = colors.index(self.shadow_color)
+        first_run = bisect_right(state.run_ends, block_start)
+        last_run = first_run
+        while last_run < len(state.run_starts) and state.run_starts[last_run] < block_end:
+            last_run += 1
+        if last_run > first_run:
+            run_starts = np.array(state.run_starts[first_run:last_run], dtype=np.int64) - block_start
+            run_ends = np.array(state.run_ends[first_run:last_run], dtype=np.int64) - block_start
+            run_codes = np.array([self.__color_codes[c] for c in state.run_colors[first_run:last_run]], dtype=np.uint8)
+            if state.format == 'html' and any(state.run_titles[first_run:last_run]):
+                tables, run_codes = self.__add_titles_numpy(state, tables, run_codes,
+                                                            state.run_titles[first_run:last_run])
+                codes = codes.astype(run_codes.dtype)
+            positions = np.arange(length)
+            run = np.searchsorted(run_ends, positions, side='right')
+            inside = run < len(run_starts)
+            inside[inside] = run_starts[run[inside]] <= positions[inside]
+            codes[inside] = run_codes[run[inside]]
+
+        nb_lines = (length + self.chunk_length - 1) // self.chunk_length
+        full_lines = length // self.chunk_length
+        line_lengths = np.zeros(nb_lines, dtype=np.int64)
+        kept = np.flatnonzero(~hidden[:full_lines])
+        output = b''
+        if len(kept) and plain and state.numpy.ascii_bytes is not None \
+                and self.address_shift + block_end <= 1 << 32:
+            output, line_lengths[kept] = self.__format_plain_lines_numpy(
+                state, kept, block_start, block[:full_lines * self.chunk_length].reshape(full_lines, -1)[kept])
+        elif len(kept):
+            output, line_lengths[kept] = self.__format_full_lines_numpy(
+                state, kept, block_start,
+                block[:full_lines * self.chunk_length].reshape(full_lines, -1)[kept],
+                codes[:full_lines * self.chunk_length].reshape(full_lines, -1)[kept], tables)
+        if full_lines < nb_lines and not hidden[-1]:
+            # the last line of the dump is not complete
+            line_start = full_lines * self.chunk_length
+            if state.format != 'ansi':
+                format_chunk = (partial(self.__format_html_chunk, state) if state.format == 'html'
+                                else self.__format_plain_chunk)
+                last_line = format_chunk(self.address_shift + block_start + line_start,
+                                         block[line_start:].tobytes(), block_start + line_start).encode()
+                line_lengths[-1] = len(last_line)
+                return output + last_line, np.cumsum(line_lengths).tolist()
+            segments = []
+            for i, code in enumerate(codes[line_start:].tolist()):
+                if segments and segments[-1][2] == colors[code]:
+                    segments[-1] = (segments[-1][0], i + 1, colors[code])
                 else:
-                    self.__hide_mode = False
-                    self.__print_chunk(addr, chunk, chunk_offset)
+                    segments.append((i, i + 1, colors[code]))
+            raw = block[line_start:].tobytes()
+            last_line = self.__format_colored_line(state, self.address_shift + block_start + line_start,
+                                                   raw.hex(' ').upper(),
+                                                   ''.join(map(self.__ascii_table.__getitem__, raw)),
+                                                   segments).encode()
+            output += last_line
+            line_lengths[-1] = len(last_line)
+        return output, np.cumsum(line_lengths).tolist()
+
+    def __format_plain_lines_numpy(self, state: _RenderState, kept, block_start: int, block):
+        # same as __format_full_lines_numpy for the plain output, when the addresses have 8 digits
+        # and each ascii character is a byte: all the lines have the same length, so they are
+        # the rows of an array whose columns are filled at once (take is much faster than indexing)
+        rows, width = block.shape
+        separator = np.frombuffer(self.column_separator.encode(), dtype=np.uint8)
+        line_length = 8 + 2 * len(separator) + 4 * width + 1
+        lines = np.empty((rows, line_length), dtype=np.uint8)
+        addresses = self.address_shift + block_start + kept.astype(np.int64) * width
+        lines[:, :8] = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)[(addresses[:, None] >> np.arange(28, -1, -4)) & 0xF]
+        position = 8 + len(separator)
+        lines[:, 8:position] = separator
+        lines[:, position:position + 3 * width] = state.numpy.hex_columns.take(block.ravel(), axis=0).reshape(rows, -1)
+        position += 3 * width
+        lines[:, position:position + len(separator)] = separator
+        position += len(separator)
+        lines[:, position:position + width] = state.numpy.ascii_bytes.take(block)
+        lines[:, -1] = ord('\n')
+        return lines.tobytes(), line_length
+
+    def __add_titles_numpy(self, state: _RenderState, tables, run_codes, titles):
+        # in HTML, each run having a title gets its own code (after the colors), whose hex prefix
+        # is a span with the title: the tables and the palette are extended with them
+        palette, hex_prefixes, hex_suffixes, ascii_prefixes, ascii_suffixes = tables
+        titled = np.array([title is not None for title in titles])
+        colors = run_codes[titled]
+        pieces = [f'{self.__html_tags[color]}{title}>'.encode() for color, title
+                  in zip((ColoredHexDump.ALLOWED_COLORS[code] for code in colors.tolist()),
+                         (title for title in titles if title is not None))]
+        title_prefixes = np.empty((len(pieces), 2), dtype=np.int32)
+        title_prefixes[:, 1] = [len(piece) for piece in pieces]
+        title_prefixes[:, 0] = len(palette) + np.cumsum(title_prefixes[:, 1]) - title_prefixes[:, 1]
+        # the runs of the default color are wrapped too when they have a title
+        span_ends = np.repeat(state.numpy.span_end[None], len(pieces), axis=0)
+        tables = (np.concatenate((palette, np.frombuffer(b''.join(pieces), dtype=np.uint8))),
+                  np.concatenate((hex_prefixes, title_prefixes)), np.concatenate((hex_suffixes, span_ends)),
+                  np.concatenate((ascii_prefixes, state.numpy.tags[colors])), np.concatenate((ascii_suffixes, span_ends)))
+        run_codes = run_codes.astype(np.int32)
+        run_codes[titled] = len(ColoredHexDump.ALLOWED_COLORS) + np.arange(len(pieces), dtype=np.int32)
+        return tables, run_codes
+
+    def __format_full_lines_numpy(self, state: _RenderState, kept, block_start: int, block, codes, tables):
+        # block and codes are 2D arrays (one row per line) of the complete lines whose
+        # indexes are in kept; tables are the palette and the pieces opening and closing each code
+        # (see __format_block_numpy). Each line is made of pieces of the palette, always in this order:
+        #   address (prefix, digits, suffix), separator, chunk_length * (prefix, hex, suffix, space), separator,
+        #   chunk_length * (prefix, ascii char, suffix), newline
+        # missing prefixes and suffixes are empty pieces. The pieces are then gathered at once.
+        # Returns the UTF-8 encoded text of the lines and the length of each line.
+        rows, width = block.shape
+        base_palette, hex_prefixes, hex_suffixes, ascii_prefixes, ascii_suffixes = tables
+        if self.merge_escapes or state.format == 'html':
+            # a prefix opens each segment of the same color, a suffix closes it
+            opening = np.ones((rows, width), dtype=bool)
+            opening[:, 1:] = codes[:, 1:] != codes[:, :-1]
+            closing = np.ones((rows, width), dtype=bool)
+            closing[:, :-1] = opening[:, 1:]
+        else:
+            opening = closing = True
+        addresses = self.address_shift + block_start + kept.astype(np.int64) * width
+        nb_pieces = 6 + 7 * width
+        # int32 is enough for a block and halves the memory traffic
+        offsets = np.empty((rows, nb_pieces), dtype=np.int32)
+        lengths = np.empty((rows, nb_pieces), dtype=np.int32)
+        address_color = ColoredHexDump.ALLOWED_COLORS.index(self.address_color)
+        if addresses[-1] < 1 << 32:
+            # 8 lowercase hex digits per address
+            digits = (addresses[:, None] >> np.arange(28, -1, -4)) & 0xF
+            palette = np.concatenate((base_palette, np.frombuffer(b'0123456789abcdef', dtype=np.uint8)[digits].ravel()))
+            offsets[:, 0], lengths[:, 0] = state.numpy.prefixes[address_color]
+            offsets[:, 1] = len(base_palette) + 8 * np.arange(rows)
+            lengths[:, 1] = 8
+            offsets[:, 2], lengths[:, 2] = state.numpy.suffixes[address_color]
+        else:
+            wrap = self.__html_wrap if state.format == 'html' else partial(self.__colorize, state)
+            addresses = [wrap(f'{addr:08x}', self.address_color).encode() for addr in addresses.tolist()]
+            palette = np.concatenate((base_palette, np.frombuffer(b''.join(addresses), dtype=np.uint8)))
+            lengths[:, 0] = [len(addr) for addr in addresses]
+            offsets[:, 0] = len(base_palette) + np.cumsum(lengths[:, 0]) - lengths[:, 0]
+            offsets[:, 1:3] = 0
+            lengths[:, 1:3] = 0
+        offsets[:, 3], lengths[:, 3] = state.numpy.separator
+        hex_offsets = offsets[:, 4:4 + 4 * width].reshape(rows, width, 4)
+        hex_lengths = lengths[:, 4:4 + 4 * width].reshape(rows, width, 4)
+        ascii_offsets = offsets[:, 5 + 4 * width:5 + 7 * width].reshape(rows, width, 3)
+        ascii_lengths = lengths[:, 5 + 4 * width:5 + 7 * width].reshape(rows, width, 3)
+        for part_offsets, part_lengths, values, prefixes, suffixes in (
+                (hex_offsets, hex_lengths, state.numpy.hex, hex_prefixes, hex_suffixes),
+                (ascii_offsets, ascii_lengths, state.numpy.ascii, ascii_prefixes, ascii_suffixes)):
+            part_offsets[..., 0] = prefixes[codes, 0]
+            part_lengths[..., 0] = prefixes[codes, 1] * opening
+            part_offsets[..., 1] = values[block, 0]
+            part_lengths[..., 1] = values[block, 1]
+            part_offsets[..., 2] = suffixes[codes, 0]
+            part_lengths[..., 2] = suffixes[codes, 1] * closing
+        hex_offsets[..., 3], hex_lengths[..., 3] = state.numpy.space
+        offsets[:, 4 + 4 * width], lengths[:, 4 + 4 * width] = state.numpy.separator
+        offsets[:, -1], lengths[:, -1] = state.numpy.newline
+
+        offsets = offsets.ravel()
+        lengths = lengths.ravel()
+        ends = np.cumsum(lengths, dtype=np.int32)
+        indexes = np.arange(ends[-1], dtype=np.int32) + np.repeat(offsets - ends + lengths, lengths)
+        return palette[indexes].tobytes(), lengths.reshape(rows, nb_pieces).sum(axis=1)
+
+    def format_columns_names(self, margin: str = '', output_format: str = None) -> str:
+        # output_format is one of OUTPUT_FORMATS (self.output_format by default), like the one of iter_lines
+        return self.__format_columns_names(self.__new_state(output_format), margin)
+
+    def __format_columns_names(self, state: _RenderState, margin: str = '') -> str:
+        names = [f'{i:02X}' for i in range(self.chunk_length)]
+        if self.merge_escapes:
+            names = self.__colorize(state, ' '.join(names), self.title_color) + ' '
+        else:
+            names = ''.join(self.__colorize(state, x, self.title_color) + ' ' for x in names)
+        return (margin + self.__colorize(state, '  Offset', self.title_color) + self.column_separator + names
+                + self.column_separator + '\n')
+
+    def __line_hidden(self, data, base: int, start: int, end: int, offset: int) -> bool:
+        # whether the line at offset is replaced by a snip (or by nothing)
+        # only the lines which are not the first or last line of the dump can be hidden
+        if offset == start or end - offset < 2 * self.chunk_length:
+            return False
+        chunk = data[offset - base:offset + self.chunk_length - base]
+        return ((self.hide_null_lines and chunk == self.__content_to_hide)
+                or (self.hide_repeated_lines and chunk == data[offset - self.chunk_length - base:offset - base]))
+
+    def __hidden_limit(self, start: int, end: int, last: int) -> int:
+        # the lines which can be hidden are before this offset
+        if end - start < 2 * self.chunk_length:
+            return start
+        return min(last, start + ((end - start) // self.chunk_length - 1) * self.chunk_length)
+
+    def __iter_lines(self, state: _RenderState, data, start: int, end: int, base: int = 0, segment=None, fileno=None):
+        # data is any object supporting the buffer protocol (bytes, mmap, memoryview...)
+        # and holds the bytes [base, base + len(data)); the window [start, end) is rendered.
+        # if segment is provided, only the lines of the window in [segment[0], segment[1]) are
+        # rendered (segment[0] must be the start of a line of the window).
+        # fileno is the file of data, if any: its holes are skipped without being read.
+        # state is the one of the output, whose format is 'ansi', 'plain', 'jsonl' (see output_format)
+        # or 'html' (see write_html).
+        # the chunks are views on data: nothing is copied until a line is formatted
+        source = data
+        data = memoryview(data)
+        first, last = (start, end) if segment is None else segment
+        if state.format in ('ansi', 'html'):
+            self.__select_runs(state, first, last, titles=state.format == 'html')
+        elif state.format == 'jsonl':
+            state.json_next, state.json_active = bisect_right(self.range_table.max_ends, first), []
+            if self.stats is not None:
+                self.stats.count('range lookups')
+        format_chunk, format_snip = {
+            'ansi': (partial(self.__format_chunk, state), partial(self.__format_snip, state)),
+            'plain': (self.__format_plain_chunk, partial(self.__format_snip, state)),
+            'jsonl': (partial(self.__format_json_chunk, state), self.__format_json_snip),
+            'html': (partial(self.__format_html_chunk, state), self.__format_html_snip),
+        }[state.format]
+        # a hidden line starts a snip unless it is identical to the previous line, which is hidden.
+        # the snip state is the one left by the previous line of the window
+        hide_mode = first > start and self.__line_hidden(data, base, start, end, first - self.chunk_length)
+        # once a line is hidden, the following identical lines are skipped at once
+        limit = self.__hidden_limit(start, end, last)
+        if self.__numpy_renderer_enabled(state, last - first):
+            snipped = yield from self.__iter_blocks_numpy(state, source, data, start, end, base, first, last,
+                                                          hide_mode, limit, fileno)
+            self.__count_lines(first, last, snipped)
+            return
+        released = first
+        length = self.chunk_length
+        chunk_offset = first
+        # number of hidden lines
+        snipped = 0
+        while chunk_offset < last:
+            if chunk_offset - released >= RELEASE_STEP:
+                release_pages(source, released - base, chunk_offset - base)
+                released = chunk_offset
+            chunk = data[chunk_offset - base:min(chunk_offset + length, end) - base]
+            addr = self.address_shift + chunk_offset
+            # check only if an option is enabled and it's not the first or last line of the dump
+            if chunk_offset != start and end - chunk_offset >= 2 * length and (
+                    (self.hide_null_lines and chunk == self.__content_to_hide)
+                    or (self.hide_repeated_lines and chunk == data[chunk_offset - length - base:chunk_offset - base])):
+                if not (hide_mode and chunk == data[chunk_offset - length - base:chunk_offset - base]):
+                    yield format_snip(addr)
+                hide_mode = True
+                next_offset = skip_repeated_lines(source, base, chunk_offset + length, limit, bytes(chunk), fileno)
+                snipped += (next_offset - chunk_offset) // length
+                chunk_offset = next_offset
+                continue
+            hide_mode = False
+            yield format_chunk(addr, chunk, chunk_offset)
+            chunk_offset += length
+        release_pages(source, released - base, last - base)
+        self.__count_lines(first, last, snipped)
+
+    def __count_lines(self, first: int, last: int, snipped: int):
+        # counts the bytes and lines of [first, last) once rendered, snipped being the number of hidden lines
+        if self.stats is not None:
+            lines = -(-(last - first) // self.chunk_length)
+            self.stats.count('bytes rendered', last - first)
+            self.stats.count('lines rendered', lines - snipped)
+            self.stats.count('lines snipped', snipped)
+
+    def __iter_blocks_numpy(self, state: _RenderState, source, data, start: int, end: int, base: int, first: int,
+                            last: int, hide_mode: bool, limit: int, fileno):
+        # same as the loop of __iter_lines, but yields the text of blocks of lines.
+        # returns the number of hidden lines if they are counted (see stats), 0 otherwise
+        block_length = ColoredHexDump.NUMPY_BLOCK_LINES * self.chunk_length
+        format_snip = self.__format_html_snip if state.format == 'html' else partial(self.__format_snip, state)
+        counted = self.stats is not None
+        snipped = 0
+        block_start = first
+        while block_start < last:
+            block_end = min(block_start + block_length, last)
+            hidden, same = self.__hidden_lines(data, base, start, end, block_start, block_end)
+            output, line_ends = self.__format_block_numpy(state, data, base, block_start, block_end, hidden)
+            text = []
+            written = 0
+            # the first line of a run of identical hidden lines is replaced by a snip
+            previous_hidden = np.empty_like(hidden)
+            previous_hidden[0] = hide_mode
+            previous_hidden[1:] = hidden[:-1]
+            for line in np.flatnonzero(hidden & ~(previous_hidden & same)).tolist():
+                text.append(output[written:line_ends[line]].decode())
+                text.append(format_snip(self.address_shift + block_start + line * self.chunk_length))
+                written = line_ends[line]
+            text.append(output[written:].decode())
+            yield ''.join(text)
+            hide_mode = bool(hidden[-1])
+            release_pages(source, block_start - base, block_end - base)
+            if counted:
+                snipped += int(np.count_nonzero(hidden))
+            block_start = block_end
+            if hide_mode:
+                # the lines identical to the last one are hidden too
+                block_start = skip_repeated_lines(source, base, block_end, limit,
+                                                  bytes(data[block_end - self.chunk_length - base:block_end - base]),
+                                                  fileno)
+                snipped += (block_start - block_end) // self.chunk_length
+        return snipped
+
+    def __hidden_lines(self, data, base: int, start: int, end: int, block_start: int, block_end: int):
+        # flags the lines of [block_start, block_end) that are never printed as such
+        # because hide_null_lines or hide_repeated_lines replaces them by a snip (or by nothing),
+        # and the lines identical to the previous one
+        line_starts = np.arange(block_start, block_end, self.chunk_length)
+        hidden = np.zeros(len(line_starts), dtype=bool)
+        same = np.zeros(len(line_starts), dtype=bool)
+        if not self.hide_null_lines and not self.hide_repeated_lines:
+            return hidden, same
+        full_lines = (block_end - block_start) // self.chunk_length
+        # the previous line is needed to find repeated lines
+        lines_start = block_start - self.chunk_length if block_start > start else block_start
+        rows = np.frombuffer(data[lines_start - base:block_start + full_lines * self.chunk_length - base],
+                             dtype=np.uint8).reshape(-1, self.chunk_length)
+        if self.hide_repeated_lines:
+            same[1 - len(rows) + full_lines:full_lines] = (rows[1:] == rows[:-1]).all(axis=1)
+            hidden |= same
+        else:
+            # the hidden lines only hold zeros
+            same[:] = True
+        if self.hide_null_lines:
+            hidden[:full_lines] |= ~rows[len(rows) - full_lines:].any(axis=1)
+        # only the lines which are not the first or last line of the dump
+        hidden &= (line_starts != start) & (end - line_starts >= 2 * self.chunk_length)
+        return hidden, same
+
+    def format_lines(self, data, first: int, last: int, base: int = 0) -> list:
+        """Returns the text of each line of [first, last), none of them being hidden.
+
+        data holds the bytes [base, base + len(data)) and first is the start of a line.
+        Only the ranges overlapping [first, last) are resolved when it is small, so that
+        a few lines of a large file can be rendered on demand (eg. by the pager).
+        """
+        data = memoryview(data)
+        end = min(last, base + len(data))
+        state = self.__new_state()
+        self.__select_runs(state, first, end)
+        return [self.__format_chunk(state, self.address_shift + offset,
+                                    data[offset - base:min(offset + self.chunk_length, end) - base], offset)
+                for offset in range(first, end, self.chunk_length)]
+
+    def _render_segment(self, data, start: int, end: int, segment, fileno=None, output_format: str = 'ansi') -> str:
+        # called by the workers of a parallel rendering
+        return ''.join(self.__iter_lines(self.__new_state(output_format), data, start, end, segment=segment,
+                                         fileno=fileno))
+
+    def __iter_parallel_blocks(self, state: _RenderState, filepath, start: int, end: int, jobs: int):
+        # yields the rendering of consecutive segments of [start, end), made by a pool of processes.
+        # with the fork start method, the workers inherit the runs of all the ranges (built here if
+        # they are needed) and the escape sequences without pickling them, and they map the file themselves.
+        segment_length = max(1, ColoredHexDump.PARALLEL_SEGMENT // self.chunk_length) * self.chunk_length
+        import multiprocessing
+        if state.format == 'ansi':
+            self.__select_runs(state, start, end)
+        if self.stats is not None:
+            # the lines are counted by the workers, which do not report them
+            self.stats.count('bytes rendered', end - start)
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        with context.Pool(jobs, _init_worker, (self, str(filepath), start, end, state.format)) as pool:
+            pending = deque()
+            for first in range(start, end, segment_length):
+                segment = (first, min(first + segment_length, end))
+                pending.append(pool.apply_async(_render_segment, (segment, )))
+                # bounds the number of rendered segments waiting to be written
+                if len(pending) > 2 * jobs:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+    def __iter_changed_lines(self, differences, start: int):
+        # yields (line offset, [(start, end) of the differences in the line]) for each line
+        # of the window starting at start holding a difference
+        line, runs = None, []
+        for run_start, run_end in differences:
+            first = start + (run_start - start) // self.chunk_length * self.chunk_length
+            for line_start in range(first, run_end, self.chunk_length):
+                if line_start != line:
+                    if line is not None:
+                        yield line, runs
+                    line, runs = line_start, []
+                runs.append((max(run_start, line_start), min(run_end, line_start + self.chunk_length)))
+        if line is not None:
+            yield line, runs
+
+    def __iter_diff_lines(self, state: _RenderState, sources, start: int, end: int, differences, context: int):
+        # sources are the (name, data, base, end) of both files, end the end of the longest one.
+        # yields the lines holding differences, with up to `context` identical lines
+        # around them (once), grouped in hunks like a unified diff:
+        # "-" lines are the ones of the first file, "+" lines the ones of the second file
+        (name_a, data_a, base_a, end_a), (name_b, data_b, base_b, end_b) = sources
+        data_a, data_b = memoryview(data_a), memoryview(data_b)
+        length = self.chunk_length
+        yield self.__colorize(state, f'--- {name_a}', self.removed_color) + '\n'
+        yield self.__colorize(state, f'+++ {name_b}', self.added_color) + '\n'
+
+        def format_line(marker, data, base, data_end, line, color_runs):
+            state.run_starts, state.run_ends, state.run_colors = color_runs
+            chunk = data[line - base:min(line + length, data_end) - base]
+            return marker + self.__format_chunk(state, self.address_shift + line, chunk, line)
+
+        def context_lines(first, last):
+            # identical lines of [first, last)
+            for line in range(max(first, start), min(last, end), length):
+                yield format_line(' ', data_a, base_a, end_a, line, ([], [], []))
+
+        removed, added = self.__colorize(state, '-', self.removed_color), self.__colorize(state, '+', self.added_color)
+        previous = None
+        changed_bytes = 0
+        for line, runs in self.__iter_changed_lines(differences, start):
+            changed_bytes += sum(run_end - run_start for run_start, run_end in runs)
+            if previous is None or line - previous > (2 * context + 1) * length:
+                if previous is not None:
+                    yield from context_lines(previous + length, previous + (context + 1) * length)
+                hunk_start = max(start, line - context * length)
+                yield self.__colorize(state, f'@@ {self.address_shift + hunk_start:08x} @@', self.title_color) + '\n'
+                yield from context_lines(hunk_start, line)
             else:
-                self.__print_chunk(addr, chunk, chunk_offset)
+                yield from context_lines(previous + length, line)
+            starts = [run_start for run_start, _ in runs]
+            ends = [run_end for _, run_end in runs]
+            if line < end_a:
+                yield format_line(removed, data_a, base_a, end_a, line, (starts, ends, [self.removed_color] * len(runs)))
+            if line < end_b:
+                yield format_line(added, data_b, base_b, end_b, line, (starts, ends, [self.added_color] * len(runs)))
+            previous = line
+        if previous is not None:
+            yield from context_lines(previous + length, previous + (context + 1) * length)
+        _logger.info(f'{changed_bytes} bytes differ')
+
+    def __write(self, state: _RenderState, lines, margin: str = '', output=None, flush: bool = False):
+        # lines (or blocks of lines) of the output of state are gathered in a buffer and written with a single call
+        # to output (stdout by default).
+        # margin is written before the columns names (lines starting with a marker).
+        # if flush is set, each item of lines is written and flushed at once
+        output = sys.stdout if output is None else output
+        write = output.write
+        if self.stats is not None:
+            write = self.stats.timed(write, 'write')
+        if state.format == 'html':
+            columns_names = self.__format_html_columns_names()
+        elif state.format == 'jsonl':
+            # the output only holds JSON objects
+            columns_names = ''
+        else:
+            columns_names = self.__format_columns_names(state, margin)
+        buffer = []
+        size = 0
+        if self.show_columns_name_at_start:
+            buffer.append(columns_names)
+        written = 0
+        for line in lines:
+            buffer.append(line)
+            size += len(line)
+            if size >= ColoredHexDump.WRITE_SIZE or flush:
+                text = ''.join(buffer)
+                write(text)
+                written += len(text)
+                buffer.clear()
+                size = 0
+                if flush:
+                    output.flush()
         if self.show_columns_name_at_end:
-            self.__print_columns_names()
+            buffer.append(columns_names)
+        text = ''.join(buffer)
+        write(text)
+        if self.stats is not None:
+            self.stats.count('characters written', written + len(text))
+
+    def iter_lines(self, source, start: int = None, end: int = None, output_format: str = None):
+        """Returns a generator of the rendered lines of the window [start, end) of source: each item
+        is a line or a block of lines, ending with a newline. The columns names are not included
+        (see format_columns_names).
+
+        source is data supporting the buffer protocol (bytes, bytearray, memoryview, mmap...), a path
+        or a binary file object: files are mapped in memory, only the pages of the window being read.
+        The other file objects (pipes, sockets, decompressed files...) are read by blocks from their
+        current position (see iter_stream_lines). The lines are rendered when they are pulled and
+        nothing is accumulated; closing the generator ends the mapping.
+        output_format is one of OUTPUT_FORMATS (self.output_format by default), 'auto' depending on stdout
+        when the first line is pulled. Each generator keeps the state of its output: the generators of
+        an instance can be pulled in turn, but an instance must not be used by several threads.
+        """
+        assert start is None or start >= 0
+        assert end is None or end >= 0
+        assert output_format is None or output_format in ColoredHexDump.OUTPUT_FORMATS
+        yield from self.__iter_source(self.__new_state(output_format), source, start or 0, end)
+
+    def iter_stream_lines(self, stream, start: int = None, end: int = None, output_format: str = None):
+        """Same as iter_lines, but the binary file object is read by blocks (of up to STREAM_BLOCK bytes)
+        from its current position, which is the offset 0: each item is the text of the lines rendered
+        after a read, so the lines come out as the data arrives.
+
+        The memory used does not depend on the length of the stream, which may be endless. As the end
+        is not known, if hide_null_lines or hide_repeated_lines is set, a line is only rendered once
+        the following line is complete: the last line of the dump is never hidden.
+        """
+        assert start is None or start >= 0
+        assert end is None or end >= 0
+        assert output_format is None or output_format in ColoredHexDump.OUTPUT_FORMATS
+        yield from self.__iter_stream(self.__new_state(output_format), stream, start or 0, end)
+
+    def __iter_source(self, state: _RenderState, source, start: int, end: int):
+        # yields the lines of [start, end) of source (see iter_lines), end being the end of source if None
+        if hasattr(source, 'getbuffer'):
+            source = source.getbuffer()
+        elif hasattr(source, 'read') and not mappable(source):
+            yield from self.__iter_stream(state, source, start, end)
+            return
+        if isinstance(source, (str, os.PathLike)) or hasattr(source, 'read'):
+            length = None if end is None else max(0, end - start)
+            with map_file(source, start, length) as (data, base), \
+                    (open(source, 'rb') if isinstance(source, (str, os.PathLike)) else nullcontext(source)) as fd:
+                # fd is used to find the holes of sparse files
+                yield from self.__iter_lines(state, data, max(start, base), base + len(data), base, fileno=fd.fileno())
+            return
+        if not isinstance(source, (bytes, bytearray, mmap.mmap)):
+            # the offsets are the ones of the bytes (eg. of a memoryview on an array of integers)
+            source = memoryview(source).cast('B')
+        size = len(source)
+        first = min(start, size)
+        yield from self.__iter_lines(state, source, first, max(first, size if end is None else min(size, end)))
+
+    def __iter_stream(self, state: _RenderState, stream, start: int, end: int):
+        # yields the text of the lines of [start, end) of the stream rendered after each read (see iter_stream_lines)
+        read = getattr(stream, 'read1', stream.read)
+        position = 0
+        while position < start:
+            block = read(min(ColoredHexDump.STREAM_BLOCK, start - position))
+            if not block:
+                return
+            position += len(block)
+        length = self.chunk_length
+        # data holds the bytes [base, base + len(data)): the lines before first are rendered,
+        # the 2 lines before first are kept to know whether first is hidden
+        data, base, first = b'', start, start
+        complete = False
+        while not complete:
+            blocks, size = [data], 0
+            # the reads go on while the data is ready and the block is not full
+            while True:
+                wanted = ColoredHexDump.STREAM_BLOCK - size
+                if end is not None:
+                    wanted = min(wanted, end - base - len(data) - size)
+                block = read(wanted) if wanted > 0 else b''
+                if not block:
+                    complete = True
+                    break
+                blocks.append(block)
+                size += len(block)
+                if size >= ColoredHexDump.STREAM_BLOCK or not data_ready(stream):
+                    break
+            data = b''.join(blocks)
+            data_end = base + len(data)
+            if complete:
+                last = data_end
+            elif self.hide_null_lines or self.hide_repeated_lines:
+                # a line is hidden only if it is followed by a complete line (see __line_hidden)
+                last = max(first, start + (data_end - start - length) // length * length)
+            else:
+                last = start + (data_end - start) // length * length
+            if last > first:
+                text = ''.join(self.__iter_lines(state, data, start, data_end, base, segment=(first, last)))
+                if text:
+                    yield text
+                first = last
+            kept = max(start, first - 2 * length)
+            data, base = data[kept - base:], kept
 
-    def print_file(self, filepath: str):
+    def print(self, data, offset: int = 0, length: int = None):
+        # only the window [offset, offset + length) of data is printed if provided
+        assert offset >= 0
+        assert length is None or length >= 0
+        state = self.__new_state()
+        self.__write(state, self.__iter_source(state, data, offset, None if length is None else offset + length))
+
+    def print_stream(self, stream, offset: int = 0, length: int = None):
+        """Prints the window [offset, offset + length) of a binary stream (eg. sys.stdin.buffer) as it is read,
+        the output being flushed after each read (see iter_stream_lines)."""
+        assert offset >= 0
+        assert length is None or length >= 0
+        state = self.__new_state()
+        self.__write(state, self.__iter_stream(state, stream, offset, None if length is None else offset + length),
+                     flush=True)
+
+    def print_file(self, filepath: str, offset: int = 0, length: int = None, jobs: int = 1):
+        # only the pages holding the window [offset, offset + length) are read
+        # if jobs > 1, large windows are rendered by a pool of jobs processes
+        assert offset >= 0
+        assert jobs > 0
+        assert length is None or length >= 0
         path = Path(filepath)
         if not path.exists() or not path.is_file():
             _logger.error(f'Check {filepath} is a file')
             return
-        
-        with path.open('rb') as fd:
-            offset = 0
-            if self.show_columns_name_at_start:
-                self.__print_columns_names()
-            while True:
-                chunks = fd.read(4096) # self.chunk_length)
-                if not chunks:
-                    break
-                for chunk_offset in range(0, len(chunks), self.chunk_length):
-                    chunk = chunks[chunk_offset:chunk_offset + self.chunk_length]
-                    addr = self.address_shift + offset + chunk_offset
-
-                    self.__print_chunk(addr, chunk, offset + chunk_offset)
-                offset += len(chunks)
-
-                # addr = self.address_shift + offset
-                # self.__print_chunk(addr, chunk, offset)
-                # offset += len(chunk)
-            if self.show_columns_name_at_end:
-                self.__print_columns_names()
+
+        state = self.__new_state()
+        size = path.stat().st_size
+        end = size if length is None else min(size, offset + length)
+        if jobs > 1 and end - offset > ColoredHexDump.PARALLEL_SEGMENT:
+            self.__write(state, self.__iter_parallel_blocks(state, path, offset, end, jobs))
+        else:
+            self.__write(state, self.__iter_source(state, path, offset, end))
+
+    def print_diff(self, filepath_a: str, filepath_b: str, offset: int = 0, length: int = None, context: int = 3):
+        """Prints the lines of the window [offset, offset + length) which differ between two files,
+        with `context` identical lines around them; the bytes which differ are colored.
+
+        The files are mapped in memory and compared by large blocks: only the blocks which
+        differ are compared byte by byte. Nothing is printed if the windows are identical.
+        """
+        assert offset >= 0
+        assert context >= 0
+        assert length is None or length >= 0
+        paths = Path(filepath_a), Path(filepath_b)
+        for path in paths:
+            if not path.exists() or not path.is_file():
+                _logger.error(f'Check {path} is a file')
+                return
+        # imported here as it is not needed by the dumps
+        from cxd.binary_diff import iter_differences
+
+        with map_file(paths[0], offset, length) as (data_a, base_a), map_file(paths[1], offset, length) as (data_b, base_b), \
+                paths[0].open('rb') as fd_a, paths[1].open('rb') as fd_b:
+            end_a, end_b = max(offset, base_a + len(data_a)), max(offset, base_b + len(data_b))
+            differences = iter_differences(data_a, base_a, data_b, base_b, offset, end_a, end_b,
+                                           fd_a.fileno(), fd_b.fileno())
+            first = next(differences, None)
+            if first is None:
+                _logger.info(f'{paths[0]} and {paths[1]} are identical')
+                return
+            sources = (str(paths[0]), data_a, base_a, end_a), (str(paths[1]), data_b, base_b, end_b)
+            # the diff is written as text: without colors in the plain and jsonl formats
+            state = self.__new_state()
+            self.__write(state, self.__iter_diff_lines(state, sources, offset, max(end_a, end_b),
+                                                       chain((first, ), differences), context), ' ')
+
+    def write_html(self, filepath: str, output: str, offset: int = 0, length: int = None):
+        """Writes the dump of the window [offset, offset + length) of the file as an HTML page to output.
+
+        The colors are CSS classes, the runs of bytes of a color being wrapped in a single span,
+        and the comments of the ranges are the tooltips of the hex bytes. The lines are rendered
+        and written by blocks, reading the file through a mmap.
+        """
+        assert offset >= 0
+        assert length is None or length >= 0
+        path = Path(filepath)
+        if not path.exists() or not path.is_file():
+            _logger.error(f'Check {filepath} is a file')
+            return
+
+        with open(output, 'w', encoding='utf-8') as out:
+            out.write(self.__format_html_header(path.name))
+            state = self.__new_state('html')
+            self.__write(state, self.__iter_source(state, path, offset, None if length is None else offset + length),
+                         output=out)
+            out.write('</pre>\n</body>\n</html>\n')
+
+    def page_file(self, filepath: str, offset: int = 0):
+        """Browses the file in the terminal from offset, rendering only the lines on screen (see HexPager)."""
+        assert offset >= 0
+        path = Path(filepath)
+        if not path.exists() or not path.is_file():
+            _logger.error(f'Check {filepath} is a file')
+            return
+        # imported here as it is not needed by the dumps
+        from cxd.pager import HexPager
+
+        with map_file(path) as (data, base):
+            pager = HexPager(self, data, base, str(path))
+            pager.goto(offset)
+            pager.run()
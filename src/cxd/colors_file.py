@@ -0,0 +1,123 @@
+"""
+Reading and writing of colors ranges files.
+
+A colors file is either:
+  - a text file, each line being 'offset_start,count[,color[,comment]]' (decimal or 0x... values)
+  - a binary ranges file (see cxd.ranges_file), recognized by its magic
+"""
+
+import logging
+import re
+from array import array
+from itertools import repeat
+from pathlib import Path
+
+from cxd.data_source import map_file
+from cxd.range_table import RangeTable
+from cxd.ranges_file import dump_ranges, is_ranges_file, load_range_table
+
+__author__ = "malware4n6"
+__copyright__ = "malware4n6"
+__license__ = "The Unlicense"
+
+_logger = logging.getLogger(__name__)
+
+
+# suffix of the files written in the binary format by write_colors_ranges
+BINARY_SUFFIX = '.ranges'
+
+
+# size of the blocks of text parsed at once
+READ_SIZE = 8 * 1024 * 1024
+_NUMBER = r'[ \t]*(0[xX][0-9a-fA-F]+|[0-9]+)[ \t]*'
+# a line is either correct (groups 1 to 4: offset, count, color, comment) or not (group 5)
+_LINE_REGEX = re.compile(r'^[ \t]*(?:' + _NUMBER + ',' + _NUMBER + r'(?:,([^,\r\n]*)(?:,([^\r\n]*))?)?'
+                         r'|(\S[^\r\n]*))\r?$', re.M)
+
+
+def _to_ints(fields) -> array:
+    try:
+        return array('q', map(int, fields, repeat(0)))
+    except ValueError:
+        # decimal values with leading zeros
+        return array('q', [int(x, 16) if x[1:2] in 'xX' else int(x) for x in fields])
+
+
+def _iter_text_blocks(fd):
+    # yields blocks of complete lines
+    remainder = ''
+    while True:
+        block = fd.read(READ_SIZE)
+        if not block:
+            if remainder:
+                yield remainder
+            return
+        block = remainder + block
+        cut = block.rfind('\n') + 1
+        remainder = block[cut:]
+        if cut:
+            yield block[:cut]
+
+
+def read_colors_ranges(colors_file, allowed_colors=None) -> RangeTable:
+    """Returns the RangeTable of the ranges of a colors file (text or binary).
+
+    A binary file is mapped in memory. A text file is parsed by blocks of lines; comments
+    are kept, and the incorrect lines (bad numbers, colors not in `allowed_colors`)
+    are logged and skipped.
+    Raises OSError if the file can not be read, ValueError if a binary file is corrupted.
+    """
+    with map_file(colors_file, 0, 8) as (head, _):
+        binary = is_ranges_file(head)
+    if binary:
+        with map_file(colors_file) as (data, _):
+            table = load_range_table(data)
+        _logger.info(f'{len(table)} colors ranges read from {colors_file}')
+        return table
+
+    starts, lengths, color_ids = array('q'), array('q'), array('H')
+    colors = [None]
+    # an empty color field is a range without color
+    colors_ids = {'': 0}
+    comments = []
+    bad_lines = 0
+    with Path(colors_file).open('r', encoding='utf-8', errors='replace', newline='') as fd:
+        for block in _iter_text_blocks(fd):
+            rows = _LINE_REGEX.findall(block)
+            if any(row[4] for row in rows):
+                for row in rows:
+                    if row[4]:
+                        _logger.warning(f'{colors_file}: incorrect line: {row[4]}')
+                        bad_lines += 1
+                rows = [row for row in rows if not row[4]]
+            block_colors = {row[2].strip() for row in rows}
+            for color in block_colors - colors_ids.keys():
+                if allowed_colors is not None and color not in allowed_colors:
+                    _logger.warning(f'{colors_file}: incorrect color: {color}')
+                    bad_lines += sum(1 for row in rows if row[2].strip() == color)
+                    rows = [row for row in rows if row[2].strip() != color]
+                else:
+                    colors_ids[color] = len(colors)
+                    colors.append(color)
+            starts += _to_ints([row[0] for row in rows])
+            lengths += _to_ints([row[1] for row in rows])
+            color_ids += array('H', [colors_ids[row[2].strip()] for row in rows])
+            # an empty comment is written for the ranges without comment
+            comments += [row[3] or None for row in rows]
+    if bad_lines:
+        _logger.warning(f'{bad_lines} incorrect lines ignored in {colors_file}')
+    _logger.info(f'{len(starts)} colors ranges read from {colors_file}')
+    return RangeTable.from_columns(starts, lengths, color_ids, colors, comments)
+
+
+def write_colors_ranges(ranges, colors_file) -> None:
+    """Writes `ranges` in `colors_file`: in the binary format if its suffix is BINARY_SUFFIX,
+    as text otherwise (one 'offset_start,count,color,comment' line per range)."""
+    path = Path(colors_file)
+    if path.suffix == BINARY_SUFFIX:
+        with path.open('wb') as fd:
+            dump_ranges(ranges, fd)
+    else:
+        with path.open('w', encoding='utf-8') as fd:
+            for r in ranges:
+                fd.write(str(r) + '\n')
@@ -21,7 +21,13 @@ class Configuration():
             'hide_null_lines': True,
             'stop_at_first_color_found': True,
             'show_columns_name_at_start': True,
-            'show_columns_name_at_end': True
+            'show_columns_name_at_end': True,
+            'merge_escapes': True,
+            'use_numpy': True,
+            'hide_repeated_lines': False,
+            'removed_color': 'red',
+            'added_color': 'green',
+            'output_format': 'auto'
         }
 
         with new_config.open('w') as fd:
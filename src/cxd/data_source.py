@@ -0,0 +1,153 @@
+"""
+Access to the data to dump without loading it in memory.
+"""
+
+import errno
+import io
+import logging
+import mmap
+import os
+import stat
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+__author__ = "malware4n6"
+__copyright__ = "malware4n6"
+__license__ = "The Unlicense"
+
+_logger = logging.getLogger(__name__)
+
+
+# once rendered, the pages of a mapping are given back to the system by blocks of this size
+RELEASE_STEP = 16 * 1024 * 1024
+# size of the blocks compared at once when skipping repeated lines
+SKIP_BLOCK = 1024 * 1024
+
+
+@contextmanager
+def map_file(filepath, offset: int = 0, length: int = None):
+    """Yields (data, base): a read-only mmap on `filepath` and the file offset of its first byte.
+
+    `filepath` may also be a binary file object of a regular file, which is left open
+    (the offsets are the ones of the file, whatever its position).
+    Only the window [offset, offset + length) is mapped (the whole file if length is None),
+    base being offset rounded down to the allocation granularity; the mapping ends with the window.
+    The pages are only read when they are accessed, and the consumer can give them
+    back with `release_pages`, so the resident memory does not depend on the file size.
+    Views on the mapping must not outlive the context.
+    """
+    opened = nullcontext(filepath) if hasattr(filepath, 'fileno') else Path(filepath).open('rb')
+    with opened as fd:
+        size = os.fstat(fd.fileno()).st_size
+        end = size if length is None else min(size, offset + length)
+        if end <= offset:
+            # nothing to map (empty files or windows can not be mapped)
+            yield b'', offset
+            return
+        base = offset - offset % mmap.ALLOCATIONGRANULARITY
+        with mmap.mmap(fd.fileno(), end - base, access=mmap.ACCESS_READ, offset=base) as mapped:
+            if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            yield mapped, base
+
+
+def mappable(fileobj) -> bool:
+    """Whether the binary file object can be mapped by map_file: a regular file read as is
+    (unlike pipes, or decompressed files such as gzip.GzipFile whose fileno is the compressed file)."""
+    if not isinstance(fileobj, (io.FileIO, io.BufferedReader, io.BufferedRandom)):
+        return False
+    try:
+        return stat.S_ISREG(os.fstat(fileobj.fileno()).st_mode)
+    except (OSError, ValueError):
+        # io.UnsupportedOperation is an OSError and a ValueError
+        return False
+
+
+def data_ready(stream) -> bool:
+    """Whether data of the stream (eg. a pipe) can be read without waiting. False if it is not known
+    (eg. on Windows, where only the sockets can be polled)."""
+    try:
+        import select
+        return bool(select.select([stream], [], [], 0)[0])
+    except (ImportError, AttributeError, TypeError, ValueError, OSError):
+        return False
+
+
+def release_pages(data, start: int, end: int):
+    """Drops the pages of [start, end) from the resident memory if `data` is a mmap.
+
+    The content is still readable afterwards: the pages are read again if needed.
+    """
+    if not isinstance(data, mmap.mmap) or not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+    start -= start % mmap.PAGESIZE
+    if end > start:
+        data.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+def next_data(fileno, offset: int):
+    """Returns the offset of the first byte at or after `offset` which is not in a hole
+    of the sparse file `fileno` (the file size if there is only a hole after offset).
+
+    Returns None if it is not known: no file, or holes not supported by the system.
+    """
+    if fileno is None or not hasattr(os, 'SEEK_DATA'):
+        return None
+    try:
+        return os.lseek(fileno, offset, os.SEEK_DATA)
+    except OSError as exc:
+        if exc.errno == errno.ENXIO:
+            # no data after offset
+            return os.fstat(fileno).st_size
+        return None
+
+
+def skip_repeated_lines(data, base: int, offset: int, limit: int, line: bytes, fileno=None) -> int:
+    """Returns the offset of the first line of [offset, limit) whose content is not `line`
+    (or the offset of the last incomplete line, or limit): the lines, of len(line) bytes,
+    start at offset.
+
+    `data` holds the bytes [base, base + len(data)). The lines are compared by blocks of
+    up to SKIP_BLOCK bytes; if `line` only holds zeros, the holes of the sparse file `fileno`
+    are skipped without being read. The pages of a mmap are released once skipped.
+    """
+    size = len(line)
+    assert size > 0
+    zeros = not any(line)
+    max_lines = max(1, SKIP_BLOCK // size)
+    # most runs are short: the blocks grow from a page to SKIP_BLOCK
+    block_lines = min(max_lines, max(1, mmap.PAGESIZE // size))
+    pattern = line * block_lines
+    view = memoryview(data)
+    released = offset
+    while limit - offset >= size:
+        if zeros:
+            data_start = next_data(fileno, offset)
+            if data_start is not None and data_start - offset >= size:
+                # a hole only holds zeros (its pages may still be mapped by the read-ahead)
+                offset += min(data_start - offset, limit - offset) // size * size
+                continue
+        count = min(block_lines, (limit - offset) // size)
+        # bytes comparisons use memcmp, unlike the ones of memoryviews
+        block = bytes(view[offset - base:offset + count * size - base])
+        if not pattern.startswith(block):
+            # the first different line, by bisection of the length of the identical prefix
+            block = memoryview(block)
+            lo, hi = 0, count - 1
+            while lo < hi:
+                middle = (lo + hi) // 2
+                if pattern.startswith(block[:(middle + 1) * size]):
+                    lo = middle + 1
+                else:
+                    hi = middle
+            offset += lo * size
+            break
+        offset += count * size
+        if block_lines < max_lines:
+            block_lines = min(max_lines, 2 * block_lines)
+            pattern = line * block_lines
+        if offset - released >= RELEASE_STEP:
+            release_pages(data, released - base, offset - base)
+            released = offset
+    release_pages(data, released - base, offset - base)
+    return offset
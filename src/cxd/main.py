@@ -4,11 +4,10 @@
 
 import argparse
 import logging
+import os
 import sys
+from contextlib import nullcontext
 from pathlib import Path
-from colorama import just_fix_windows_console
-
-from cxd import __version__
 
 __author__ = "malware4n6"
 __copyright__ = "malware4n6"
@@ -16,14 +15,35 @@ __license__ = "The Unlicense"
 
 _logger = logging.getLogger(__name__)
 
+# the other modules (parsers, cache, colors files, configuration...) are only imported
+# by main() when an option needs them, as cxd may be run thousands of times by scripts
 from cxd.colored_hex_dump import ColoredHexDump
-from cxd.color_range import ColorRange
-from cxd.configuration import Configuration
+
+class VersionAction(argparse.Action):
+    # same as action="version", but importlib.metadata is only imported if the version is requested
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS,
+                 help="show program's version number and exit"):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from cxd import __version__
+        parser.exit(message=f'cxd {__version__}\n')
 
 def import_plugins():
+    # kept for compatibility: imports all the builtin parsers (see cxd.parsers.loader.load_parser)
     from cxd.parsers.loader import load_parsers
     return load_parsers()
 
+def read_colors_ranges(colors_file):
+    # kept for the scripts importing it from here: see cxd.colors_file.read_colors_ranges
+    # (imported when called, as the colors files are only read with option -c)
+    from cxd.colors_file import read_colors_ranges as read
+    return read(colors_file, ColoredHexDump.ALLOWED_COLORS)
+
+def auto_int(value):
+    # accepts decimal and hexadecimal (0x...) values
+    return int(value, 0)
+
 def parse_args(args):
     """Parse command line parameters
 
@@ -35,14 +55,43 @@ def parse_args(args):
       :obj:`argparse.Namespace`: command line parameters namespace
     """
     parser = argparse.ArgumentParser(description="Colored Hex Dump")
-    parser.add_argument("--version", action="version", version="cxd {ver}".format(ver=__version__))
-    parser.add_argument("-d", "--data", help="path to some data", type=str)
+    parser.add_argument("--version", action=VersionAction)
+    parser.add_argument("-d", "--data", help="path to some data (stdin if it is - or missing: the data is printed "
+                                             "as it is read)", type=str)
+    parser.add_argument("--diff", help="print the lines which differ between two files", nargs=2, metavar=("A", "B"))
+    parser.add_argument("-P", "--pattern", dest="patterns", action="append", default=[],
+                        help="color the matches of a hex pattern (eg. '4D 5A ?? 00', ?? matching any byte) "
+                             "or of a regex pattern (eg. 're:https?://'). Can be repeated", type=str)
+    parser.add_argument("--patterns-file", help="path to patterns, one per line (lines starting with # are ignored)",
+                        type=str)
+    parser.add_argument("-C", "--context", help="number of identical lines printed around the differences (default: 3)",
+                        type=int, default=3)
     parser.add_argument("-c", "--colors",
-                        help="path to colors ranges. Each line contains 'offset_start,count,color[,comment]'",
+                        help="path to colors ranges. Each line contains 'offset_start,count,color[,comment]' "
+                             "(or binary ranges written by -po)",
                         type=str)
     parser.add_argument("-k", "--configuration", help="path to configuration (use `cxd_genconf` to generate it)", type=str)
     parser.add_argument("-p", "--parser", help="parser to use. Takes precedence over option colors", type=str)
-    parser.add_argument("-po", "--parser-output", help="location to store parser output", type=str)
+    parser.add_argument("-po", "--parser-output",
+                        help="location to store parser output (binary format if it ends with .ranges)", type=str)
+    cache = parser.add_mutually_exclusive_group()
+    cache.add_argument("--no-cache", help="do not read nor write the parsers cache", action="store_true")
+    cache.add_argument("--refresh-cache", help="run the parser and replace its cached output", action="store_true")
+    cache.add_argument("--clear-cache", help="remove all the cached parsers outputs", action="store_true")
+    parser.add_argument("-s", "--offset", help="offset of the first byte to dump (decimal or 0x...)", type=auto_int, default=0)
+    window = parser.add_mutually_exclusive_group()
+    window.add_argument("-l", "--length", help="number of bytes to dump (decimal or 0x...)", type=auto_int)
+    window.add_argument("-n", "--lines", help="number of lines to dump", type=int)
+    parser.add_argument("-F", "--format", help="format of the dump (default: ansi on a terminal, plain otherwise)",
+                        choices=ColoredHexDump.OUTPUT_FORMATS, dest="output_format")
+    parser.add_argument("--html", help="write the dump as an HTML page to this path", type=str, metavar="OUTPUT")
+    parser.add_argument("-i", "--interactive", help="browse the data in the terminal (only the lines on screen are rendered)",
+                        action="store_true")
+    parser.add_argument("-j", "--jobs", help="number of processes rendering the dump (0: one per CPU)", type=int, default=1)
+    parser.add_argument("--stats", help="print the time and memory of each stage of the run and counters to stderr, "
+                                        "as a table or as JSON", nargs="?", const="text", choices=("text", "json"))
+    parser.add_argument("--profile", help="write the cProfile statistics of the run to this path "
+                                          "(and the slowest functions to stderr)", type=str, metavar="OUTPUT")
     parser.add_argument("-v", "--verbose", dest="loglevel", help="set loglevel to INFO",
                         action="store_const", const=logging.INFO)
     parser.add_argument("-vv", "--very-verbose", dest="loglevel", help="set loglevel to DEBUG",
@@ -60,45 +109,6 @@ def setup_logging(loglevel):
         level=loglevel, stream=sys.stdout, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
     )
 
-def read_colors_ranges(colors_file):
-    # TODO: improve parsing, maybe using `csv` package
-    colors_path = Path(colors_file)
-    if not colors_path.exists() or not colors_path.is_file():
-        _logger.fatal(f'Colors ranges can not be read from {colors_file}')
-        sys.exit(0)
-    ret = []
-    with colors_path.open('r') as fd:
-        for curline in fd.readlines():
-            curline = curline.strip()
-            if curline:
-                _logger.debug(f'{curline=}')
-                body = curline.split(',')
-                _logger.debug(body)
-                start = body[0]
-                if '0x' in start:
-                    start = int(start, 16)
-                else:
-                    start = int(start)
-
-                length = body[1]
-                if '0x' in length:
-                    length = int(length, 16)
-                else:
-                    length = int(length)
-
-                if len(body) == 2:
-                    ret.append(ColorRange(start, length))
-                elif len(body) >= 3:
-                    color = body[2]
-                    if color in ColoredHexDump.ALLOWED_COLORS:
-                        ret.append(ColorRange(start, length, color))
-                    else:
-                        _logger.info(f'Incorrect line due to color: {curline}')
-                    # comment field is not considered. if needed, the file
-                    # being self-explanatory, one can read it to understand
-                    # its own comment
-    return ret
-
 def main(args):
     """
     Args:
@@ -108,43 +118,159 @@ def main(args):
     args = parse_args(args)
     setup_logging(args.loglevel)
 
+    # the statistics and the profiler cost nothing unless they are requested
+    stats = None
+    if args.stats:
+        from cxd.run_stats import RunStats
+        stats = RunStats()
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        _dump(args, stats)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            import pstats
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+        if stats is not None:
+            stats.close()
+            sys.stdout.flush()
+            sys.stderr.write(stats.format(args.stats))
+
+def _dump(args, stats):
+    # runs the command line, its stages being measured by stats if it is not None
+    stage = nullcontext if stats is None else stats.stage
+
+    if args.clear_cache:
+        from cxd.parser_cache import ParserCache
+        ParserCache().clear()
+        if args.data is None:
+            return
+
+    # the data is read from stdin with -d -, or without -d (unless stdin is a terminal)
+    stdin = not args.diff and args.data in (None, '-')
+    if stdin:
+        if args.data is None and sys.stdin.isatty():
+            _logger.error('No data: use -d PATH, or pipe the data to cxd')
+            return
+        if args.parser or args.patterns or args.patterns_file or args.html or args.interactive:
+            _logger.error('Parsers, patterns, --html and --interactive need a file: use -d PATH')
+            return
+
+    config = {}
+    if args.configuration:
+        from cxd.configuration import Configuration
+        config = Configuration.parse(args.configuration)
+    if args.output_format:
+        config['output_format'] = args.output_format
+    # a plain dump does not use the colors ranges: they are neither computed nor read
+    plain = (not args.html and not args.interactive and not args.parser_output
+             and ColoredHexDump.resolve_output_format(config.get('output_format', 'auto')) == 'plain')
+
+    # colors given to the parsers and to the patterns
+    colors = 'red green yellow blue magenta cyan light_red light_green light_yellow light_blue light_magenta light_cyan'.split()
     ranges = None
-    if args.parser:
-        parsers = import_plugins()
-        _logger.info(f'{parsers=}')
-        if args.parser not in parsers.keys():
-            _logger.error(f'Parser {args.parser} does not exist. Available: {", ".join(parsers.keys())}')
+    if args.diff or plain:
+        # the colors of a diff are the ones of the differences
+        ranges = []
+    elif args.parser:
+        from cxd.parsers.loader import available_parsers, load_parser
+        with stage('parser import'):
+            colorer_class = load_parser(args.parser)
+        if colorer_class is None:
+            _logger.error(f'Parser {args.parser} does not exist. Available: {", ".join(available_parsers())}')
             return
         _logger.info(f'Parser {args.parser} found')
-        parser = parsers[args.parser]
-        colors = 'red green yellow blue magenta cyan light_red light_green light_yellow light_blue light_magenta light_cyan'.split()
-        colorer = parser['module'].__dict__[parser['name']](str(Path(args.data).absolute()),
-                                                            colors)
+        colorer = colorer_class(str(Path(args.data).absolute()), colors)
         if colorer.check():
-            ranges = colorer.parse()
+            with stage('parse'):
+                if args.no_cache:
+                    ranges = colorer.parse()
+                else:
+                    from cxd.parser_cache import ParserCache
+                    ranges = ParserCache().parse(colorer, args.parser, refresh=args.refresh_cache)
             if args.parser_output:
-                with open(args.parser_output, 'w') as fd:
-                    for r in ranges:
-                        fd.write(str(r) + '\n')
+                from cxd.colors_file import write_colors_ranges
+                write_colors_ranges(ranges, args.parser_output)
         else:
             _logger.error('Parser failed; exiting')
             return
     else:
         if args.colors:
-            ranges = read_colors_ranges(args.colors)
+            from cxd.colors_file import read_colors_ranges
+            try:
+                with stage('ranges loading'):
+                    ranges = read_colors_ranges(args.colors, ColoredHexDump.ALLOWED_COLORS)
+            except (OSError, ValueError) as exc:
+                _logger.fatal(f'Colors ranges can not be read from {args.colors}: {exc}')
+                return
         else:
             ranges = []
-    just_fix_windows_console()
+    if sys.platform == 'win32':
+        from colorama import just_fix_windows_console
+        just_fix_windows_console()
 
-    config = {}
-    if args.configuration:
-        config = Configuration.parse(args.configuration)
+    length = args.length
+    if args.lines is not None:
+        length = args.lines * config.get('chunk_length', 16)
+    if args.offset < 0 or (length is not None and length < 0):
+        _logger.error('Offset and length must be positive')
+        return
+    if args.jobs < 0:
+        _logger.error('Jobs must be positive (0: one per CPU)')
+        return
+
+    patterns = list(args.patterns)
+    if args.patterns_file:
+        try:
+            with open(args.patterns_file, encoding='utf-8') as fd:
+                patterns += [line.strip() for line in fd if line.strip() and not line.lstrip().startswith('#')]
+        except OSError as exc:
+            _logger.fatal(f'Patterns can not be read from {args.patterns_file}: {exc}')
+            return
+    if patterns and not args.diff and not plain:
+        from cxd.pattern_search import PatternColorer
+        try:
+            colorer = PatternColorer(args.data, colors, patterns)
+        except ValueError as exc:
+            _logger.error(f'{exc}; exiting')
+            return
+        # only the matches of the window are searched
+        with stage('patterns'):
+            ranges = list(ranges) + colorer.parse(args.offset, length)
 
     # colors can be found here: https://pypi.org/project/termcolor/
-    cxd = ColoredHexDump(ranges=ranges, **config)
-    with open(args.data, 'rb') as fd:
-        data = fd.read()
-    cxd.print(data)
+    with stage('range table'):
+        cxd = ColoredHexDump(ranges=ranges, **config)
+    if stats is not None:
+        cxd.stats = stats
+        stats.count('ranges loaded', len(cxd.range_table))
+    if args.diff:
+        if args.context < 0:
+            _logger.error('Context must be positive')
+            return
+        with stage('render'):
+            cxd.print_diff(args.diff[0], args.diff[1], args.offset, length, args.context)
+        return
+    if args.html:
+        with stage('render'):
+            cxd.write_html(args.data, args.html, args.offset, length)
+        return
+    if args.interactive:
+        cxd.page_file(args.data, args.offset)
+        return
+    if stdin:
+        with stage('render'):
+            cxd.print_stream(sys.stdin.buffer, args.offset, length)
+        return
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    # the time of the writes is included in the one of the rendering, and reported apart
+    with stage('render'):
+        cxd.print_file(args.data, args.offset, length, jobs)
 
 
 def run():
@@ -0,0 +1,245 @@
+"""
+Interactive terminal pager rendering only the lines on screen.
+"""
+
+import logging
+import os
+import shutil
+import sys
+from collections import OrderedDict
+
+from cxd.colored_hex_dump import HUGE_PAGE
+from cxd.data_source import release_pages
+
+__author__ = "malware4n6"
+__copyright__ = "malware4n6"
+__license__ = "The Unlicense"
+
+_logger = logging.getLogger(__name__)
+
+
+# number of rendered lines kept to scroll back without rendering them again
+CACHE_LINES = 4096
+# matches are searched backwards by blocks of this size
+SEARCH_BLOCK = 4 * 1024 * 1024
+# actions of the keys (and of their escape sequences)
+KEYS = {
+    b'j': 'down', b'\x1b[B': 'down', b'\r': 'down', b'\n': 'down',
+    b'k': 'up', b'\x1b[A': 'up',
+    b' ': 'page_down', b'f': 'page_down', b'\x1b[6~': 'page_down',
+    b'b': 'page_up', b'\x1b[5~': 'page_up',
+    b'g': 'home', b'\x1b[H': 'home', b'\x1b[1~': 'home',
+    b'G': 'end', b'\x1b[F': 'end', b'\x1b[4~': 'end',
+    b'n': 'next', b'N': 'previous',
+    b':': 'goto', b'/': 'search',
+    b'q': 'quit', b'Q': 'quit',
+    b'?': 'help', b'h': 'help',
+}
+HELP = 'j/k: line  space/b: page  g/G: start/end  :offset  /pattern  n/N: next/previous match  q: quit'
+# shown when a key has no action
+UNKNOWN_KEY = 'Unknown key (press ? for the keys)'
+
+
+class HexPager():
+    """Browses data (a mmap of a file) rendered by a ColoredHexDump, a screen at a time.
+
+    The line holding an offset is found by a division, so any offset or match is reached at once:
+    only the lines on screen are rendered, with the ranges overlapping them, and the last
+    CACHE_LINES rendered lines are kept for scrolling. The pages of the rendered lines are given back,
+    so the memory used does not depend on the size of the file nor on the lines seen.
+    All the lines are shown: hide_null_lines and hide_repeated_lines are not used.
+    """
+    def __init__(self, cxd, data, base: int = 0, name: str = '', height: int = 24) -> None:
+        self.cxd = cxd
+        # data holds the bytes [base, self.end)
+        self.data = data
+        self.base = base
+        self.end = base + len(data)
+        self.name = name
+        # number of lines of data on screen
+        self.height = height
+        self.length = cxd.chunk_length
+        # offset of the first line on screen; the lines start at base
+        self.top = base
+        # {line offset: rendered text}, the least recently used first
+        self.cache = OrderedDict()
+        self.search = None
+        self.match = None
+        self.message = ''
+
+    def __last_top(self) -> int:
+        # offset of the first line on screen when the last line of data is at the bottom
+        last_line = self.base + max(0, self.end - 1 - self.base) // self.length * self.length
+        return max(self.base, last_line - (self.height - 1) * self.length)
+
+    def __render(self, first: int, last: int):
+        # renders the lines of [first, last) which are not cached
+        missing = [line for line in range(first, last, self.length) if line not in self.cache]
+        if not missing:
+            return
+        lines = self.cxd.format_lines(self.data, missing[0], missing[-1] + self.length, self.base)
+        for line, text in zip(range(missing[0], missing[-1] + 1, self.length), lines):
+            if line not in self.cache:
+                self.cache[line] = text.rstrip('\n')
+        # the pages are mapped by blocks which may be larger than the lines
+        release_pages(self.data, max(0, missing[0] - self.base - HUGE_PAGE),
+                      missing[-1] + self.length - self.base + HUGE_PAGE)
+
+    def lines(self) -> list:
+        """Returns the text of the lines on screen."""
+        last = min(self.top + self.height * self.length, self.end)
+        self.__render(self.top, last)
+        texts = []
+        for line in range(self.top, last, self.length):
+            self.cache.move_to_end(line)
+            texts.append(self.cache[line])
+        while len(self.cache) > max(CACHE_LINES, len(texts)):
+            self.cache.popitem(last=False)
+        return texts
+
+    def status(self) -> str:
+        size = self.end - self.base
+        percent = 100 * (min(self.top + self.height * self.length, self.end) - self.base) // size if size else 100
+        status = f'{self.name}  {self.cxd.address_shift + self.top:08x}  {percent}%'
+        return status + '  ' + self.message if self.message else status
+
+    def scroll(self, lines: int):
+        self.goto(self.top + lines * self.length)
+
+    def goto(self, offset: int):
+        """Shows the line holding offset at the top of the screen (or the last lines of data)."""
+        offset = max(self.base, min(offset, self.__last_top()))
+        self.top = self.base + (offset - self.base) // self.length * self.length
+
+    def set_pattern(self, pattern: str):
+        """Searches the pattern (see cxd.pattern_search.parse_pattern) from the top of the screen."""
+        # imported here as it is only needed by the searches
+        from cxd.pattern_search import PatternSearch
+        try:
+            self.search = PatternSearch([pattern])
+        except ValueError as exc:
+            self.message = str(exc)
+            return
+        self.match = None
+        self.next_match()
+
+    def next_match(self, backward: bool = False):
+        """Shows the next (or previous) match of the pattern."""
+        if self.search is None:
+            self.message = 'No pattern'
+            return
+        # the search goes on from the current match if it is on screen, from the top of the screen otherwise
+        position = self.top
+        if self.match is not None and self.top <= self.match < self.top + self.height * self.length:
+            position = self.match if backward else self.match + 1
+        if backward:
+            match = None
+            block_end = position
+            while match is None and block_end > self.base:
+                block_start = max(self.base, block_end - SEARCH_BLOCK)
+                matches = list(self.search.iter_matches(self.data, self.base, block_start, block_end))
+                match = matches[-1][0] if matches else None
+                block_end = block_start
+        else:
+            match = next(self.search.iter_matches(self.data, self.base, position), (None, ))[0]
+        if match is None:
+            self.message = f'Pattern not found: {self.search.patterns[0]}'
+            return
+        self.match = match
+        self.message = f'Match at {self.cxd.address_shift + match:08x}'
+        self.goto(match)
+
+    def handle(self, action: str, argument: str = None) -> bool:
+        """Runs the action of a key (see KEYS); returns False to quit."""
+        self.message = ''
+        if action == 'quit':
+            return False
+        if action in ('down', 'up'):
+            self.scroll(1 if action == 'down' else -1)
+        elif action in ('page_down', 'page_up'):
+            self.scroll(self.height if action == 'page_down' else -self.height)
+        elif action == 'home':
+            self.goto(self.base)
+        elif action == 'end':
+            self.goto(self.end)
+        elif action in ('next', 'previous'):
+            self.next_match(action == 'previous')
+        elif action == 'goto' and argument:
+            try:
+                self.goto(int(argument, 0) - self.cxd.address_shift)
+            except ValueError:
+                self.message = f'Incorrect offset {argument}'
+        elif action == 'search' and argument:
+            self.set_pattern(argument)
+        elif action == 'help':
+            self.message = HELP
+        elif action is None:
+            self.message = UNKNOWN_KEY
+        return True
+
+    def __draw(self, write):
+        # the lines are written over the previous ones, each line being cleared after its text
+        screen = ['\x1b[H', self.cxd.format_columns_names().rstrip('\n'), '\x1b[K\r\n']
+        for text in self.lines():
+            screen += [text, '\x1b[K\r\n']
+        screen.append('\x1b[J\x1b[7m' + self.status() + '\x1b[0m\x1b[K')
+        write(''.join(screen))
+
+    def __prompt(self, fd, write, prompt: str) -> str:
+        # reads a line in the status line; returns None if Escape is pressed.
+        # a read may return several characters (eg. when text is pasted)
+        text = ''
+        write('\x1b[?25h')
+        try:
+            while True:
+                write(f'\r\x1b[K{prompt}{text}')
+                key = os.read(fd, 32)
+                if key.startswith(b'\x1b'):
+                    return None
+                for char in key.decode('latin-1'):
+                    if char in '\r\n':
+                        return text
+                    if char in '\x7f\x08':
+                        text = text[:-1]
+                    elif char.isascii() and char.isprintable():
+                        text += char
+        finally:
+            write('\x1b[?25l')
+
+    def run(self):
+        """Runs the pager until q is pressed: the terminal shows the alternate screen meanwhile."""
+        if not sys.stdin.isatty() or not sys.stdout.isatty():
+            _logger.error('The pager needs a terminal')
+            return
+        try:
+            import termios
+            import tty
+        except ImportError:
+            _logger.error('The pager needs a terminal supporting termios (not available on Windows)')
+            return
+
+        def write(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+        fd = sys.stdin.fileno()
+        saved = termios.tcgetattr(fd)
+        # alternate screen, hidden cursor, lines not wrapped
+        write('\x1b[?1049h\x1b[?25l\x1b[?7l')
+        try:
+            tty.setcbreak(fd)
+            while True:
+                # the terminal may have been resized
+                self.height = max(1, shutil.get_terminal_size().lines - 2)
+                self.goto(self.top)
+                self.__draw(write)
+                key = os.read(fd, 32)
+                action = KEYS.get(key)
+                argument = None
+                if action in ('goto', 'search'):
+                    argument = self.__prompt(fd, write, key.decode())
+                if not self.handle(action, argument):
+                    break
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+            write('\x1b[?7h\x1b[?25h\x1b[?1049l')
@@ -0,0 +1,125 @@
+"""
+On-disk cache of the colors ranges produced by the parsers.
+"""
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+from time import perf_counter
+
+from cxd.data_source import map_file
+from cxd.ranges_file import dump_ranges, load_range_table
+
+__author__ = "malware4n6"
+__copyright__ = "malware4n6"
+__license__ = "The Unlicense"
+
+_logger = logging.getLogger(__name__)
+
+
+def default_cache_dir() -> Path:
+    if os.environ.get('CXD_CACHE_DIR'):
+        return Path(os.environ['CXD_CACHE_DIR'])
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'cxd'
+
+
+class ParserCache():
+    """Stores the ranges produced by a parser on a file, keyed by the content of the file,
+    the name and version of the parser, the colors it was given and its parameters
+    (the tuple returned by its optional cache_params method, eg. the minimal length of the strings).
+
+    An entry is a file of the cache directory, in the format of cxd.ranges_file.
+    Its modification time is updated when it is read; once the entries take more
+    than max_size bytes, the least recently used ones are removed.
+    """
+    DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+    SUFFIX = '.ranges'
+
+    def __init__(self, cache_dir=None, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        assert max_size >= 0
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, filepath, parser_name: str, parser_version, colors, params: tuple = ()) -> str:
+        digest = hashlib.sha256()
+        with map_file(filepath) as (data, _):
+            digest.update(data)
+        digest.update(f'\0{parser_name}\0{parser_version}\0{",".join(colors)}'.encode())
+        if params:
+            digest.update(f'\0{params!r}'.encode())
+        return digest.hexdigest()
+
+    def __entry(self, key: str) -> Path:
+        return self.cache_dir / f'{key}{ParserCache.SUFFIX}'
+
+    def get(self, key: str):
+        """Returns the cached ranges (as a RangeTable), or None if there are none."""
+        entry = self.__entry(key)
+        start = perf_counter()
+        try:
+            with map_file(entry) as (data, _):
+                ranges = load_range_table(data)
+            os.utime(entry)
+        except (OSError, ValueError) as exc:
+            self.misses += 1
+            if entry.exists():
+                _logger.warning(f'Cache entry {entry} can not be read ({exc})')
+            _logger.info(f'Parser cache miss for {key} (hits={self.hits}, misses={self.misses})')
+            return None
+        self.hits += 1
+        _logger.info(f'Parser cache hit for {key}: {len(ranges)} ranges read in {perf_counter() - start:.3f}s (hits={self.hits}, misses={self.misses})')
+        return ranges
+
+    def put(self, key: str, ranges) -> None:
+        entry = self.__entry(key)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = entry.with_suffix(f'.{os.getpid()}.tmp')
+            with tmp.open('wb') as fd:
+                dump_ranges(ranges, fd)
+            os.replace(tmp, entry)
+        except OSError as exc:
+            _logger.warning(f'Parser cache can not be written in {self.cache_dir} ({exc})')
+            return
+        _logger.debug(f'Cached {len(ranges)} ranges in {entry}')
+        self.evict()
+
+    def invalidate(self, key: str) -> None:
+        self.__entry(key).unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        for entry in self.cache_dir.glob(f'*{ParserCache.SUFFIX}'):
+            entry.unlink(missing_ok=True)
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until they take at most max_size bytes."""
+        entries = []
+        for entry in self.cache_dir.glob(f'*{ParserCache.SUFFIX}'):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_size:
+                break
+            _logger.debug(f'Evicting {entry} from the parser cache')
+            entry.unlink(missing_ok=True)
+            total -= size
+
+    def parse(self, colorer, parser_name: str, refresh: bool = False):
+        """Returns colorer.parse() on colorer.path, reading it from the cache if possible.
+
+        With refresh=True, the cached ranges are ignored and replaced.
+        """
+        params = colorer.cache_params() if hasattr(colorer, 'cache_params') else ()
+        key = self.key(colorer.path, parser_name, getattr(colorer, 'VERSION', 0), colorer.colors, params)
+        ranges = None if refresh else self.get(key)
+        if ranges is None:
+            ranges = colorer.parse()
+            self.put(key, ranges)
+        return ranges
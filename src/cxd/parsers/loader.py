@@ -4,15 +4,52 @@ from pathlib import Path
 
 _logger = logging.getLogger(__name__)
 
-def load_parsers():
-    _logger.debug('load_parsers' + __file__)
+# third-party packages can provide parsers with entry points of this group, eg. in their setup.cfg:
+#   [options.entry_points]
+#   cxd.parsers =
+#       foo = foo_package.parser:FooColorer
+ENTRY_POINTS_GROUP = 'cxd.parsers'
+
 
+def builtin_parsers():
+    # {format: 'module:class'} of the scripts parser_*.py of this package, found without importing them
     parsers = {}
     for g in Path(__file__).parent.glob('parser_*.py'):
-        _logger.info(f'{g}')
         format_ = g.stem[7:]
-        name = f'{format_.title()}Colorer'
-        _logger.info(f'Found {g} => {name}')
-        parsers[format_] = {'name': name,
-                        'module': import_module(f'cxd.parsers.parser_{format_}')}
-    return parsers
\ No newline at end of file
+        parsers[format_] = f'cxd.parsers.parser_{format_}:{format_.title()}Colorer'
+    return parsers
+
+def entry_point_parsers():
+    # {format: EntryPoint} of the installed third-party parsers
+    # importlib.metadata is slow to import and to scan: only used if needed
+    from importlib.metadata import entry_points
+    return {ep.name: ep for ep in entry_points(group=ENTRY_POINTS_GROUP)}
+
+def available_parsers():
+    return sorted(builtin_parsers().keys() | entry_point_parsers().keys())
+
+def load_parsers():
+    # kept for compatibility: imports all the builtin parsers, returning {format: {'name': class name, 'module': module}}.
+    # load_parser only imports the parser which is used
+    parsers = {}
+    for format_, spec in builtin_parsers().items():
+        module_name, class_name = spec.split(':')
+        parsers[format_] = {'name': class_name, 'module': import_module(module_name)}
+    return parsers
+
+def load_parser(format_):
+    """Returns the colorer class of the parser `format_`, or None if it does not exist.
+
+    Only the module of this parser is imported; a builtin parser takes precedence
+    over an entry point with the same name.
+    """
+    spec = builtin_parsers().get(format_)
+    if spec is not None:
+        module_name, class_name = spec.split(':')
+        _logger.info(f'Found {module_name} => {class_name}')
+        return getattr(import_module(module_name), class_name)
+    entry_point = entry_point_parsers().get(format_)
+    if entry_point is not None:
+        _logger.info(f'Found entry point {entry_point.value}')
+        return entry_point.load()
+    return None
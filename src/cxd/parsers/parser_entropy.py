@@ -0,0 +1,278 @@
+import argparse
+import logging
+import sys
+from bisect import bisect_right
+from collections import Counter, deque
+from math import log2
+from pathlib import Path
+
+from cxd import colored_hex_dump
+from cxd.color_range import ColorRange
+from cxd.data_source import RELEASE_STEP, map_file, release_pages
+
+_logger = logging.getLogger(__name__)
+
+__author__ = "malware4n6"
+__copyright__ = "malware4n6"
+__license__ = "The Unlicense"
+
+
+# the data is read by chunks of about this size (NumPy computes the entropies of a chunk at once)
+CHUNK_SIZE = 32 * 1024
+# (lowest entropy, color) of the bands, in bits per byte. The bytes below the first band are not colored
+BANDS = (
+    (2.0, 'blue'),
+    (4.0, 'cyan'),
+    (6.0, 'green'),
+    (7.0, 'yellow'),
+    (7.5, 'light_red'),
+    (7.8, 'red'),
+)
+
+# the entropies are rounded to this number of decimals, so that both ways of summing the counts
+# give the same bands (eg. for data of 16 values equally distributed, whose entropy is 4)
+ROUNDING = 9
+
+
+def _plogp_table(window: int) -> list:
+    # c * log2(c) for each count c of a byte in a window: the entropy of n bytes
+    # is log2(n) - sum(c * log2(c)) / n
+    return [0.0] + [c * log2(c) for c in range(1, window + 1)]
+
+
+def _sliding_sums(rows, width: int):
+    # sums of the `width` consecutive rows starting at each row (the last width - 1 rows being
+    # missing), from the sums of 1, 2, 4... consecutive rows
+    result, offset, length = None, 0, len(rows) - width + 1
+    sums, size = rows, 1
+    while width:
+        if width & size:
+            part = sums[offset:offset + length]
+            result = part.copy() if result is None else result + part
+            offset += size
+            width -= size
+        if width:
+            sums = sums[:-size] + sums[size:]
+            size *= 2
+    return result
+
+
+class EntropyColorer():
+    """Colors the data by bands of Shannon entropy, so that packed or encrypted data stands out.
+
+    The data is cut in steps of `step` bytes; each step gets the entropy of the window of
+    `window` bytes centered on it (shorter at the ends of the file). Consecutive steps of the
+    same band are merged into one range, whose comment is the band.
+    The windows are computed from the histograms of their steps: with NumPy, the histograms of
+    a chunk of steps are counted at once with bincount and summed by window with cumulative sums;
+    otherwise, the histogram of the window is updated incrementally while it slides.
+    """
+    # to be increased when the produced ranges change (the cached ranges are discarded)
+    VERSION = 1
+
+    def __init__(self, path, colors, window=2048, step=512, use_numpy=True) -> None:
+        assert step > 0 and window >= step and window % step == 0
+        # the colors of the bands are fixed (see BANDS): `colors` is only kept for the parsers' interface
+        self.colors = colors
+        self.colors_ranges = None
+        # if self.colors_ranges is None, then the parser did not do its job yet.
+        # this value is used to be sure the file is parsed only once.
+        # the method .parse() is responsible for the creation of a list.
+        # if .parse() is called multiple times, only the first call will parse the file,
+        # and the already-generated list will be returned.
+        self.path = path
+        self.window = window
+        self.step = step
+        self.use_numpy = use_numpy
+        self.__check = None
+
+    def cache_params(self) -> tuple:
+        # the parameters changing the ranges (see cxd.parser_cache.ParserCache)
+        return self.window, self.step
+
+    def check(self):
+        if self.__check is None:
+            if not Path(self.path).is_file():
+                _logger.error(f'Parser "entropy" can not read {self.path}')
+                self.__check = False
+            else:
+                self.__check = True
+        return self.__check
+
+    def parse(self):
+        if self.colors_ranges is None:
+            self.colors_ranges = list(self.iter_ranges())
+        return self.colors_ranges
+
+    def iter_ranges(self):
+        """Yields the colors ranges of the bands, ordered by offset, as they are computed."""
+        with map_file(self.path) as (data, _):
+            if self.use_numpy and colored_hex_dump._load_numpy():
+                entropies = self.__iter_entropies_numpy(data)
+            else:
+                entropies = self.__iter_entropies(data)
+            yield from self.__iter_bands(entropies, len(data))
+
+    def iter_entropies(self):
+        """Yields the entropy of each step of the file, in bits per byte."""
+        with map_file(self.path) as (data, _):
+            if self.use_numpy and colored_hex_dump._load_numpy():
+                for entropies in self.__iter_entropies_numpy(data):
+                    yield from entropies.tolist()
+            else:
+                for entropies in self.__iter_entropies(data):
+                    yield from entropies
+
+    def __iter_bands(self, entropies, size: int):
+        # merges the steps of the same band, the entropies coming by chunks
+        thresholds = [low for low, _ in BANDS]
+        band, band_start, offset = -1, 0, 0
+        for chunk in entropies:
+            if isinstance(chunk, list):
+                bands = [bisect_right(thresholds, entropy) - 1 for entropy in chunk]
+                changes = [i for i, current in enumerate(bands) if current != (bands[i - 1] if i else band)]
+            else:
+                np = colored_hex_dump.np
+                bands = np.searchsorted(thresholds, chunk, side='right') - 1
+                changes = np.flatnonzero(np.diff(bands, prepend=band)).tolist()
+                bands = bands.tolist()
+            for i in changes:
+                if band >= 0:
+                    yield self.__band_range(band, band_start, offset + i * self.step)
+                band, band_start = bands[i], offset + i * self.step
+            offset += len(chunk) * self.step
+        if band >= 0:
+            yield self.__band_range(band, band_start, size)
+
+    @staticmethod
+    def __band_range(band: int, start: int, end: int) -> ColorRange:
+        low, color = BANDS[band]
+        high = BANDS[band + 1][0] if band + 1 < len(BANDS) else 8.0
+        return ColorRange(start, end - start, color, f'entropy {low}-{high}')
+
+    def __windows_shifts(self):
+        # the window of the step k is the steps [k - before, k + after + 1)
+        before = (self.window // self.step - 1) // 2
+        after = self.window // self.step - 1 - before
+        return -before, after + 1
+
+    def __iter_entropies_numpy(self, data):
+        # yields the entropies of the steps by batches, computed by chunks of steps
+        np = colored_hex_dump.np
+        size, step = len(data), self.step
+        steps_count = -(-size // step)
+        chunk_steps = max(1, CHUNK_SIZE // step)
+        shift_start, shift_end = self.__windows_shifts()
+        # histograms of the steps [first + shift_start, last - 1 + shift_end) of a chunk, the steps
+        # outside of the file being empty: the window of the step first + i is the rows [i, i + width)
+        width = shift_end - shift_start
+        rows = chunk_steps + width - 1
+        # key (row << 8 | byte) of each byte, counted with bincount. The histograms stay in the CPU cache
+        rows_keys = np.repeat(np.arange(rows, dtype=np.int64) << 8, step)
+        keys = np.empty_like(rows_keys)
+        table = np.array(_plogp_table(self.window))
+        view = memoryview(data)
+        released = 0
+        batch = []
+        for first in range(0, steps_count, chunk_steps):
+            last = min(first + chunk_steps, steps_count)
+            lo, hi = max(0, first + shift_start), min(steps_count, last - 1 + shift_end)
+            array = np.frombuffer(view[lo * step:min(hi * step, size)], dtype=np.uint8)
+            skipped = (lo - first - shift_start) * step
+            np.bitwise_or(rows_keys[skipped:skipped + len(array)], array, out=keys[:len(array)])
+            histograms = np.bincount(keys[:len(array)], minlength=rows << 8).reshape(rows, 256)
+            windows = _sliding_sums(histograms, width)[:last - first]
+            steps = np.arange(first, last)
+            # the windows are shorter at the ends of the file
+            lengths = np.minimum((steps + shift_end) * step, size) - np.maximum(steps + shift_start, 0) * step
+            batch.append(np.log2(lengths) - table[windows].sum(axis=1) / lengths)
+            if lo * step - released >= RELEASE_STEP:
+                # the entropies are yielded in batches: handling them has a cost per call
+                yield np.round(np.concatenate(batch), ROUNDING)
+                batch = []
+                release_pages(data, released, lo * step)
+                released = lo * step
+        if batch:
+            yield np.round(np.concatenate(batch), ROUNDING)
+        release_pages(data, released, size)
+
+    def __iter_entropies(self, data):
+        # yields the entropies of the steps of a chunk at once, the histogram of the window being updated
+        # with the histograms of the steps entering and leaving it
+        size, step = len(data), self.step
+        steps_count = -(-size // step)
+        chunk_steps = max(1, CHUNK_SIZE // step)
+        table = _plogp_table(self.window)
+        shift_start, shift_end = self.__windows_shifts()
+        counts = [0] * 256
+        # sum of c * log2(c) for the counts of the window
+        plogp = 0.0
+        length = 0
+        # histograms of the steps of the window
+        window = deque()
+        window_end = 0
+        released = 0
+        chunk = []
+        for k in range(steps_count):
+            start, end = max(0, k + shift_start), min(steps_count, k + shift_end)
+            while window_end - len(window) < start:
+                histogram = window.popleft()
+                for byte, count in histogram.items():
+                    plogp += table[counts[byte] - count] - table[counts[byte]]
+                    counts[byte] -= count
+                length -= sum(histogram.values())
+            while window_end < end:
+                histogram = Counter(data[window_end * step:(window_end + 1) * step])
+                for byte, count in histogram.items():
+                    plogp += table[counts[byte] + count] - table[counts[byte]]
+                    counts[byte] += count
+                length += sum(histogram.values())
+                window.append(histogram)
+                window_end += 1
+            chunk.append(round(log2(length) - plogp / length, ROUNDING))
+            if len(chunk) == chunk_steps:
+                yield chunk
+                chunk = []
+                # the rounding errors of the updates are not accumulated
+                plogp = sum(table[count] for count in counts)
+                if k * step - released >= RELEASE_STEP:
+                    release_pages(data, released, start * step)
+                    released = start * step
+        if chunk:
+            yield chunk
+        release_pages(data, released, size)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="Entropy parser")
+    parser.add_argument("-i", "--input", help="path to some file", type=str)
+    parser.add_argument("-o", "--output", help="path to output file (colors ranges). Each line contains 'offset_start,count,color'", type=str)
+    parser.add_argument("-w", "--window", help="number of bytes of the window of each step", type=int, default=2048)
+    parser.add_argument("-t", "--step", help="number of bytes of a step (the window must be a multiple)", type=int, default=512)
+    parser.add_argument("-v", "--verbose", dest="loglevel", help="set loglevel to INFO",
+                        action="store_const", const=logging.INFO)
+    parser.add_argument("-vv", "--very-verbose", dest="loglevel", help="set loglevel to DEBUG",
+                        action="store_const", const=logging.DEBUG)
+    return parser.parse_args(args)
+
+def setup_logging(loglevel):
+    logformat = "[%(asctime)s] %(levelname)s\t%(name)s\t%(message)s"
+    logging.basicConfig(
+        level=loglevel, stream=sys.stdout, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+    entropy_colorer = EntropyColorer(args.input, [], args.window, args.step)
+    if entropy_colorer.check():
+        with open(args.output, 'w') as fd:
+            for c in entropy_colorer.iter_ranges():
+                fd.write(str(c) + '\n')
+
+def run():
+    main(sys.argv[1:])
+
+if __name__ == "__main__":
+    run()
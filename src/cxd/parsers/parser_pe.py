@@ -3,6 +3,7 @@ import logging
 import sys
 from itertools import pairwise
 from pathlib import Path
+from time import perf_counter
 _logger = logging.getLogger(__name__)
 try:
     import pefile
@@ -16,7 +17,35 @@ __copyright__ = "malware4n6"
 __license__ = "The Unlicense"
 
 class PeColorer():
-    def __init__(self, path, colors) -> None:
+    """Colors the headers fields, the imported names and the exported names of a PE.
+
+    With fast_load=True (default), pefile only parses the headers (the file being
+    read through a mmap), the fields offsets are read from the parsed structures and
+    a data directory is only parsed when its ranges are requested.
+    With fast_load=False, the whole PE is parsed and the offsets are read from
+    pefile.PE.dump_dict(), which is much slower on large PE; the ranges are the same.
+    """
+    # to be increased when the produced ranges change (the cached ranges are discarded)
+    VERSION = 2
+    # fields colored in each header; a field is colored until the next one starts
+    HEADERS_FIELDS = (
+        ('DOS_HEADER', ('e_magic', 'e_cblp', 'e_cp', 'e_crlc', 'e_cparhdr', 'e_minalloc', 'e_maxalloc', 'e_ss', 'e_sp',
+                        'e_csum', 'e_ip', 'e_cs', 'e_lfarlc', 'e_ovno', 'e_res', 'e_oemid', 'e_oeminfo', 'e_res2',
+                        'e_lfanew')),
+        ('NT_HEADERS', ('Signature',)),
+        ('FILE_HEADER', ('Machine', 'NumberOfSections', 'TimeDateStamp', 'PointerToSymbolTable', 'NumberOfSymbols',
+                         'SizeOfOptionalHeader', 'Characteristics')),
+        ('OPTIONAL_HEADER', ('Magic', 'MajorLinkerVersion', 'MinorLinkerVersion', 'SizeOfCode', 'SizeOfInitializedData',
+                             'SizeOfUninitializedData', 'AddressOfEntryPoint', 'BaseOfCode', 'ImageBase',
+                             'SectionAlignment', 'FileAlignment', 'MajorOperatingSystemVersion',
+                             'MinorOperatingSystemVersion', 'MajorImageVersion', 'MinorImageVersion',
+                             'MajorSubsystemVersion', 'MinorSubsystemVersion', 'Reserved1', 'SizeOfImage',
+                             'SizeOfHeaders', 'CheckSum', 'Subsystem', 'DllCharacteristics', 'SizeOfStackReserve',
+                             'SizeOfStackCommit', 'SizeOfHeapReserve', 'SizeOfHeapCommit', 'LoaderFlags',
+                             'NumberOfRvaAndSizes')),
+    )
+
+    def __init__(self, path, colors, fast_load=True) -> None:
         self.colors = colors
         self.colors_ranges = None
         # if self.colors_ranges is None, then the parser did not do its job yet.
@@ -25,14 +54,16 @@ class PeColorer():
         # if .parse() is called multiple times, only the first call will parse the file,
         # and the already-generated list will be returned.
         self.path = path
+        self.fast_load = fast_load
         self.pe = None
         self.__check = None
         self.__color_index = 0
+        self.__parsed_directories = set()
     
     def check(self):
         if self.__check is None:
             try:
-                self.pe = pefile.PE(self.path)
+                self.pe = pefile.PE(self.path, fast_load=self.fast_load)
                 self.__check = True
                 _logger.info(f'Can read {self.path}')
             except:
@@ -43,72 +74,70 @@ class PeColorer():
 
     def parse(self):
         if self.colors_ranges is None:
-            self.colors_ranges = []
-            self.pe.parse_data_directories( directories=[ 
-                pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_IMPORT'],
-                pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_EXPORT'],
-                pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_RESOURCE'],
-                pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_DEBUG'],
-                # pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_BASERELOC'], # Do not parse relocations
-                pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_TLS'],
-                pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_DELAY_IMPORT'],
-                pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_BOUND_IMPORT'] ] )
-            # for section in self.pe.sections:
-                # print(section.Name, hex(section.VirtualAddress), hex(section.Misc_VirtualSize), section.SizeOfRawData )
-                # print(section.Name, hex(section.VirtualAddress), hex(section.Misc_VirtualSize), section.SizeOfRawData )
-            pe_file_dict_data = self.pe.dump_dict()
-            # consider a PE as a list of offsets for the moment
-            # sure: that's not the best idea, as some bytes that should not be colored will get colored - for nothing.
-            # some keys may also not exist - or not be in the correct order
-            # the following try...except should also be better handled
-            file_offsets = []
-            comments = []
-            # DOS_HEADER
-            for k in ('e_magic', 'e_cblp', 'e_cp', 'e_crlc', 'e_cparhdr', 'e_minalloc', 'e_maxalloc', 'e_ss', 'e_sp', 'e_csum',
-                    'e_ip', 'e_cs', 'e_lfarlc', 'e_ovno', 'e_res', 'e_oemid', 'e_oeminfo', 'e_res2', 'e_lfanew'):
-                file_offsets.append(pe_file_dict_data['DOS_HEADER'][k]['FileOffset'])
-                comments.append(f'DOS_HEADER.{k}')
-            # NT_HEADERS
-            file_offsets.append(pe_file_dict_data['NT_HEADERS']['Signature']['FileOffset'])
-            comments.append('NT_HEADERS.Signature')
-            # FILE_HEADER
-            for k in ('Machine', 'NumberOfSections', 'TimeDateStamp', 'PointerToSymbolTable', 'NumberOfSymbols', 'SizeOfOptionalHeader', 'Characteristics'):
-                file_offsets.append(pe_file_dict_data['FILE_HEADER'][k]['FileOffset'])
-                comments.append(f'FILE_HEADER.{k}')
-
-            # OPTIONAL_HEADER
-            for k in ('Magic', 'MajorLinkerVersion', 'MinorLinkerVersion', 'SizeOfCode', 'SizeOfInitializedData', 'SizeOfUninitializedData', 'AddressOfEntryPoint', 'BaseOfCode', 'ImageBase', 'SectionAlignment', 'FileAlignment', 'MajorOperatingSystemVersion', 'MinorOperatingSystemVersion', 'MajorImageVersion', 'MinorImageVersion', 'MajorSubsystemVersion', 'MinorSubsystemVersion', 'Reserved1', 'SizeOfImage', 'SizeOfHeaders', 'CheckSum', 'Subsystem', 'DllCharacteristics', 'SizeOfStackReserve', 'SizeOfStackCommit', 'SizeOfHeapReserve', 'SizeOfHeapCommit', 'LoaderFlags', 'NumberOfRvaAndSizes'):
-                file_offsets.append(pe_file_dict_data['OPTIONAL_HEADER'][k]['FileOffset'])
-                comments.append(f'OPTIONAL_HEADER.{k}')
-
-            # consider the offsets read until there
-            for i, pair in enumerate(pairwise(file_offsets)):
-                self.colors_ranges.append(ColorRange(pair[0], pair[1] - pair[0], self.colors[self.__color_index], comments[i]))
-                self.__color_index = (self.__color_index+1) % len(self.colors)
-            # add the imports
-            _logger.debug(f'## imports')
-            if self.pe.__dict__.get('DIRECTORY_ENTRY_IMPORT'):
-                for import_entry in self.pe.DIRECTORY_ENTRY_IMPORT:
-                    # _logger.debug(f'{import_entry.dll=}')
-                    for imp in import_entry.imports:
-                        # _logger.debug(f'\t-{imp.name=}')
-                        if imp.name and imp.name_offset:
-                            self.colors_ranges.append(ColorRange(imp.name_offset, len(imp.name), self.colors[self.__color_index]))
-                            self.__color_index = (self.__color_index+1) % len(self.colors)
-                        else:
-                            _logger.error(f'\t-{imp.name=} not handled')
-            # add the exports
-            _logger.debug(f'## exports')
-            if self.pe.__dict__.get('DIRECTORY_ENTRY_EXPORT'):
-                for exp in self.pe.DIRECTORY_ENTRY_EXPORT.symbols:
-                    _logger.debug(f'{exp.name=}')
-                    self.colors_ranges.append(ColorRange(exp.name_offset, len(exp.name), self.colors[self.__color_index]))
-                    self.__color_index = (self.__color_index+1) % len(self.colors)
-                    if exp.forwarder_offset:
-                        self.colors_ranges.append(ColorRange(exp.forwarder_offset, len(exp.forwarder), self.colors[self.__color_index]))
-                        self.__color_index = (self.__color_index+1) % len(self.colors)
+            start = perf_counter()
+            self.colors_ranges = self.headers_ranges() + self.imports_ranges() + self.exports_ranges()
+            _logger.info(f'{len(self.colors_ranges)} ranges found in {perf_counter() - start:.3f}s')
         return self.colors_ranges
 
+    def __next_color(self):
+        color = self.colors[self.__color_index]
+        self.__color_index = (self.__color_index+1) % len(self.colors)
+        return color
+
+    def __parse_directory(self, name):
+        # data directories are parsed at most once, and only when needed
+        if not self.fast_load or name in self.__parsed_directories:
+            return
+        self.__parsed_directories.add(name)
+        self.pe.parse_data_directories(directories=[pefile.DIRECTORY_ENTRY[name]])
+
+    def __headers_fields_offsets(self):
+        if self.fast_load:
+            for header, fields in PeColorer.HEADERS_FIELDS:
+                structure = getattr(self.pe, header)
+                for k in fields:
+                    yield structure.get_field_absolute_offset(k), f'{header}.{k}'
+        else:
+            pe_file_dict_data = self.pe.dump_dict()
+            for header, fields in PeColorer.HEADERS_FIELDS:
+                for k in fields:
+                    yield pe_file_dict_data[header][k]['FileOffset'], f'{header}.{k}'
+
+    def headers_ranges(self):
+        # consider a PE as a list of offsets for the moment
+        # sure: that's not the best idea, as some bytes that should not be colored will get colored - for nothing.
+        # some keys may also not exist - or not be in the correct order
+        ret = []
+        for (offset, comment), (next_offset, _) in pairwise(self.__headers_fields_offsets()):
+            ret.append(ColorRange(offset, next_offset - offset, self.__next_color(), comment))
+        return ret
+
+    def imports_ranges(self):
+        _logger.debug(f'## imports')
+        self.__parse_directory('IMAGE_DIRECTORY_ENTRY_IMPORT')
+        ret = []
+        for import_entry in getattr(self.pe, 'DIRECTORY_ENTRY_IMPORT', ()):
+            for imp in import_entry.imports:
+                if imp.name and imp.name_offset:
+                    ret.append(ColorRange(imp.name_offset, len(imp.name), self.__next_color()))
+                else:
+                    _logger.error(f'\t-{imp.name=} not handled')
+        return ret
+
+    def exports_ranges(self):
+        _logger.debug(f'## exports')
+        self.__parse_directory('IMAGE_DIRECTORY_ENTRY_EXPORT')
+        ret = []
+        if hasattr(self.pe, 'DIRECTORY_ENTRY_EXPORT'):
+            for exp in self.pe.DIRECTORY_ENTRY_EXPORT.symbols:
+                if exp.name:
+                    ret.append(ColorRange(exp.name_offset, len(exp.name), self.__next_color()))
+                if exp.forwarder_offset:
+                    ret.append(ColorRange(exp.forwarder_offset, len(exp.forwarder), self.__next_color()))
+        # a message per symbol would be formatted even when it is not logged
+        _logger.debug(f'{len(ret)} exports ranges')
+        return ret
+
 def parse_args(args):
     parser = argparse.ArgumentParser(description="PE parser")
     parser.add_argument("-i", "--input", help="path to some PE", type=str)
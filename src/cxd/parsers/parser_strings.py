@@ -1,11 +1,14 @@
 import argparse
+import heapq
 import logging
 import sys
 from pathlib import Path
+import re
 import subprocess
 
 from platform import system as psystem
 from cxd.color_range import ColorRange
+from cxd.data_source import map_file
 
 _logger = logging.getLogger(__name__)
 
@@ -14,14 +17,72 @@ __copyright__ = "malware4n6"
 __license__ = "The Unlicense"
 
 
+# characters considered as printable, as `strings` does: TAB and the ASCII range 0x20-0x7e
+PRINTABLE = b'\t' + bytes(range(0x20, 0x7f))
+
+# the data is searched by chunks, once translated into classes of bytes:
+# P for printable characters, Z for null bytes and X for the other ones.
+# matching literal classes is much faster than matching ranges of characters.
+CHUNK_SIZE = 1024 * 1024
+_CLASSES = bytes(ord('P') if c in PRINTABLE else ord('Z') if c == 0 else ord('X') for c in range(256))
+
+
+def _iter_classes_matches(data, regex, min_length):
+    """Yields the spans of the matches of `regex` in `data` translated into classes of bytes."""
+    size = len(data)
+    # bytes to read again from the previous chunk: a string shorter than min_length is not matched yet
+    backoff = 2 * min_length + 2
+    chunk_size = max(CHUNK_SIZE, 2 * backoff)
+    pos = 0
+    done = 0
+    while pos < size:
+        end = min(size, pos + chunk_size)
+        text = data[pos:end].translate(_CLASSES)
+        next_pos = max(pos + 1, end - backoff) if end < size else size
+        for m in regex.finditer(text):
+            start = pos + m.start()
+            if end < size and m.end() > len(text) - 2:
+                # the string may continue in the next chunk
+                next_pos = start
+                break
+            if start >= done:
+                done = pos + m.end()
+                yield start, done
+        if next_pos == pos:
+            # a string longer than a chunk
+            chunk_size *= 2
+        pos = next_pos
+
+
+def extract_strings(data, min_length: int = 4):
+    """Yields (offset, length, string) for each ASCII or UTF-16LE string of `data`, ordered by offset.
+
+    `length` is the exact number of bytes of the string in `data`.
+    As with `strings` and `strings -el`, an ASCII string and an UTF-16LE string
+    can share a character (eg. the A of b'xyzA\\0B\\0C\\0D\\0').
+    """
+    assert min_length > 0
+    ascii_regex = re.compile(b'P' * min_length + b'P*')
+    wide_regex = re.compile(b'PZ' * min_length + b'(?:PZ)*')
+    spans = heapq.merge(((start, end, 'ascii') for start, end in _iter_classes_matches(data, ascii_regex, min_length)),
+                        ((start, end, 'utf-16-le') for start, end in _iter_classes_matches(data, wide_regex, min_length)))
+    for start, end, encoding in spans:
+        yield start, end - start, data[start:end].decode(encoding)
+
+
 class StringsColorer():
-    """quick win: run
-    - `strings -a -n 4 -td` and get the output (offset, len(detected_string), color, detected_string as comment)
-    - `strings -a -el -n 4 -td` and get the output (offset, 2*len(detected_string), color, detected_string as comment)
-    2 * len(detected_string) because `strings`' output is ASCII-encoded and I don't want to write a precise
-    all-possible-strings-formats-and-encodings detection tool.
+    """Colors the printable strings of a file, ASCII-encoded or UTF-16LE-encoded
+    (same strings as `strings -a -n 4` and `strings -a -el -n 4`).
+    Each range covers the exact bytes of a string, the string itself being used as comment.
+
+    The file is read in one pass through a mmap. With use_strings_binary=True, the
+    `strings` tool is run instead (only works on Linux systems).
     """
-    def __init__(self, path, colors) -> None:
+    # to be increased when the produced ranges change (the cached ranges are discarded)
+    VERSION = 2
+
+    def __init__(self, path, colors, min_length=4, use_strings_binary=False) -> None:
+        assert min_length > 0
         self.colors = colors
         self.colors_ranges = None
         # if self.colors_ranges is None, then the parser did not do its job yet.
@@ -30,56 +91,86 @@ class StringsColorer():
         # if .parse() is called multiple times, only the first call will parse the file,
         # and the already-generated list will be returned.
         self.path = path
+        self.min_length = min_length
+        self.use_strings_binary = use_strings_binary
         self.pe = None
         self.__check = None
         self.__color_index = 0
+
+    def cache_params(self) -> tuple:
+        # the parameters changing the ranges (see cxd.parser_cache.ParserCache)
+        return self.min_length, self.use_strings_binary
     
     def check(self):
         if self.__check is None:
-            if psystem() != 'Linux':
-                _logger.error('Parser "strings" only works on Linux systems')
+            if not Path(self.path).is_file():
+                _logger.error(f'Parser "strings" can not read {self.path}')
+                self.__check = False
+            elif self.use_strings_binary and psystem() != 'Linux':
+                _logger.error('Parser "strings" only works on Linux systems when using the `strings` tool')
                 self.__check = False    
             else:
                 self.__check = True
         return self.__check
 
+    def __next_color(self):
+        color = self.colors[self.__color_index]
+        self.__color_index = (self.__color_index+1) % len(self.colors)
+        return color
+
     def parse(self):
         if self.colors_ranges is None:
-            self.colors_ranges = []
-            out = subprocess.check_output(['strings', '-a', '-n', '4', '-td', str(Path(self.path))])
-            if out:
-                lines = out.decode().split('\n')
-                for curline in lines:
-                    curline = curline.strip()
-                    arr = curline.split(' ', maxsplit=1)
-                    if len(arr) > 1:
-                        offset = int(arr[0])
-                        detected_string = arr[1].strip()
-                        nb_spaces_at_start = len(arr[1]) - len(arr[1].lstrip()) 
-                        self.colors_ranges.append(ColorRange(offset + nb_spaces_at_start, len(detected_string),
-                                                            self.colors[self.__color_index], detected_string))
-                        self.__color_index = (self.__color_index+1) % len(self.colors)
-
-            out = subprocess.check_output(['strings', '-a', '-el', '-n', '4', '-td', str(Path(self.path))])
-            if out:
-                lines = out.decode().split('\n')
-                for curline in lines:
-                    curline = curline.strip()
-                    arr = curline.split(' ', maxsplit=1)
-                    if len(arr) > 1:
-                        offset = int(arr[0])
-                        detected_string = arr[1].strip()
-                        nb_spaces_at_start = len(arr[1]) - len(arr[1].lstrip()) 
-                        self.colors_ranges.append(ColorRange(offset + nb_spaces_at_start, 2*len(detected_string),
-                                                            self.colors[self.__color_index], detected_string))
-                        self.__color_index = (self.__color_index+1) % len(self.colors)
-
+            self.colors_ranges = list(self.iter_ranges())
         return self.colors_ranges
 
+    def iter_ranges(self):
+        """Yields the colors ranges of the strings, ordered by offset, as they are found."""
+        if self.use_strings_binary:
+            strings = self.__iter_strings_binary()
+        else:
+            strings = self.__iter_strings()
+        for offset, length, detected_string in strings:
+            yield ColorRange(offset, length, self.__next_color(), detected_string)
+
+    def __iter_strings(self):
+        with map_file(self.path) as (data, _):
+            yield from extract_strings(data, self.min_length)
+
+    def __iter_strings_binary(self):
+        # both `strings` run concurrently, their outputs being merged by offset as they are read:
+        # a process can only get ahead of the other one by the size of its pipe buffer.
+        processes = [subprocess.Popen(['strings', *options, '-n', str(self.min_length), '-td', str(Path(self.path))],
+                                      stdout=subprocess.PIPE)
+                     for options in (['-a'], ['-a', '-el'])]
+        try:
+            yield from heapq.merge(self.__read_strings_output(processes[0], 1),
+                                   self.__read_strings_output(processes[1], 2))
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    # the consumer stopped early
+                    process.kill()
+                process.stdout.close()
+                process.wait()
+
+    @staticmethod
+    def __read_strings_output(process, char_size):
+        # each line is `offset string`, the offset being right-aligned on 7 characters.
+        # `strings` output is ASCII-encoded: the length of an UTF-16LE string is char_size * len(detected_string)
+        for curline in process.stdout:
+            offset, _, detected_string = curline.rstrip(b'\n').lstrip(b' ').partition(b' ')
+            if detected_string:
+                yield int(offset), char_size * len(detected_string), detected_string.decode('ascii', errors='replace')
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+
 def parse_args(args):
     parser = argparse.ArgumentParser(description="Strings parser")
     parser.add_argument("-i", "--input", help="path to some file", type=str)
     parser.add_argument("-o", "--output", help="path to output file (colors ranges). Each line contains 'offset_start,count,color'", type=str)
+    parser.add_argument("-n", "--min-length", help="minimum number of characters of a string", type=int, default=4)
+    parser.add_argument("-b", "--strings-binary", help="run the `strings` tool instead of the builtin extractor",
+                        action="store_true")
     parser.add_argument("-v", "--verbose", dest="loglevel", help="set loglevel to INFO",
                         action="store_const", const=logging.INFO)
     parser.add_argument("-vv", "--very-verbose", dest="loglevel", help="set loglevel to DEBUG",
@@ -97,11 +188,10 @@ def main(args):
     args = parse_args(args)
     setup_logging(args.loglevel)
     colors = 'red green yellow blue magenta cyan light_red light_green light_yellow light_blue light_magenta light_cyan'.split()
-    strings_colorer = StringsColorer(args.input, colors)
+    strings_colorer = StringsColorer(args.input, colors, args.min_length, args.strings_binary)
     if strings_colorer.check():
-        colors = strings_colorer.parse()
         with open(args.output, 'w') as fd:
-            for c in colors:
+            for c in strings_colorer.iter_ranges():
                 fd.write(str(c) + '\n')
 
 def run():
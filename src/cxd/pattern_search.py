@@ -0,0 +1,197 @@
+"""
+Search of many hex or regex patterns in one pass over the data.
+"""
+
+import logging
+import re
+from pathlib import Path
+
+from cxd import colored_hex_dump
+from cxd.color_range import ColorRange
+from cxd.data_source import map_file, release_pages
+
+__author__ = "malware4n6"
+__copyright__ = "malware4n6"
+__license__ = "The Unlicense"
+
+_logger = logging.getLogger(__name__)
+
+
+# a regex pattern starts with this prefix, any other pattern is hex (eg. '4D 5A ?? 00', ?? matching any byte)
+REGEX_PREFIX = 're:'
+# size of the blocks of data searched at once
+CHUNK_SIZE = 4 * 1024 * 1024
+# each block is searched with the MAX_MATCH_LENGTH bytes following it, so that the matches
+# crossing its end are found. Longer regex matches starting just before the end of a block may be missed.
+MAX_MATCH_LENGTH = 64 * 1024
+# the regex patterns matching an empty string in this data are rejected
+EMPTY_MATCH_PROBE = bytes(range(256))
+# the literal patterns are found from their first bytes (at most this number)
+PREFIX_LENGTH = 3
+# a few literals are found faster by searching each of them than with NumPy
+NUMPY_MIN_LITERALS = 8
+
+
+def parse_pattern(pattern: str):
+    """Returns the bytes of a hex pattern, or the compiled regex of a regex pattern
+    (or of a hex pattern with ?? wildcards). Raises ValueError if the pattern is incorrect."""
+    if pattern.startswith(REGEX_PREFIX):
+        try:
+            regex = re.compile(pattern[len(REGEX_PREFIX):].encode(), re.DOTALL)
+        except re.error as exc:
+            raise ValueError(f'incorrect regex pattern {pattern}: {exc}') from exc
+        # a regex matching empty strings would be tried at (almost) every offset, for no range
+        if regex.fullmatch(b'') is not None or any(m.start() == m.end() for m in regex.finditer(EMPTY_MATCH_PROBE)):
+            raise ValueError(f'incorrect regex pattern {pattern}: it matches an empty string')
+        return regex
+    digits = ''.join(pattern.split())
+    if not digits or len(digits) % 2:
+        raise ValueError(f'incorrect hex pattern {pattern}: an even number of hex digits is expected')
+    try:
+        parts = [b'.' if digits[i:i + 2] == '??' else re.escape(bytes.fromhex(digits[i:i + 2]))
+                 for i in range(0, len(digits), 2)]
+    except ValueError as exc:
+        raise ValueError(f'incorrect hex pattern {pattern}: {exc}') from exc
+    if b'.' in parts:
+        return re.compile(b''.join(parts), re.DOTALL)
+    literal = bytes.fromhex(digits)
+    if len(literal) > MAX_MATCH_LENGTH:
+        raise ValueError(f'incorrect hex pattern {pattern}: longer than {MAX_MATCH_LENGTH} bytes')
+    return literal
+
+
+class PatternSearch():
+    """Finds all the matches of a list of patterns (see parse_pattern), including overlapping ones,
+    reading the data once.
+
+    The literal patterns are found together from their first bytes: with NumPy, the first bytes
+    at each offset are looked up in a table, so the time hardly depends on the number of patterns
+    (without NumPy, each literal is searched in turn). The regex patterns are searched with
+    a single regex; at each offset where it matches, every regex pattern is tried.
+    """
+    def __init__(self, patterns) -> None:
+        self.patterns = list(patterns)
+        assert self.patterns
+        parsed = [parse_pattern(pattern) for pattern in self.patterns]
+        self.literals = [(literal, i) for i, literal in enumerate(parsed) if isinstance(literal, bytes)]
+        self.regexes = [(regex, i) for i, regex in enumerate(parsed) if not isinstance(regex, bytes)]
+        self.use_numpy = len(self.literals) >= max(1, NUMPY_MIN_LITERALS) and colored_hex_dump._load_numpy()
+        if self.use_numpy:
+            np = colored_hex_dump.np
+            self.__prefix_length = min(PREFIX_LENGTH, min(len(literal) for literal, _ in self.literals))
+            # {first bytes: [(literal, index)]}
+            self.__by_prefix = {}
+            for literal, i in self.literals:
+                self.__by_prefix.setdefault(literal[:self.__prefix_length], []).append((literal, i))
+            self.__prefixes_table = np.zeros(1 << 8 * self.__prefix_length, dtype=bool)
+            self.__prefixes_table[[int.from_bytes(prefix, 'big') for prefix in self.__by_prefix]] = True
+            # the offsets are first filtered with a smaller table (of the first 2 bytes), which stays in the CPU cache
+            self.__short_table = np.zeros(1 << 8 * min(2, self.__prefix_length), dtype=bool)
+            self.__short_table[[int.from_bytes(prefix[:2], 'big') for prefix in self.__by_prefix]] = True
+        # matches where any regex pattern matches
+        self.__regex = re.compile(b'|'.join(b'(?:' + regex.pattern + b')' for regex, _ in self.regexes),
+                                  re.DOTALL) if self.regexes else None
+
+    def __literals_matches(self, block: bytes, count: int) -> list:
+        # (offset, length, index) of the literals starting in block[:count]
+        np = colored_hex_dump.np
+        length = self.__prefix_length
+        count = min(count, len(block) - length + 1)
+        if count <= 0:
+            return []
+        array = np.frombuffer(block, dtype=np.uint8)
+        # the first bytes at each offset, as a big endian integer
+        keys = array[:count].astype(np.uint32)
+        if length > 1:
+            keys <<= 8
+            keys |= array[1:count + 1]
+        offsets = np.flatnonzero(self.__short_table[keys])
+        if length > 2:
+            keys = keys[offsets] << 8 | array[offsets + 2]
+            offsets = offsets[self.__prefixes_table[keys]]
+        matches = []
+        for offset in offsets.tolist():
+            for literal, i in self.__by_prefix[block[offset:offset + length]]:
+                if block.startswith(literal, offset):
+                    matches.append((offset, len(literal), i))
+        return matches
+
+    def __find_literals(self, block: bytes, count: int) -> list:
+        # same as __literals_matches without NumPy: each literal is searched in turn
+        matches = []
+        for literal, i in self.literals:
+            offset = block.find(literal, 0, count + len(literal) - 1)
+            while offset >= 0:
+                matches.append((offset, len(literal), i))
+                offset = block.find(literal, offset + 1, count + len(literal) - 1)
+        return matches
+
+    def __regexes_matches(self, data, start: int, end: int, block_end: int, complete: bool) -> list:
+        # (offset, length, index) of the patterns searched with the regex starting in data[start:end],
+        # the data being matched until block_end. Unless it is the end of data (complete), the matches
+        # reaching block_end are matched again until the end of data
+        matches = []
+        position = start
+        while True:
+            m = self.__regex.search(data, position, block_end)
+            if m is None or m.start() >= end:
+                return matches
+            offset = m.start()
+            for regex, i in self.regexes:
+                match = regex.match(data, offset, block_end)
+                if match is not None and match.end() == block_end and not complete:
+                    match = regex.match(data, offset)
+                if match is not None and match.end() > offset:
+                    matches.append((offset, match.end() - offset, i))
+            position = offset + 1
+
+    def iter_matches(self, data, base: int = 0, start: int = None, end: int = None):
+        """Yields (offset, length, pattern index) for each match starting in [start, end),
+        ordered by offset then pattern index.
+
+        `data` holds the bytes [base, base + len(data)), all of them being available to the matches.
+        The data is read by blocks of CHUNK_SIZE bytes; the pages of a mmap are released once searched.
+        """
+        data_end = base + len(data)
+        start = base if start is None else max(start, base)
+        end = data_end if end is None else min(end, data_end)
+        view = memoryview(data)
+        for chunk_start in range(start, end, CHUNK_SIZE):
+            chunk_end = min(chunk_start + CHUNK_SIZE, end)
+            block_end = min(chunk_end + MAX_MATCH_LENGTH, data_end)
+            matches = []
+            if self.literals:
+                # bytes comparisons use memcmp, unlike the ones of memoryviews
+                block = bytes(view[chunk_start - base:block_end - base])
+                find = self.__literals_matches if self.use_numpy else self.__find_literals
+                matches += [(chunk_start + offset, length, i) for offset, length, i
+                            in find(block, chunk_end - chunk_start)]
+            if self.__regex is not None:
+                # the regexes see the data around the block (eg. for lookbehind assertions)
+                matches += [(base + offset, length, i) for offset, length, i
+                            in self.__regexes_matches(view, chunk_start - base, chunk_end - base,
+                                                      block_end - base, block_end == data_end)]
+            yield from sorted(matches)
+            release_pages(data, chunk_start - base, chunk_end - base)
+
+
+class PatternColorer():
+    """Colors the matches of patterns in a file, each pattern with a color,
+    the pattern being used as comment of its matches' ranges."""
+    def __init__(self, path, colors, patterns) -> None:
+        self.path = path
+        self.colors = colors
+        self.search = PatternSearch(patterns)
+
+    def parse(self, offset: int = 0, length: int = None) -> list:
+        """Returns the ranges of the matches overlapping the window [offset, offset + length)."""
+        ranges = []
+        patterns = self.search.patterns
+        with map_file(self.path) as (data, base):
+            start = max(0, offset - MAX_MATCH_LENGTH)
+            end = None if length is None else offset + length
+            for match_offset, match_length, i in self.search.iter_matches(data, base, start, end):
+                if match_offset + match_length > offset:
+                    ranges.append(ColorRange(match_offset, match_length, self.colors[i % len(self.colors)], patterns[i]))
+        _logger.info(f'{len(ranges)} matches of {len(patterns)} patterns found in {Path(self.path).name}')
+        return ranges
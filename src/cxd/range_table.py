@@ -0,0 +1,103 @@
+"""
+Compact, read-only table of colors ranges.
+"""
+
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from operator import add, lt
+
+from cxd.color_range import ColorRange
+
+__author__ = "malware4n6"
+__copyright__ = "malware4n6"
+__license__ = "The Unlicense"
+
+_logger = logging.getLogger(__name__)
+
+
+class RangeTable():
+    """Colors ranges stored as columns of machine integers instead of Python objects.
+
+    The ranges are sorted by (start, end), ranges with the same bounds keeping their
+    input order. Each range i is described by:
+      - starts[i] and ends[i]: its first offset and the first offset after it
+      - color_ids[i]: index of its color in self.colors (None being the color 0)
+      - comments[i]: its comment (or None)
+    max_ends[i] is the largest end of the ranges 0..i: it is sorted, so the ranges
+    overlapping an offset are found by bisecting both starts and max_ends.
+    """
+    def __init__(self, ranges=()) -> None:
+        ranges = ranges if isinstance(ranges, (list, tuple)) else list(ranges)
+        order = sorted(range(len(ranges)), key=lambda i: (ranges[i].start, ranges[i].end))
+        self.colors = [None]
+        self.comments = []
+        colors_ids = {None: 0}
+        self.starts, self.ends = array('q'), array('q')
+        self.color_ids = array('H')
+        for i in order:
+            cr = ranges[i]
+            color_id = colors_ids.get(cr.color)
+            if color_id is None:
+                color_id = colors_ids[cr.color] = len(self.colors)
+                self.colors.append(cr.color)
+            self.starts.append(cr.start)
+            self.ends.append(cr.end + 1)
+            self.color_ids.append(color_id)
+            self.comments.append(cr.comment)
+        self.max_ends = array('q', accumulate(self.ends, max))
+
+    @classmethod
+    def from_columns(cls, starts, lengths, color_ids, colors, comments):
+        """Builds a table from columns (eg. read from a ranges file) without creating ColorRange objects.
+
+        colors[0] must be None; comments[i] is the comment of the range i (or None).
+        """
+        assert colors[0] is None
+        ends = array('q', map(add, starts, lengths))
+        table = cls()
+        table.colors = list(colors)
+        if all(map(lt, starts, starts[1:])) \
+                or all(s0 < s1 or (s0 == s1 and e0 <= e1) for s0, s1, e0, e1 in zip(starts, starts[1:], ends, ends[1:])):
+            # already sorted (eg. written from a table)
+            table.starts, table.ends = array('q', starts), ends
+            table.color_ids = array('H', color_ids)
+            table.comments = list(comments)
+        else:
+            order = sorted(range(len(starts)), key=lambda i: (starts[i], ends[i]))
+            table.starts = array('q', (starts[i] for i in order))
+            table.ends = array('q', (ends[i] for i in order))
+            table.color_ids = array('H', (color_ids[i] for i in order))
+            table.comments = [comments[i] for i in order]
+        table.max_ends = array('q', accumulate(table.ends, max))
+        return table
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> ColorRange:
+        return ColorRange(self.starts[i], self.ends[i] - self.starts[i], self.colors[self.color_ids[i]],
+                          self.comments[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def begin(self) -> int:
+        # first offset covered by a range (0 if there are no ranges)
+        return self.starts[0] if self.starts else 0
+
+    def end(self) -> int:
+        # first offset after all the ranges (0 if there are no ranges)
+        return self.max_ends[-1] if self.max_ends else 0
+
+    def overlap(self, start: int, end: int) -> list:
+        """Indexes of the ranges overlapping [start, end), in the order of the table."""
+        lo = bisect_right(self.max_ends, start)
+        hi = bisect_left(self.starts, end)
+        return [i for i in range(lo, hi) if self.ends[i] > start]
+
+    def at(self, offset: int) -> list:
+        """Indexes of the ranges holding `offset`, in the order of the table."""
+        return self.overlap(offset, offset + 1)
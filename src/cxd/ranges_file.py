@@ -0,0 +1,138 @@
+"""
+Compact binary form of a list of colors ranges.
+
+Layout (little-endian):
+  - MAGIC, then the format version and the number of ranges n (<IQ)
+  - the table of the colors names: their count (<I), then each name as <B length + ASCII bytes
+  - padding up to a multiple of 8 bytes
+  - n starts (int64), n lengths (int64), n comments lengths (uint32, NO_COMMENT if None), n colors ids (uint8)
+  - the comments, UTF-8 encoded, concatenated
+"""
+
+import logging
+import struct
+import sys
+from array import array
+
+from cxd.color_range import ColorRange
+from cxd.range_table import RangeTable
+
+__author__ = "malware4n6"
+__copyright__ = "malware4n6"
+__license__ = "The Unlicense"
+
+_logger = logging.getLogger(__name__)
+
+
+MAGIC = b'CXDRANGE'
+FORMAT_VERSION = 1
+# color id of the ranges without color
+NO_COLOR = 0
+NO_COMMENT = 0xffffffff
+_HEADER = struct.Struct('<IQ')
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def is_ranges_file(data) -> bool:
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def dump_ranges(ranges, fd) -> None:
+    """Writes `ranges` (ColorRange) in the binary file object `fd`.
+    Raises ValueError if they have more than 255 colors."""
+    colors = [None]
+    colors_ids = {None: NO_COLOR}
+    starts, lengths, comments_lengths, ids = array('q'), array('q'), array('I'), array('B')
+    comments = []
+    for r in ranges:
+        color_id = colors_ids.get(r.color)
+        if color_id is None:
+            if len(colors) == 256:
+                # the colors ids are stored as uint8
+                raise ValueError('too many colors (at most 255)')
+            color_id = colors_ids[r.color] = len(colors)
+            colors.append(r.color)
+        starts.append(r.start)
+        lengths.append(r.length)
+        ids.append(color_id)
+        if r.comment is None:
+            comments_lengths.append(NO_COMMENT)
+        else:
+            comment = str(r.comment).encode('utf-8')
+            comments_lengths.append(len(comment))
+            comments.append(comment)
+    header = bytearray(MAGIC + _HEADER.pack(FORMAT_VERSION, len(starts)))
+    header += struct.pack('<I', len(colors) - 1)
+    for color in colors[1:]:
+        name = color.encode('ascii')
+        header += struct.pack('<B', len(name)) + name
+    header += bytes(-len(header) % 8)
+    fd.write(header)
+    for values in (starts, lengths, comments_lengths, ids):
+        fd.write(_little_endian(values).tobytes())
+    fd.write(b''.join(comments))
+
+
+def _load_columns(data):
+    # returns the starts, lengths, colors ids, colors names and comments stored in `data`
+    if not is_ranges_file(data):
+        raise ValueError('not a ranges file')
+    pos = len(MAGIC)
+    if len(data) < pos + _HEADER.size + 4:
+        raise ValueError('truncated ranges file')
+    version, count = _HEADER.unpack_from(data, pos)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'unsupported ranges file version {version}')
+    pos += _HEADER.size
+    nb_colors, = struct.unpack_from('<I', data, pos)
+    pos += 4
+    colors = [None]
+    for _ in range(nb_colors):
+        if pos >= len(data) or pos + 1 + data[pos] > len(data):
+            raise ValueError('truncated ranges file')
+        size = data[pos]
+        colors.append(bytes(data[pos + 1:pos + 1 + size]).decode('ascii'))
+        pos += 1 + size
+    pos += -pos % 8
+    columns = []
+    for typecode in ('q', 'q', 'I', 'B'):
+        values = array(typecode)
+        if pos + count * values.itemsize > len(data):
+            raise ValueError('truncated ranges file')
+        values.frombytes(data[pos:pos + count * values.itemsize])
+        columns.append(_little_endian(values))
+        pos += count * values.itemsize
+    starts, lengths, comments_lengths, ids = columns
+    blob = bytes(data[pos:])
+    if sum(length for length in comments_lengths if length != NO_COMMENT) > len(blob):
+        raise ValueError('truncated ranges file')
+    # slicing a str is cheaper than decoding each comment
+    text = blob.decode('ascii') if blob.isascii() else None
+    comments = []
+    pos = 0
+    for comment_length in comments_lengths:
+        if comment_length == NO_COMMENT:
+            comments.append(None)
+        else:
+            comments.append(text[pos:pos + comment_length] if text is not None
+                            else blob[pos:pos + comment_length].decode('utf-8'))
+            pos += comment_length
+    return starts, lengths, ids, colors, comments
+
+
+def load_ranges(data) -> list:
+    """Returns the list of ColorRange stored in `data` (bytes-like, eg. a mmap) by dump_ranges."""
+    starts, lengths, ids, colors, comments = _load_columns(data)
+    return [ColorRange(start, length, colors[color_id], comment)
+            for start, length, color_id, comment in zip(starts, lengths, ids, comments)]
+
+
+def load_range_table(data) -> RangeTable:
+    """Returns the RangeTable of the ranges stored in `data` by dump_ranges, without creating ColorRange objects."""
+    return RangeTable.from_columns(*_load_columns(data))
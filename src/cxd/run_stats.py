@@ -0,0 +1,120 @@
+"""
+Statistics of a run of cxd (see --stats): time and memory of its stages, and counters.
+"""
+
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+__author__ = "malware4n6"
+__copyright__ = "malware4n6"
+__license__ = "The Unlicense"
+
+_logger = logging.getLogger(__name__)
+
+
+class RunStats():
+    """Measures the wall time, the CPU time and the peak of the memory allocated by Python
+    (with tracemalloc) of each stage of a run, and counts events (bytes rendered, range lookups...).
+
+    The stages are measured by the callers (see stage and timed) and the counters are updated
+    per call or per block of lines, never per byte: when no RunStats is given, nothing is measured.
+    A stage entered several times accumulates its times. The memory of the mapped files is not
+    allocated by Python: the peak resident set size of the process is reported too.
+    """
+    def __init__(self, trace_memory: bool = True) -> None:
+        # {stage: [wall seconds, CPU seconds, peak bytes (None if not traced), calls]}, by order of first call
+        self.stages = {}
+        # {counter: value}
+        self.counters = {}
+        # tracing the allocations slows down Python: it can be disabled to only measure the times
+        self.trace_memory = trace_memory
+        # the tracing is stopped by close only if it was started here
+        self.__started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if self.__started_tracing:
+            tracemalloc.start()
+
+    def close(self):
+        """Stops tracing the allocations if it was started by this RunStats (the stages are no longer measured)."""
+        if self.__started_tracing:
+            tracemalloc.stop()
+            self.__started_tracing = False
+        self.trace_memory = False
+
+    def __record(self, name: str) -> list:
+        return self.stages.setdefault(name, [0.0, 0.0, None, 0])
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measures the code run in the context as the stage `name`."""
+        record = self.__record(name)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield self
+        finally:
+            record[0] += time.perf_counter() - wall
+            record[1] += time.process_time() - cpu
+            record[3] += 1
+            if self.trace_memory:
+                record[2] = max(record[2] or 0, tracemalloc.get_traced_memory()[1])
+
+    def timed(self, function, name: str):
+        """Returns function, its calls being measured as the stage `name` (times only: it may be
+        called within another stage, whose peak of memory includes it)."""
+        record = self.__record(name)
+
+        def measured(*args, **kwargs):
+            wall, cpu = time.perf_counter(), time.process_time()
+            result = function(*args, **kwargs)
+            record[0] += time.perf_counter() - wall
+            record[1] += time.process_time() - cpu
+            record[3] += 1
+            return result
+        return measured
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self) -> dict:
+        stages = {name: {'wall_seconds': round(wall, 6), 'cpu_seconds': round(cpu, 6),
+                         'peak_memory': peak, 'calls': calls}
+                  for name, (wall, cpu, peak, calls) in self.stages.items()}
+        return {'stages': stages, 'counters': dict(self.counters), 'peak_rss': peak_rss()}
+
+    def format(self, output_format: str = 'text') -> str:
+        """Returns the statistics as a table ('text') or as a JSON object ('json')."""
+        if output_format == 'json':
+            return json.dumps(self.as_dict()) + '\n'
+        lines = [f'{"stage":<16} {"wall (s)":>10} {"cpu (s)":>10} {"peak memory":>12} {"calls":>7}']
+        for name, (wall, cpu, peak, calls) in self.stages.items():
+            memory = '-' if peak is None else format_size(peak)
+            lines.append(f'{name:<16} {wall:>10.3f} {cpu:>10.3f} {memory:>12} {calls:>7}')
+        lines += [f'{name:<16} {value:>10}' for name, value in self.counters.items()]
+        rss = peak_rss()
+        if rss is not None:
+            lines.append(f'{"peak rss":<16} {format_size(rss):>10}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GiB'
+
+
+def peak_rss():
+    """Returns the peak resident set size of the process in bytes (None if it is not available)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
@@ -1,12 +1,31 @@
+import html
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+from importlib.metadata import EntryPoint
+from pathlib import Path
 import pytest
+import termcolor
 
 __author__ = "malware4n6"
 __copyright__ = "malware4n6"
 __license__ = "MIT"
 
-from cxd.colored_hex_dump import ColoredHexDump
+from cxd.colored_hex_dump import ColoredHexDump, _build_color_runs
+from cxd.colors_file import read_colors_ranges, write_colors_ranges
 from cxd.color_range import ColorRange
 from cxd.main import main
+from cxd.parser_cache import ParserCache
+from cxd.range_table import RangeTable
+from cxd.ranges_file import dump_ranges, load_ranges
+from cxd.parsers import parser_strings
+from cxd.parsers.parser_strings import StringsColorer, extract_strings
 
 data = b'\xc4\xc0q"\x8e\xb4\xc9\x94\x06\x01\x1e0\xca\x15*\x03/L1Ku\x9d1\x16\xe7\x84\xf7^\x90\x161\x89\xc4\xa4[\x9c\r\xf4\xc0\xf1\nf\xa7\xa0\xcd\x85c\x8bw\xa1'
 
@@ -44,11 +63,49 @@ expected_from_file = '''00000000\t1F C1 2F 70 06 81 06 9D 50 19 89 8B 17 A7 CA E
 000001f0\t19 46 A1 5E                                     \t.F.^'''.replace('\n', '')
 
 
+@pytest.fixture
+def force_color(monkeypatch):
+    # termcolor only colors a TTY and caches its decision
+    monkeypatch.delenv('NO_COLOR', raising=False)
+    monkeypatch.delenv('ANSI_COLORS_DISABLED', raising=False)
+    monkeypatch.setenv('FORCE_COLOR', '1')
+    termcolor.termcolor.can_colorize.cache_clear()
+    yield
+    termcolor.termcolor.can_colorize.cache_clear()
+
+def strip_escapes(text):
+    return re.sub('\x1b\\[[0-9;]*m', '', text)
+
+
 def test_color_range():
     cr = ColorRange(0, 20, 'blue', 'foobar')
     assert str(cr) == '0,20,blue,foobar'
     cr = ColorRange(0, 0x20, 'blue', 'foobar')
     assert str(cr) == '0,32,blue,foobar'
+    assert not hasattr(cr, '__dict__')
+
+def test_range_table():
+    ranges = [ColorRange(10, 5, 'red', 'a'), ColorRange(0, 100, 'green'), ColorRange(10, 5, 'blue'),
+              ColorRange(50, 0, 'red'), ColorRange(12, 1, None, 'b')]
+    table = RangeTable(ranges)
+    assert [str(r) for r in table] == ['0,100,green,', '10,5,red,a', '10,5,blue,', '12,1,,b', '50,0,red,']
+    assert (table.begin(), table.end()) == (0, 100)
+    for start, end in ((0, 1), (9, 11), (12, 13), (15, 50), (50, 51), (99, 200), (100, 200)):
+        assert table.overlap(start, end) == [i for i, r in enumerate(table) if r.start < end and r.end >= start
+                                             and r.length > 0]
+    assert table.at(12) == [0, 1, 2, 3]
+    assert _build_color_runs(table) == _build_color_runs(ranges) == ([0], [100], ['green'])
+    assert _build_color_runs(table, False) == ([0, 10, 13, 15], [10, 12, 15, 100], ['green', 'blue', 'blue', 'green'])
+
+def test_color_runs():
+    ranges = [ColorRange(0, 8, 'red'),
+                ColorRange(2, 2, 'green'),
+                ColorRange(6, 6, 'blue'),
+                ColorRange(20, 4)]
+    assert _build_color_runs(ranges, True) == ([0, 8], [8, 12], ['red', 'blue'])
+    assert _build_color_runs(ranges, False) == ([0, 2, 4, 6], [2, 4, 6, 12], ['red', 'green', 'red', 'blue'])
+    assert _build_color_runs([ColorRange(0, 4, 'red'), ColorRange(4, 4, 'red')]) == ([0], [8], ['red'])
+    assert _build_color_runs([]) == ([], [], [])
 
 def test_bad_params():
     ranges = [ColorRange(0, 4, 'red'),
@@ -128,3 +185,491 @@ def test_file(capsys):
     captured = capsys.readouterr()
     assert expected_from_file in captured.out.replace('\n', '')
 
+
+def test_merge_escapes(capsys, force_color):
+    ranges = [ColorRange(0, 4, 'red'),
+                ColorRange(4, 4, 'green'),
+                ColorRange(8, 4, 'blue')]
+    ColoredHexDump(ranges=ranges, merge_escapes=False).print(data)
+    legacy = capsys.readouterr().out
+    ColoredHexDump(ranges=ranges, merge_escapes=True).print(data)
+    merged = capsys.readouterr().out
+    assert '\x1b[31mC4\x1b[0m \x1b[31mC0\x1b[0m ' in legacy
+    assert '\x1b[31mC4 C0 71 22\x1b[0m \x1b[32m8E B4 C9 94\x1b[0m ' in merged
+    assert merged.count('\x1b') < legacy.count('\x1b')
+    assert strip_escapes(merged) == strip_escapes(legacy)
+
+def test_replace_not_printable(capsys):
+    cxd = ColoredHexDump(chunk_length=16, replace_not_printable='·')
+    cxd.print(data)
+    assert '00000000\tC4 C0 71 22 8E B4 C9 94 06 01 1E 30 CA 15 2A 03 \t··q"·······0··*·' in capsys.readouterr().out
+    cxd = ColoredHexDump(chunk_length=16, replace_not_printable='█')
+    cxd.print(data)
+    assert '00000000\tC4 C0 71 22 8E B4 C9 94 06 01 1E 30 CA 15 2A 03 \t██q"███████0██*█' in capsys.readouterr().out
+
+def test_print_file_matches_print(capsys, tmp_path):
+    content = data + bytes(200) + data * 100
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(content)
+    for chunk_length in (16, 20):
+        cxd = ColoredHexDump(ranges=[ColorRange(4090, 20, 'red')], chunk_length=chunk_length)
+        cxd.print(content)
+        expected = capsys.readouterr().out
+        cxd.print_file(path)
+        assert capsys.readouterr().out == expected
+        assert '\t*\n' in expected
+    empty = tmp_path / 'empty.bin'
+    empty.write_bytes(b'')
+    ColoredHexDump(show_columns_name_at_start=False, show_columns_name_at_end=False).print_file(empty)
+    assert capsys.readouterr().out == ''
+
+def test_window(capsys, tmp_path):
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(bytes(100000) + data)
+    ranges = [ColorRange(0, 4, 'red'), ColorRange(100000, 4, 'green')]
+    cxd = ColoredHexDump(ranges=ranges, address_shift=0x1000, show_columns_name_at_start=False,
+                        show_columns_name_at_end=False)
+    cxd.print_file(path, offset=100000, length=20)
+    assert capsys.readouterr().out == ('000196a0\tC4 C0 71 22 8E B4 C9 94 06 01 1E 30 CA 15 2A 03 \t..q".......0..*.\n'
+                                       '000196b0\t2F 4C 31 4B                                     \t/L1K\n')
+    cxd.print(bytes(100000) + data, offset=100000, length=20)
+    assert capsys.readouterr().out.startswith('000196a0\tC4 C0 71 22')
+    cxd.print_file(path, offset=200000)
+    assert capsys.readouterr().out == ''
+
+def test_main_window(capsys):
+    main(['-d', './tests/random.bin', '--offset', '0x1e0', '--lines', '1'])
+    captured = capsys.readouterr()
+    assert '000001e0\t22 1A 29 9F 2A 05 46 13 CD C2 15 5A 8A 7D 65 5F \t".).*.F....Z.}e_' in captured.out
+    assert '000001f0' not in captured.out
+
+def test_parallel(capsys, caplog, tmp_path, monkeypatch):
+    # small segments so that zero lines and ranges cross the segments borders
+    monkeypatch.setattr(ColoredHexDump, 'PARALLEL_SEGMENT', 64)
+    content = data + bytes(300) + data + bytes(40) + data * 3 + bytes(64)
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(content)
+    ranges = [ColorRange(40, 200, 'red'), ColorRange(500, 30, 'green')]
+    for chunk_length in (16, 24):
+        cxd = ColoredHexDump(ranges=ranges, chunk_length=chunk_length)
+        cxd.print_file(path)
+        expected = capsys.readouterr().out
+        cxd.print_file(path, jobs=3)
+        assert capsys.readouterr().out == expected
+    main(['-d', str(path), '-j', '-4'])
+    assert capsys.readouterr().out == '' and 'Jobs must be positive' in caplog.text
+
+def test_numpy_renderer(capsys, force_color, monkeypatch):
+    pytest.importorskip('numpy')
+    monkeypatch.setattr(ColoredHexDump, 'NUMPY_BLOCK_LINES', 2)
+    monkeypatch.setattr(ColoredHexDump, 'NUMPY_MIN_SIZE', 0)
+    content = data + bytes(100) + data + b'\x00' * 7
+    ranges = [ColorRange(0, 4, 'red'), ColorRange(2, 40, 'green'), ColorRange(100, 60, 'blue')]
+    for merge_escapes in (True, False):
+        for chunk_length in (16, 7):
+            ColoredHexDump(ranges=ranges, chunk_length=chunk_length, merge_escapes=merge_escapes,
+                           use_numpy=False).print(content)
+            expected = capsys.readouterr().out
+            ColoredHexDump(ranges=ranges, chunk_length=chunk_length, merge_escapes=merge_escapes,
+                           use_numpy=True).print(content)
+            assert capsys.readouterr().out == expected
+
+def test_strings(tmp_path, monkeypatch):
+    monkeypatch.setattr(parser_strings, 'CHUNK_SIZE', 16)
+    content = b'\x01 abc\x00\x02' + 'wide string'.encode('utf-16-le') + b'\xffxyzA\x00B\x00C\x00D\x00' + b'x' * 40
+    assert list(extract_strings(content)) == [(1, 4, ' abc'), (7, 22, 'wide string'), (30, 4, 'xyzA'),
+                                              (33, 8, 'ABCD'), (41, 40, 'x' * 40)]
+    assert [s for _, _, s in extract_strings(content, 5)] == ['wide string', 'x' * 40]
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(content)
+    colorer = StringsColorer(str(path), ['red', 'green'])
+    assert colorer.check()
+    assert [str(r) for r in colorer.parse()[:2]] == ['1,4,red, abc', '7,22,green,wide string']
+
+@pytest.mark.skipif(shutil.which('strings') is None, reason='strings is not installed')
+def test_strings_binary():
+    native = StringsColorer('./tests/random.bin', ['red', 'green'])
+    binary = StringsColorer('./tests/random.bin', ['red', 'green'], use_strings_binary=True)
+    ranges = binary.iter_ranges()
+    assert next(ranges).start == next(native.iter_ranges()).start
+    ranges.close()
+    assert [str(r) for r in binary.parse()] == [str(r) for r in native.parse()]
+
+def test_pe_fast_load(tmp_path):
+    pytest.importorskip('pefile')
+    from cxd.parsers.parser_pe import PeColorer
+    # headers of a PE32+ without sections nor data directories
+    dos_header = b'MZ' + bytes(58) + struct.pack('<I', 0x40)
+    file_header = struct.pack('<HHIIIHH', 0x8664, 0, 0, 0, 0, 240, 0x22)
+    optional_header = struct.pack('<HBBIIIIIQIIHHHHHHIIIIHHQQQQII', 0x20b, 1, 0, 0, 0, 0, 0x1000, 0x1000, 0x140000000,
+                                  0x1000, 0x200, 6, 0, 0, 0, 6, 0, 0, 0x2000, 0x200, 0, 3, 0, 0x100000, 0x1000,
+                                  0x100000, 0x1000, 0, 16) + bytes(16 * 8)
+    path = tmp_path / 'sample.exe'
+    path.write_bytes((dos_header + b'PE\0\0' + file_header + optional_header).ljust(0x200, b'\0'))
+    fast, full = PeColorer(str(path), ['red', 'green']), PeColorer(str(path), ['red', 'green'], fast_load=False)
+    assert fast.check() and full.check()
+    ranges = [str(r) for r in fast.parse()]
+    assert ranges == [str(r) for r in full.parse()]
+    assert ranges[0] == '0,2,red,DOS_HEADER.e_magic'
+    assert ranges[18] == '60,4,red,DOS_HEADER.e_lfanew'
+    assert ranges[-1] == '192,4,red,OPTIONAL_HEADER.LoaderFlags'
+
+def test_ranges_file():
+    ranges = [ColorRange(0, 4, 'red', 'DOS_HEADER.e_magic'), ColorRange(2, 1), ColorRange(2**40, 3, 'light_blue', 'é,€')]
+    fd = io.BytesIO()
+    dump_ranges(ranges, fd)
+    assert [str(r) for r in load_ranges(fd.getvalue())] == [str(r) for r in ranges]
+    with pytest.raises(ValueError):
+        load_ranges(b'0,4,red')
+    ranges = [ColorRange(i * 16, 4, 'red', f'range {i}') for i in range(10)]
+    fd = io.BytesIO()
+    dump_ranges(ranges, fd)
+    with pytest.raises(ValueError, match='too many colors'):
+        dump_ranges([ColorRange(i, 1, f'color{i}') for i in range(256)], io.BytesIO())
+    # each truncation is detected, instead of loading less ranges
+    for size in range(8, len(fd.getvalue())):
+        with pytest.raises(ValueError, match='truncated ranges file'):
+            load_ranges(fd.getvalue()[:size])
+
+def test_parser_cache(tmp_path):
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(b'\x00hello world\x00')
+    cache = ParserCache(tmp_path / 'cache')
+    colorer = StringsColorer(str(path), ['red'])
+    assert [str(r) for r in cache.parse(colorer, 'strings')] == ['1,11,red,hello world']
+    assert (cache.hits, cache.misses) == (0, 1)
+    colorer.parse = None  # the parser must not run again
+    assert [str(r) for r in cache.parse(colorer, 'strings')] == ['1,11,red,hello world']
+    assert (cache.hits, cache.misses) == (1, 1)
+    key = cache.key(str(path), 'strings', StringsColorer.VERSION, ['red'], colorer.cache_params())
+    assert key != cache.key(str(path), 'strings', StringsColorer.VERSION + 1, ['red'])
+    # a corrupted or truncated entry is a miss
+    entry = cache.cache_dir / f'{key}.ranges'
+    for content in (b'CXDRANGE', entry.read_bytes()[:30]):
+        entry.write_bytes(content)
+        assert cache.get(key) is None
+    cache.invalidate(key)
+    assert cache.get(key) is None
+    for i in range(4):
+        cache.put(str(i), [ColorRange(i, 1, 'red')] * 100)
+        os.utime(cache.cache_dir / f'{i}.ranges', (i, i))
+    entry_size = (cache.cache_dir / '0.ranges').stat().st_size
+    cache.max_size = 2 * entry_size
+    cache.get('0')
+    cache.evict()
+    assert sorted(p.name for p in cache.cache_dir.iterdir()) == ['0.ranges', '3.ranges']
+    # the parameters of the parser are part of the key
+    misses = cache.misses
+    assert len(cache.parse(StringsColorer(str(path), ['red']), 'strings')) == 1
+    assert cache.parse(StringsColorer(str(path), ['red'], min_length=12), 'strings') == []
+    assert cache.misses == misses + 2
+
+def test_colors_file(tmp_path, caplog):
+    path = tmp_path / 'colors.txt'
+    path.write_text('0,4,red\n0x10, 0x4 ,green,a comment, with a comma\n\n32,2\n40,2,,\nfoo,4,red\n48,4,purple\n'
+                    '64,010,blue,last')
+    table = read_colors_ranges(path, ColoredHexDump.ALLOWED_COLORS)
+    assert [str(r) for r in table] == ['0,4,red,', '16,4,green,a comment, with a comma', '32,2,,', '40,2,,',
+                                       '64,10,blue,last']
+    assert '2 incorrect lines ignored' in caplog.text
+    for name in ('colors.ranges', 'colors2.txt'):
+        write_colors_ranges(table, tmp_path / name)
+        assert [str(r) for r in read_colors_ranges(tmp_path / name)] == [str(r) for r in table]
+    assert (tmp_path / 'colors.ranges').read_bytes().startswith(b'CXDRANGE')
+    with pytest.raises(OSError):
+        read_colors_ranges(tmp_path / 'missing.txt')
+    # a corrupted binary file is reported instead of dumping the data without colors
+    for content in (b'CXDRANGE', (tmp_path / 'colors.ranges').read_bytes()[:40]):
+        (tmp_path / 'bad.ranges').write_bytes(content)
+        main(['-d', str(path), '-c', str(tmp_path / 'bad.ranges'), '-F', 'ansi'])
+        assert f'Colors ranges can not be read from {tmp_path / "bad.ranges"}: truncated ranges file' in caplog.text
+        caplog.clear()
+    # still available where it used to be
+    from cxd import main as cxd_main
+    assert [str(r) for r in cxd_main.read_colors_ranges(str(path))] == [str(r) for r in table]
+
+def test_parsers_registry(monkeypatch):
+    from cxd.parsers import loader
+    assert loader.load_parser('strings') is StringsColorer
+    assert loader.load_parser('nope') is None
+    entry_point = EntryPoint('foo', 'cxd.parsers.parser_strings:StringsColorer', loader.ENTRY_POINTS_GROUP)
+    monkeypatch.setattr(loader, 'entry_point_parsers', lambda: {'foo': entry_point})
+    assert loader.load_parser('foo') is StringsColorer
+    assert loader.available_parsers() == ['entropy', 'foo', 'pe', 'strings']
+    # all the builtin parsers, as before the registry
+    parsers = loader.load_parsers()
+    assert sorted(parsers) == ['entropy', 'pe', 'strings']
+    assert parsers['strings']['module'] is parser_strings and parsers['strings']['name'] == 'StringsColorer'
+
+def test_lazy_imports():
+    import cxd
+    code = 'import sys, cxd.main; print(*(m in sys.modules for m in ("numpy", "pefile", "importlib.metadata")))'
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(cxd.__file__)))
+    out = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+    assert out.split() == ['False', 'False', 'False']
+
+def test_skip_repeated_lines(capsys, tmp_path, monkeypatch, force_color):
+    monkeypatch.setattr(ColoredHexDump, 'NUMPY_MIN_SIZE', 0)
+    path = tmp_path / 'sparse.bin'
+    with path.open('wb') as fd:
+        fd.truncate(1 << 20)
+        fd.write(b'head' * 8)
+        fd.seek(0x80000)
+        fd.write(b'\xff' * 64 + b'tail')
+    lines = lambda: [line.split('\t')[:2] for line in strip_escapes(capsys.readouterr().out).splitlines()[1:-1]]
+    for use_numpy in (True, False):
+        ColoredHexDump(use_numpy=use_numpy).print_file(path)
+        assert [line[0] for line in lines()] == ['00000000', '00000010', '00000020', '00080000', '00080010',
+                                                 '00080020', '00080030', '00080040', '00080050', '000ffff0']
+        ColoredHexDump(use_numpy=use_numpy, hide_repeated_lines=True).print_file(path)
+        assert lines() == [['00000000', '68 65 61 64 ' * 4], ['00000010', '*'], ['00000020', '*'],
+                           ['00080000', 'FF ' * 16], ['00080010', '*'], ['00080040', '74 61 69 6C ' + '00 ' * 12],
+                           ['00080050', '*'], ['000ffff0', '00 ' * 16]]
+
+def test_diff(capsys, tmp_path, monkeypatch):
+    from cxd import binary_diff
+    monkeypatch.setattr(binary_diff, 'DIFF_BLOCK', 8)
+    content = bytes(range(256))
+    a, b = tmp_path / 'a.bin', tmp_path / 'b.bin'
+    a.write_bytes(content)
+    b.write_bytes(content[:0x15] + b'XY' + content[0x17:0x90] + b'Z' + content[0x91:] + b'end')
+    differences = binary_diff.iter_differences(a.read_bytes(), 0, b.read_bytes(), 0, 0, 256, 259)
+    assert list(differences) == [(0x15, 0x17), (0x90, 0x91), (0x100, 0x103)]
+    main(['--diff', str(a), str(b), '-C', '1'])
+    lines = [line.split('\t')[0] for line in capsys.readouterr().out.splitlines()[1:-1]]
+    assert lines == [f'--- {a}', f'+++ {b}', '@@ 00000000 @@', ' 00000000', '-00000010', '+00000010', ' 00000020',
+                     '@@ 00000080 @@', ' 00000080', '-00000090', '+00000090', ' 000000a0',
+                     '@@ 000000f0 @@', ' 000000f0', '+00000100']
+    main(['--diff', str(a), str(a)])
+    assert capsys.readouterr().out == ''
+
+def test_pattern_search(caplog, tmp_path, monkeypatch, force_color):
+    from cxd import pattern_search
+    from cxd.pattern_search import PatternSearch, parse_pattern
+    assert parse_pattern('4d 5A') == b'MZ'
+    assert parse_pattern('4D ?? 00').match(b'M\xff\x00')
+    for pattern in ('4D5', '4G', '', 're:(', 're:A*', 're:x?', 're:\\b', 're:'):
+        with pytest.raises(ValueError):
+            parse_pattern(pattern)
+    monkeypatch.setattr(pattern_search, 'CHUNK_SIZE', 5)
+    content = b'xxAAAyMZ\x90\x00http://a.b/c AAz'
+    patterns = ['41 41', '41 41 41', '4D 5A ?? 00', 're:https?://[a-z./]+', 're:(?<=A)z']
+    expected = [(2, 2, 0), (2, 3, 1), (3, 2, 0), (6, 4, 2), (10, 12, 3), (23, 2, 0), (25, 1, 4)]
+    for min_literals in (0, 100):
+        monkeypatch.setattr(pattern_search, 'NUMPY_MIN_LITERALS', min_literals)
+        assert list(PatternSearch(patterns).iter_matches(content)) == expected
+        assert list(PatternSearch(patterns).iter_matches(content, 0, 3, 7)) == [(3, 2, 0), (6, 4, 2)]
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(content)
+    main(['-d', str(path), '-P', '4D 5A', '-P', 're:('])
+    assert 'incorrect regex pattern re:(' in caplog.text
+    caplog.set_level(logging.INFO)
+    main(['-d', str(path), '-P', '4D 5A', '-P', '41 41'])
+    assert '4 matches of 2 patterns found' in caplog.text
+
+def test_entropy(tmp_path, monkeypatch):
+    from cxd.parsers import parser_entropy
+    from cxd.parsers.parser_entropy import EntropyColorer
+    monkeypatch.setattr(parser_entropy, 'CHUNK_SIZE', 192)
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(bytes(512) + bytes(range(256)) * 2 + bytes(range(16)) * 32)
+    for use_numpy in (True, False):
+        colorer = EntropyColorer(str(path), [], window=256, step=64, use_numpy=use_numpy)
+        assert colorer.check()
+        assert [round(e, 3) for e in colorer.iter_entropies()][5:18] == [0, 2.276, 4.467, 6.471, 8, 8, 8, 8, 8, 7.5,
+                                                                         6.5, 5.311, 4]
+        assert [str(r) for r in colorer.parse()] == ['384,64,blue,entropy 2.0-4.0', '448,64,cyan,entropy 4.0-6.0',
+                                                     '512,64,green,entropy 6.0-7.0', '576,320,red,entropy 7.8-8.0',
+                                                     '896,64,light_red,entropy 7.5-7.8',
+                                                     '960,64,green,entropy 6.0-7.0', '1024,512,cyan,entropy 4.0-6.0']
+
+def test_pager(monkeypatch):
+    from cxd import pager
+    from cxd.pager import HexPager
+    monkeypatch.setattr(pager, 'CACHE_LINES', 6)
+    cxd = ColoredHexDump([ColorRange(0x20, 4, 'red')], address_shift=0x1000)
+    content = bytes(range(256)) * 4 + b'MZ'
+    view = HexPager(cxd, content, height=4)
+    addresses = lambda: [line.split('\t')[0] for line in map(strip_escapes, view.lines())]
+    assert addresses() == ['00001000', '00001010', '00001020', '00001030']
+    assert view.lines()[2] == cxd.format_lines(content, 0x20, 0x30)[0].rstrip('\n')
+    for action, argument, expected in (('page_down', None, 0x40), ('up', None, 0x30), ('end', None, 0x3d0),
+                                       ('goto', '0x1100', 0x100), ('goto', 'xyz', 0x100), ('search', '4D 5A', 0x3d0),
+                                       ('home', None, 0), ('search', '41', 0x40), ('next', None, 0x140),
+                                       ('next', None, 0x240), ('previous', None, 0x140)):
+        assert view.handle(action, argument)
+        assert view.top == expected
+        assert addresses()[0] == f'{0x1000 + expected:08x}'
+        assert len(view.cache) <= 6
+    assert view.match == 0x141 and 'Match at 00001141' in view.status()
+    assert view.handle(pager.KEYS[b'?']) and view.message == pager.HELP
+    assert view.handle(pager.KEYS.get(b'x')) and view.message == pager.UNKNOWN_KEY
+    assert not view.handle('quit')
+
+def test_html(tmp_path, monkeypatch):
+    monkeypatch.setattr(ColoredHexDump, 'NUMPY_MIN_SIZE', 0)
+    monkeypatch.setattr(ColoredHexDump, 'NUMPY_BLOCK_LINES', 2)
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(b'<a&b>' + bytes(48) + bytes(range(32, 64)) + b'xyz')
+    ranges = [ColorRange(0, 2, 'red', 'tag "open"'), ColorRange(3, 2, 'red'), ColorRange(0x40, 4, 'white', 'field')]
+    outputs = []
+    for use_numpy in (True, False):
+        output = tmp_path / f'dump{use_numpy}.html'
+        ColoredHexDump(ranges, use_numpy=use_numpy).write_html(str(path), str(output))
+        outputs.append(output.read_text())
+    assert outputs[0] == outputs[1]
+    page = outputs[0]
+    assert page.startswith('<!DOCTYPE html>') and page.endswith('</pre>\n</body>\n</html>\n')
+    assert '<span class=c1 title="tag &quot;open&quot;">3C 61</span> 26 <span class=c1>62 3E</span> ' in page
+    assert '<span class=c1>&lt;a</span>&amp;<span class=c1>b&gt;</span>' in page
+    # a titled range of the default color is wrapped too
+    assert '<span class=c7 title="field">2B 2C 2D 2E</span> 2F' in page
+    # the visible text is the plain dump
+    lines = html.unescape(re.sub('<[^>]*>', '', page.split('<pre class=cxd>\n')[1])).splitlines()
+    assert lines[1:6] == ['00000000\t3C 61 26 62 3E 00 00 00 00 00 00 00 00 00 00 00 \t<a&b>...........',
+                          '00000010\t*', '00000030\t00 00 00 00 00 20 21 22 23 24 25 26 27 28 29 2A \t..... !"#$%&\'()*',
+                          '00000040\t2B 2C 2D 2E 2F 30 31 32 33 34 35 36 37 38 39 3A \t+,-./0123456789:',
+                          '00000050\t3B 3C 3D 3E 3F 78 79 7A                         \t;<=>?xyz']
+
+def test_output_formats(capsys, tmp_path, monkeypatch):
+    monkeypatch.setattr(ColoredHexDump, 'NUMPY_MIN_SIZE', 0)
+    monkeypatch.setenv('NO_COLOR', '1')
+    termcolor.termcolor.can_colorize.cache_clear()
+    content = b'MZ\x90\x00' + bytes(range(0x41, 0x5b)) * 3 + bytes(64) + b'end'
+    ranges = [ColorRange(0, 2, 'red', 'magic'), ColorRange(1, 20, 'green'), ColorRange(40, 0, 'blue')]
+    outputs = {}
+    for output_format in ('auto', 'ansi', 'plain'):
+        for use_numpy in (True, False):
+            ColoredHexDump(ranges, output_format=output_format, use_numpy=use_numpy).print(content)
+            outputs[output_format, use_numpy] = capsys.readouterr().out
+    # the ansi format is colored even if NO_COLOR is set
+    assert '\x1b[' in outputs['ansi', True] and outputs['ansi', True] == outputs['ansi', False]
+    assert len(set(outputs.values()) - {outputs['ansi', True]}) == 1
+    assert outputs['auto', True] == strip_escapes(outputs['ansi', True])
+    ColoredHexDump(ranges, output_format='jsonl').print(content)
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert lines[0] == {'offset': 0, 'hex': '4d5a90004142434445464748494a4b4c', 'ascii': 'MZ..ABCDEFGHIJKL',
+                        'ranges': [0, 1]}
+    assert [line['ranges'] for line in lines[1:4]] == [[1], [], []]
+    assert lines[-3:] == [{'offset': 0x60, 'hidden': True},
+                          {'offset': 0x80, 'hex': '00' * 16, 'ascii': '.' * 16, 'ranges': []},
+                          {'offset': 0x90, 'hex': '0000656e64', 'ascii': '..end', 'ranges': []}]
+    # the colors ranges are not read for a plain dump
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(content)
+    main(['-d', str(path), '-c', str(tmp_path / 'missing.txt'), '-F', 'plain'])
+    assert capsys.readouterr().out == outputs['plain', False]
+
+def test_benchmarks(tmp_path, capsys):
+    import importlib.util
+    spec = importlib.util.spec_from_file_location('bench_cxd', Path(__file__).parent.parent / 'benchmarks' / 'bench_cxd.py')
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+    assert [bench.parse_size(x) for x in ('1K', '64m', '1G', '1000')] == [1024, 64 << 20, 1 << 30, 1000]
+    assert bench.format_size(16 << 20) == '16M'
+    cases = bench.list_cases(tmp_path, ['zeros', 'pe'], [4096], [0, 100])
+    names = [case['name'] for case in cases]
+    assert 'read_colors_ranges ranges=100' in names and 'print_file[ansi] pe 4K ranges=100' in names
+    assert 'PeColorer.parse pe 4K' in names and 'StringsColorer.parse pe 4K' in names
+    # the inputs are the same on every run
+    first = (tmp_path / 'pe-4K.bin').read_bytes()
+    (tmp_path / 'pe-4K.bin').unlink()
+    assert bench.generate_input(tmp_path, 'pe', 4096).read_bytes() == first
+    assert len(read_colors_ranges(str(tmp_path / 'ranges-100-4K.txt'))) == 100
+    for case in cases:
+        if case['operation'] in ('print', 'print_file', 'read_colors_ranges'):
+            assert bench.run_case(case)['seconds'] >= 0
+    assert capsys.readouterr().out == ''
+    results = {'a': {'seconds': 1.0, 'rss_kb': 100}, 'b': {'seconds': 1.0, 'rss_kb': 200}, 'c': {'seconds': 2.0, 'rss_kb': 1},
+               'd': {'seconds': 0.002, 'rss_kb': 1}, 'xxd': {'seconds': 2.0, 'rss_kb': 1, 'external': True}}
+    baseline = {name: {'seconds': 1.0, 'rss_kb': 100} for name in results}
+    baseline['a']['seconds'], baseline['d']['seconds'] = 0.9, 0.001
+    assert bench.compare(results, baseline, 0.2) == ['b', 'c']
+
+def test_stats(tmp_path, capsys):
+    import tracemalloc
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(data + bytes(64) + data)
+    colors = tmp_path / 'colors.txt'
+    colors.write_text('0,4,red\n16,4,blue\n')
+    profile = tmp_path / 'run.prof'
+    main(['-d', str(path), '-c', str(colors), '-F', 'ansi', '--stats', 'json', '--profile', str(profile)])
+    # the allocations are no longer traced once the statistics are printed
+    assert not tracemalloc.is_tracing()
+    captured = capsys.readouterr()
+    assert strip_escapes(captured.out).startswith('  Offset')
+    stats = json.loads(captured.err.splitlines()[-1])
+    assert list(stats['stages']) == ['ranges loading', 'range table', 'render', 'write']
+    assert stats['stages']['render']['peak_memory'] > 0 and stats['stages']['write']['peak_memory'] is None
+    # 11 lines, the 3 null lines being replaced by a snip
+    assert stats['counters'] == {'ranges loaded': 2, 'range lookups': 1, 'ranges resolved': 2, 'bytes rendered': 164,
+                                 'lines rendered': 8, 'lines snipped': 3, 'characters written': len(captured.out)}
+    assert 'cumulative' in captured.err and profile.stat().st_size > 0
+    # the counters are only updated when statistics are requested
+    cxd = ColoredHexDump()
+    cxd.print(data)
+    assert cxd.stats is None and capsys.readouterr().err == ''
+
+def test_iter_lines(tmp_path, capsys):
+    content = data * 2000
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(content)
+    for use_numpy in (False, True):
+        cxd = ColoredHexDump(use_numpy=use_numpy, output_format='plain', show_columns_name_at_start=False,
+                             show_columns_name_at_end=False)
+        cxd.print(content, 0x20, 70000)
+        expected = capsys.readouterr().out
+        with path.open('rb') as fd:
+            for source in (content, bytearray(content), memoryview(content), io.BytesIO(content), str(path), path, fd):
+                assert ''.join(cxd.iter_lines(source, 0x20, 0x20 + 70000)) == expected
+        lines = cxd.iter_lines(path)
+        assert next(lines).startswith('00000000\tC4 C0 71 22')
+        # the file is unmapped when the generator is closed
+        lines.close()
+        assert ''.join(cxd.iter_lines(content, len(content) + 16)) == ''
+    assert capsys.readouterr().out == ''
+
+def test_iter_lines_interleaved():
+    # each generator keeps the state of its output: the generators of an instance can be pulled in turn
+    content = data * 14000
+    ranges = [ColorRange(0x100, 0x200, 'red', 'header'), ColorRange(0x80010, 0x40, 'green'),
+              ColorRange(0x90000, 0x100, 'blue')]
+    windows = [(0, 0x20000, 'ansi'), (0x80000, 0xa0000, 'plain'), (0x80000, 0xa0000, 'jsonl'),
+               (0x80000, 0xa0000, 'ansi'), (0, 0x100, 'plain')]
+    for use_numpy in (False, True):
+        cxd = ColoredHexDump(ranges, use_numpy=use_numpy)
+        expected = [''.join(cxd.iter_lines(content, start, end, output_format)) for start, end, output_format in windows]
+        assert expected[0] != strip_escapes(expected[0]) and expected[3] != strip_escapes(expected[3])
+        # nothing is rendered before the first line is pulled
+        generators = [cxd.iter_lines(content, start, end, output_format) for start, end, output_format in windows]
+        outputs = [[] for _ in windows]
+        pending = list(range(len(windows)))
+        while pending:
+            for i in list(pending):
+                line = next(generators[i], None)
+                if line is None:
+                    pending.remove(i)
+                else:
+                    outputs[i].append(line)
+        assert [''.join(output) for output in outputs] == expected
+
+def test_stdin(tmp_path, capsys, monkeypatch):
+    content = data + bytes(100) + data * 3000 + bytes(40)
+    path = tmp_path / 'sample.bin'
+    path.write_bytes(content)
+    for options in (['-F', 'plain'], ['-F', 'jsonl', '-s', '0x30', '-l', '70000']):
+        main(['-d', str(path)] + options)
+        expected = capsys.readouterr().out
+        for data_option in (['-d', '-'], []):
+            monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(content)))
+            main(data_option + options)
+            assert capsys.readouterr().out == expected
+    # a pipe is read as the data arrives, by blocks of any size: the hidden lines are the same
+    monkeypatch.setattr(ColoredHexDump, 'STREAM_BLOCK', 1000)
+    cxd = ColoredHexDump(output_format='plain', hide_repeated_lines=True)
+    cxd.print(content)
+    expected = capsys.readouterr().out
+    with subprocess.Popen([sys.executable, '-c', f'import sys; sys.stdout.buffer.write(open({str(path)!r}, "rb").read())'],
+                          stdout=subprocess.PIPE) as process:
+        lines = ''.join(cxd.iter_lines(process.stdout))
+    assert cxd.format_columns_names() + lines + cxd.format_columns_names() == expected